@@ -0,0 +1,30 @@
+"""unfollow tombstones for the follow graph
+
+Revision ID: 03382a9e8bb0
+Revises: 6b8e2f4a1c07
+Create Date: 2026-10-16 23:21:18.449053
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '03382a9e8bb0'
+down_revision = '6b8e2f4a1c07'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_table('follow_tombstone',
+    sa.Column('id', sa.Integer(), nullable=False),
+    sa.Column('follower_id', sa.Integer(), nullable=False),
+    sa.Column('following_id', sa.Integer(), nullable=False),
+    sa.Column('deleted_at', sa.DateTime(), nullable=False),
+    sa.PrimaryKeyConstraint('id')
+    )
+
+
+def downgrade():
+    op.drop_table('follow_tombstone')
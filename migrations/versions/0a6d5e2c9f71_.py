@@ -0,0 +1,61 @@
+"""like/comment archive tables, range-partitioned by month on Postgres
+
+Revision ID: 0a6d5e2c9f71
+Revises: f3c61e08b5d4
+Create Date: 2026-10-16 19:52:26.774105
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '0a6d5e2c9f71'
+down_revision = 'f3c61e08b5d4'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    partitioned = op.get_bind().dialect.name == 'postgresql'
+    # the monthly partitions are added by archive.ensure_partitions() as rows arrive
+    partition_args = {'postgresql_partition_by': 'RANGE (created_at)'} if partitioned else {}
+    op.create_table('like_archive',
+    sa.Column('id', sa.Integer(), autoincrement=False, nullable=False),
+    sa.Column('created_at', sa.DateTime(), nullable=False),
+    sa.Column('user_id', sa.Integer(), nullable=False),
+    sa.Column('post_id', sa.Integer(), nullable=False),
+    sa.ForeignKeyConstraint(['post_id'], ['post.id'], ),
+    sa.ForeignKeyConstraint(['user_id'], ['user.id'], ),
+    sa.PrimaryKeyConstraint('id', 'created_at'),
+    **partition_args
+    )
+    op.create_index('ix_like_archive_post_id', 'like_archive', ['post_id'], unique=False)
+    op.create_index('ix_like_archive_user_id_post_id', 'like_archive', ['user_id', 'post_id'], unique=False)
+    op.create_table('comment_archive',
+    sa.Column('id', sa.Integer(), autoincrement=False, nullable=False),
+    sa.Column('created_at', sa.DateTime(), nullable=False),
+    sa.Column('content', sa.Text(), nullable=False),
+    sa.Column('user_id', sa.Integer(), nullable=False),
+    sa.Column('post_id', sa.Integer(), nullable=False),
+    sa.Column('client_token', sa.String(length=64), nullable=True),
+    sa.ForeignKeyConstraint(['post_id'], ['post.id'], ),
+    sa.ForeignKeyConstraint(['user_id'], ['user.id'], ),
+    sa.PrimaryKeyConstraint('id', 'created_at'),
+    **partition_args
+    )
+    op.create_index('ix_comment_archive_post_id_created_at_id', 'comment_archive', ['post_id', 'created_at', 'id'], unique=False)
+    op.create_index('ix_comment_archive_user_id_client_token', 'comment_archive', ['user_id', 'client_token'], unique=False)
+    if partitioned:
+        # catches rows outside every monthly partition instead of failing the move
+        op.execute('CREATE TABLE like_archive_default PARTITION OF like_archive DEFAULT')
+        op.execute('CREATE TABLE comment_archive_default PARTITION OF comment_archive DEFAULT')
+
+
+def downgrade():
+    op.drop_index('ix_comment_archive_user_id_client_token', table_name='comment_archive')
+    op.drop_index('ix_comment_archive_post_id_created_at_id', table_name='comment_archive')
+    op.drop_table('comment_archive')
+    op.drop_index('ix_like_archive_user_id_post_id', table_name='like_archive')
+    op.drop_index('ix_like_archive_post_id', table_name='like_archive')
+    op.drop_table('like_archive')
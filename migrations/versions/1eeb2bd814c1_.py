@@ -0,0 +1,29 @@
+"""rate limit buckets shared between workers
+
+Revision ID: 1eeb2bd814c1
+Revises: 0a6d5e2c9f71
+Create Date: 2026-10-16 22:55:27.361234
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '1eeb2bd814c1'
+down_revision = '0a6d5e2c9f71'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_table('rate_limit_bucket',
+    sa.Column('key', sa.String(length=200), nullable=False),
+    sa.Column('tokens', sa.Float(precision=53), nullable=False),
+    sa.Column('updated_at', sa.Float(precision=53), nullable=False),
+    sa.PrimaryKeyConstraint('key')
+    )
+
+
+def downgrade():
+    op.drop_table('rate_limit_bucket')
@@ -0,0 +1,37 @@
+"""media metadata
+
+Revision ID: 3524e445259e
+Revises: 1eeb2bd814c1
+Create Date: 2026-10-16 22:58:18.774211
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '3524e445259e'
+down_revision = '1eeb2bd814c1'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_table('media',
+    sa.Column('id', sa.Integer(), nullable=False),
+    sa.Column('url', sa.String(length=255), nullable=False),
+    sa.Column('status', sa.String(length=16), nullable=False),
+    sa.Column('width', sa.Integer(), nullable=True),
+    sa.Column('height', sa.Integer(), nullable=True),
+    sa.Column('bytes', sa.Integer(), nullable=True),
+    sa.Column('placeholder', sa.String(length=64), nullable=True),
+    sa.Column('thumbnails', sa.Text(), nullable=True),
+    sa.Column('error', sa.Text(), nullable=True),
+    sa.Column('processed_at', sa.DateTime(), nullable=False),
+    sa.PrimaryKeyConstraint('id'),
+    sa.UniqueConstraint('url')
+    )
+
+
+def downgrade():
+    op.drop_table('media')
@@ -0,0 +1,135 @@
+"""instagram models and denormalized counters
+
+Revision ID: 3c9e1f7a2b40
+Revises: a5cffa318ac2
+Create Date: 2026-10-16 09:12:44.318207
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '3c9e1f7a2b40'
+down_revision = 'a5cffa318ac2'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    # the new required columns are added nullable, filled in for existing users, then made NOT NULL
+    with op.batch_alter_table('user', schema=None) as batch_op:
+        batch_op.add_column(sa.Column('username', sa.String(length=30), nullable=True))
+        batch_op.add_column(sa.Column('full_name', sa.String(length=100), nullable=True))
+        batch_op.add_column(sa.Column('bio', sa.Text(), nullable=True))
+        batch_op.add_column(sa.Column('profile_picture', sa.String(length=255), nullable=True))
+        batch_op.add_column(sa.Column('website', sa.String(length=255), nullable=True))
+        batch_op.add_column(sa.Column('is_private', sa.Boolean(), nullable=True))
+        batch_op.add_column(sa.Column('created_at', sa.DateTime(), nullable=True))
+        batch_op.add_column(sa.Column('posts_count', sa.Integer(), server_default='0', nullable=False))
+        batch_op.add_column(sa.Column('followers_count', sa.Integer(), server_default='0', nullable=False))
+        batch_op.add_column(sa.Column('following_count', sa.Integer(), server_default='0', nullable=False))
+
+    user = sa.table('user', sa.column('id', sa.Integer()), sa.column('username', sa.String()),
+                    sa.column('full_name', sa.String()), sa.column('is_private', sa.Boolean()),
+                    sa.column('created_at', sa.DateTime()))
+    op.execute(user.update().values(
+        username=sa.literal('user_', sa.String()) + sa.cast(user.c.id, sa.String()),
+        full_name='',
+        is_private=False,
+        created_at=sa.func.current_timestamp(),
+    ))
+
+    with op.batch_alter_table('user', schema=None) as batch_op:
+        batch_op.alter_column('username', existing_type=sa.String(length=30), nullable=False)
+        batch_op.alter_column('full_name', existing_type=sa.String(length=100), nullable=False)
+        batch_op.alter_column('is_private', existing_type=sa.Boolean(), nullable=False)
+        batch_op.alter_column('created_at', existing_type=sa.DateTime(), nullable=False)
+        batch_op.alter_column('password', existing_type=sa.String(length=80), type_=sa.String(), existing_nullable=False)
+        batch_op.create_unique_constraint('uq_user_username', ['username'])
+
+    op.create_table('post',
+    sa.Column('id', sa.Integer(), nullable=False),
+    sa.Column('image_url', sa.String(length=255), nullable=False),
+    sa.Column('caption', sa.Text(), nullable=True),
+    sa.Column('location', sa.String(length=100), nullable=True),
+    sa.Column('user_id', sa.Integer(), nullable=False),
+    sa.Column('created_at', sa.DateTime(), nullable=False),
+    sa.Column('likes_count', sa.Integer(), server_default='0', nullable=False),
+    sa.Column('comments_count', sa.Integer(), server_default='0', nullable=False),
+    sa.ForeignKeyConstraint(['user_id'], ['user.id'], ),
+    sa.PrimaryKeyConstraint('id')
+    )
+    op.create_index('ix_post_user_id', 'post', ['user_id'], unique=False)
+
+    op.create_table('comment',
+    sa.Column('id', sa.Integer(), nullable=False),
+    sa.Column('content', sa.Text(), nullable=False),
+    sa.Column('user_id', sa.Integer(), nullable=False),
+    sa.Column('post_id', sa.Integer(), nullable=False),
+    sa.Column('created_at', sa.DateTime(), nullable=False),
+    sa.ForeignKeyConstraint(['post_id'], ['post.id'], ),
+    sa.ForeignKeyConstraint(['user_id'], ['user.id'], ),
+    sa.PrimaryKeyConstraint('id')
+    )
+    op.create_index('ix_comment_post_id', 'comment', ['post_id'], unique=False)
+
+    op.create_table('like',
+    sa.Column('id', sa.Integer(), nullable=False),
+    sa.Column('user_id', sa.Integer(), nullable=False),
+    sa.Column('post_id', sa.Integer(), nullable=False),
+    sa.Column('created_at', sa.DateTime(), nullable=False),
+    sa.ForeignKeyConstraint(['post_id'], ['post.id'], ),
+    sa.ForeignKeyConstraint(['user_id'], ['user.id'], ),
+    sa.PrimaryKeyConstraint('id')
+    )
+    op.create_index('ix_like_post_id', 'like', ['post_id'], unique=False)
+
+    op.create_table('follow',
+    sa.Column('id', sa.Integer(), nullable=False),
+    sa.Column('follower_id', sa.Integer(), nullable=False),
+    sa.Column('following_id', sa.Integer(), nullable=False),
+    sa.Column('created_at', sa.DateTime(), nullable=False),
+    sa.ForeignKeyConstraint(['follower_id'], ['user.id'], ),
+    sa.ForeignKeyConstraint(['following_id'], ['user.id'], ),
+    sa.PrimaryKeyConstraint('id')
+    )
+    op.create_index('ix_follow_follower_id', 'follow', ['follower_id'], unique=False)
+    op.create_index('ix_follow_following_id', 'follow', ['following_id'], unique=False)
+
+    op.create_table('story',
+    sa.Column('id', sa.Integer(), nullable=False),
+    sa.Column('media_url', sa.String(length=255), nullable=False),
+    sa.Column('user_id', sa.Integer(), nullable=False),
+    sa.Column('created_at', sa.DateTime(), nullable=False),
+    sa.Column('expires_at', sa.DateTime(), nullable=False),
+    sa.ForeignKeyConstraint(['user_id'], ['user.id'], ),
+    sa.PrimaryKeyConstraint('id')
+    )
+
+
+def downgrade():
+    op.drop_table('story')
+    op.drop_index('ix_follow_following_id', table_name='follow')
+    op.drop_index('ix_follow_follower_id', table_name='follow')
+    op.drop_table('follow')
+    op.drop_index('ix_like_post_id', table_name='like')
+    op.drop_table('like')
+    op.drop_index('ix_comment_post_id', table_name='comment')
+    op.drop_table('comment')
+    op.drop_index('ix_post_user_id', table_name='post')
+    op.drop_table('post')
+
+    with op.batch_alter_table('user', schema=None) as batch_op:
+        batch_op.drop_constraint('uq_user_username', type_='unique')
+        batch_op.alter_column('password', existing_type=sa.String(), type_=sa.String(length=80), existing_nullable=False)
+        batch_op.drop_column('following_count')
+        batch_op.drop_column('followers_count')
+        batch_op.drop_column('posts_count')
+        batch_op.drop_column('created_at')
+        batch_op.drop_column('is_private')
+        batch_op.drop_column('website')
+        batch_op.drop_column('profile_picture')
+        batch_op.drop_column('bio')
+        batch_op.drop_column('full_name')
+        batch_op.drop_column('username')
@@ -0,0 +1,29 @@
+"""cache versions shared by every worker
+
+Revision ID: 3d49911b3172
+Revises: 7b1f4c2e8a60
+Create Date: 2026-10-16 23:13:56.515646
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '3d49911b3172'
+down_revision = '7b1f4c2e8a60'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_table('cache_version',
+    sa.Column('kind', sa.String(length=16), nullable=False),
+    sa.Column('entity_id', sa.Integer(), autoincrement=False, nullable=False),
+    sa.Column('version', sa.BigInteger(), nullable=False),
+    sa.PrimaryKeyConstraint('kind', 'entity_id')
+    )
+
+
+def downgrade():
+    op.drop_table('cache_version')
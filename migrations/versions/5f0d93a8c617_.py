@@ -0,0 +1,64 @@
+"""unique likes, follows and comment client tokens
+
+Revision ID: 5f0d93a8c617
+Revises: e41b7c05d9a2
+Create Date: 2026-10-16 12:41:09.114582
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '5f0d93a8c617'
+down_revision = 'e41b7c05d9a2'
+branch_labels = None
+depends_on = None
+
+
+def _delete_duplicates(table, columns):
+    # keep the oldest row of each group; the extra derived table keeps MySQL happy
+    keep = sa.select(sa.func.min(table.c.id).label('id')).group_by(*[table.c[name] for name in columns]).subquery()
+    op.execute(table.delete().where(table.c.id.not_in(sa.select(keep.c.id))))
+
+
+def _recount(target, column, source, fk):
+    actual = sa.select(sa.func.count()).select_from(source).where(source.c[fk] == target.c.id).scalar_subquery()
+    op.execute(target.update().values({column: actual}))
+
+
+def upgrade():
+    user = sa.table('user', sa.column('id'), sa.column('followers_count'), sa.column('following_count'))
+    post = sa.table('post', sa.column('id'), sa.column('likes_count'))
+    like = sa.table('like', sa.column('id'), sa.column('user_id'), sa.column('post_id'))
+    follow = sa.table('follow', sa.column('id'), sa.column('follower_id'), sa.column('following_id'))
+
+    _delete_duplicates(like, ['user_id', 'post_id'])
+    _delete_duplicates(follow, ['follower_id', 'following_id'])
+    _recount(post, 'likes_count', like, 'post_id')
+    _recount(user, 'followers_count', follow, 'following_id')
+    _recount(user, 'following_count', follow, 'follower_id')
+
+    with op.batch_alter_table('like', schema=None) as batch_op:
+        batch_op.create_unique_constraint('uq_like_user_id_post_id', ['user_id', 'post_id'])
+
+    with op.batch_alter_table('follow', schema=None) as batch_op:
+        batch_op.create_unique_constraint('uq_follow_follower_id_following_id', ['follower_id', 'following_id'])
+        batch_op.drop_index('ix_follow_follower_id_following_id')
+
+    with op.batch_alter_table('comment', schema=None) as batch_op:
+        batch_op.add_column(sa.Column('client_token', sa.String(length=64), nullable=True))
+        batch_op.create_unique_constraint('uq_comment_user_id_client_token', ['user_id', 'client_token'])
+
+
+def downgrade():
+    with op.batch_alter_table('comment', schema=None) as batch_op:
+        batch_op.drop_constraint('uq_comment_user_id_client_token', type_='unique')
+        batch_op.drop_column('client_token')
+
+    with op.batch_alter_table('follow', schema=None) as batch_op:
+        batch_op.create_index('ix_follow_follower_id_following_id', ['follower_id', 'following_id'], unique=False)
+        batch_op.drop_constraint('uq_follow_follower_id_following_id', type_='unique')
+
+    with op.batch_alter_table('like', schema=None) as batch_op:
+        batch_op.drop_constraint('uq_like_user_id_post_id', type_='unique')
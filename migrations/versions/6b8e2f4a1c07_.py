@@ -0,0 +1,29 @@
+"""C-collated lower(username) index for ordered prefix search
+
+Revision ID: 6b8e2f4a1c07
+Revises: 3d49911b3172
+Create Date: 2026-10-16 23:41:09.582310
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '6b8e2f4a1c07'
+down_revision = '3d49911b3172'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    # unlike text_pattern_ops, a C-collated index can also return prefix matches in order
+    if op.get_bind().dialect.name == 'postgresql':
+        op.execute('CREATE INDEX ix_user_search_username_c ON "user" (lower(username) COLLATE "C")')
+        op.execute('DROP INDEX ix_user_search_username_prefix')
+
+
+def downgrade():
+    if op.get_bind().dialect.name == 'postgresql':
+        op.execute('CREATE INDEX ix_user_search_username_prefix ON "user" (lower(username) text_pattern_ops)')
+        op.execute('DROP INDEX ix_user_search_username_c')
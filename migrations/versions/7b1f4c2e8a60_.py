@@ -0,0 +1,32 @@
+"""post_id, created_at, id indexes on like and comment for delta sync
+
+Revision ID: 7b1f4c2e8a60
+Revises: 3524e445259e
+Create Date: 2026-10-16 23:20:41.502318
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '7b1f4c2e8a60'
+down_revision = '3524e445259e'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    # the new indexes lead with post_id, so they replace the single-column ones
+    # (created first: MySQL needs an index on post_id for the foreign key at all times)
+    op.create_index('ix_like_post_id_created_at_id', 'like', ['post_id', 'created_at', 'id'], unique=False)
+    op.drop_index('ix_like_post_id', table_name='like')
+    op.create_index('ix_comment_post_id_created_at_id', 'comment', ['post_id', 'created_at', 'id'], unique=False)
+    op.drop_index('ix_comment_post_id', table_name='comment')
+
+
+def downgrade():
+    op.create_index('ix_comment_post_id', 'comment', ['post_id'], unique=False)
+    op.drop_index('ix_comment_post_id_created_at_id', table_name='comment')
+    op.create_index('ix_like_post_id', 'like', ['post_id'], unique=False)
+    op.drop_index('ix_like_post_id_created_at_id', table_name='like')
@@ -0,0 +1,31 @@
+"""composite indexes for the home feed
+
+Revision ID: 8d2a4e6b1f93
+Revises: 3c9e1f7a2b40
+Create Date: 2026-10-16 10:03:17.902114
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '8d2a4e6b1f93'
+down_revision = '3c9e1f7a2b40'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    # the composite indexes lead with the same column, so they replace the single-column ones
+    op.create_index('ix_post_user_id_created_at_id', 'post', ['user_id', 'created_at', 'id'], unique=False)
+    op.drop_index('ix_post_user_id', table_name='post')
+    op.create_index('ix_follow_follower_id_following_id', 'follow', ['follower_id', 'following_id'], unique=False)
+    op.drop_index('ix_follow_follower_id', table_name='follow')
+
+
+def downgrade():
+    op.create_index('ix_follow_follower_id', 'follow', ['follower_id'], unique=False)
+    op.drop_index('ix_follow_follower_id_following_id', table_name='follow')
+    op.create_index('ix_post_user_id', 'post', ['user_id'], unique=False)
+    op.drop_index('ix_post_user_id_created_at_id', table_name='post')
@@ -0,0 +1,33 @@
+"""created_at and deleted_at indexes for the follow graph's settle window
+
+Revision ID: 911362c917ed
+Revises: 03382a9e8bb0
+Create Date: 2026-10-16 23:34:55.908852
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '911362c917ed'
+down_revision = '03382a9e8bb0'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    with op.batch_alter_table('follow', schema=None) as batch_op:
+        batch_op.create_index(batch_op.f('ix_follow_created_at'), ['created_at'], unique=False)
+
+    with op.batch_alter_table('follow_tombstone', schema=None) as batch_op:
+        batch_op.create_index(batch_op.f('ix_follow_tombstone_deleted_at'), ['deleted_at'], unique=False)
+
+
+def downgrade():
+    with op.batch_alter_table('follow_tombstone', schema=None) as batch_op:
+        batch_op.drop_index(batch_op.f('ix_follow_tombstone_deleted_at'))
+
+    with op.batch_alter_table('follow', schema=None) as batch_op:
+        batch_op.drop_index(batch_op.f('ix_follow_created_at'))
+
@@ -0,0 +1,39 @@
+"""story expiry indexes and story_archive table
+
+Revision ID: b7e25d1c4f08
+Revises: 5f0d93a8c617
+Create Date: 2026-10-16 13:58:31.665020
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'b7e25d1c4f08'
+down_revision = '5f0d93a8c617'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_index('ix_story_user_id_expires_at', 'story', ['user_id', 'expires_at'], unique=False)
+    op.create_index('ix_story_expires_at', 'story', ['expires_at'], unique=False)
+    op.create_table('story_archive',
+    sa.Column('id', sa.Integer(), autoincrement=False, nullable=False),
+    sa.Column('media_url', sa.String(length=255), nullable=False),
+    sa.Column('user_id', sa.Integer(), nullable=False),
+    sa.Column('created_at', sa.DateTime(), nullable=False),
+    sa.Column('expires_at', sa.DateTime(), nullable=False),
+    sa.Column('archived_at', sa.DateTime(), nullable=False),
+    sa.ForeignKeyConstraint(['user_id'], ['user.id'], ),
+    sa.PrimaryKeyConstraint('id')
+    )
+    op.create_index('ix_story_archive_user_id', 'story_archive', ['user_id'], unique=False)
+
+
+def downgrade():
+    op.drop_index('ix_story_archive_user_id', table_name='story_archive')
+    op.drop_table('story_archive')
+    op.drop_index('ix_story_expires_at', table_name='story')
+    op.drop_index('ix_story_user_id_expires_at', table_name='story')
@@ -0,0 +1,39 @@
+"""user search indexes (pg_trgm on Postgres, FTS5 table on SQLite)
+
+Revision ID: c8f3a61d2e97
+Revises: b7e25d1c4f08
+Create Date: 2026-10-16 15:12:40.204118
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'c8f3a61d2e97'
+down_revision = 'b7e25d1c4f08'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    dialect = op.get_bind().dialect.name
+    if dialect == 'postgresql':
+        op.execute('CREATE EXTENSION IF NOT EXISTS pg_trgm')
+        op.execute('CREATE INDEX ix_user_search_username_prefix ON "user" (lower(username) text_pattern_ops)')
+        op.execute('CREATE INDEX ix_user_search_username_trgm ON "user" USING gin (lower(username) gin_trgm_ops)')
+        op.execute('CREATE INDEX ix_user_search_full_name_trgm ON "user" USING gin (lower(full_name) gin_trgm_ops)')
+    elif dialect == 'sqlite':
+        op.execute("CREATE VIRTUAL TABLE user_search USING fts5(username, full_name, prefix='2 3')")
+        op.execute("INSERT INTO user_search (rowid, username, full_name) "
+                   "SELECT id, username, coalesce(full_name, '') FROM user")
+
+
+def downgrade():
+    dialect = op.get_bind().dialect.name
+    if dialect == 'postgresql':
+        op.execute('DROP INDEX ix_user_search_full_name_trgm')
+        op.execute('DROP INDEX ix_user_search_username_trgm')
+        op.execute('DROP INDEX ix_user_search_username_prefix')
+    elif dialect == 'sqlite':
+        op.execute('DROP TABLE user_search')
@@ -0,0 +1,42 @@
+"""hashtag index and location feed index
+
+Revision ID: d4a7b90e3c15
+Revises: c8f3a61d2e97
+Create Date: 2026-10-16 16:04:12.518302
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'd4a7b90e3c15'
+down_revision = 'c8f3a61d2e97'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_table('tag',
+    sa.Column('id', sa.Integer(), nullable=False),
+    sa.Column('name', sa.String(length=100), nullable=False),
+    sa.PrimaryKeyConstraint('id'),
+    sa.UniqueConstraint('name')
+    )
+    op.create_table('post_tag',
+    sa.Column('post_id', sa.Integer(), nullable=False),
+    sa.Column('tag_id', sa.Integer(), nullable=False),
+    sa.Column('created_at', sa.DateTime(), nullable=False),
+    sa.ForeignKeyConstraint(['post_id'], ['post.id'], ),
+    sa.ForeignKeyConstraint(['tag_id'], ['tag.id'], ),
+    sa.PrimaryKeyConstraint('post_id', 'tag_id')
+    )
+    op.create_index('ix_post_tag_tag_id_created_at_post_id', 'post_tag', ['tag_id', 'created_at', 'post_id'], unique=False)
+    op.create_index('ix_post_location_created_at_id', 'post', ['location', 'created_at', 'id'], unique=False)
+
+
+def downgrade():
+    op.drop_index('ix_post_location_created_at_id', table_name='post')
+    op.drop_index('ix_post_tag_tag_id_created_at_post_id', table_name='post_tag')
+    op.drop_table('post_tag')
+    op.drop_table('tag')
@@ -0,0 +1,33 @@
+"""timeline_entry table for fan-out-on-write feeds
+
+Revision ID: e41b7c05d9a2
+Revises: 8d2a4e6b1f93
+Create Date: 2026-10-16 11:26:52.480931
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'e41b7c05d9a2'
+down_revision = '8d2a4e6b1f93'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_table('timeline_entry',
+    sa.Column('owner_id', sa.Integer(), nullable=False),
+    sa.Column('post_id', sa.Integer(), nullable=False),
+    sa.Column('created_at', sa.DateTime(), nullable=False),
+    sa.ForeignKeyConstraint(['owner_id'], ['user.id'], ),
+    sa.ForeignKeyConstraint(['post_id'], ['post.id'], ),
+    sa.PrimaryKeyConstraint('owner_id', 'post_id')
+    )
+    op.create_index('ix_timeline_entry_owner_id_created_at_post_id', 'timeline_entry', ['owner_id', 'created_at', 'post_id'], unique=False)
+
+
+def downgrade():
+    op.drop_index('ix_timeline_entry_owner_id_created_at_post_id', table_name='timeline_entry')
+    op.drop_table('timeline_entry')
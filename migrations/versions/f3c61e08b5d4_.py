@@ -0,0 +1,37 @@
+"""explore scores and engagement created_at indexes
+
+Revision ID: f3c61e08b5d4
+Revises: e9b2c4d7a813
+Create Date: 2026-10-16 18:40:07.118624
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'f3c61e08b5d4'
+down_revision = 'e9b2c4d7a813'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_table('post_score',
+    sa.Column('period', sa.String(length=8), nullable=False),
+    sa.Column('post_id', sa.Integer(), nullable=False),
+    sa.Column('score', sa.Float(), nullable=False),
+    sa.Column('computed_at', sa.DateTime(), nullable=False),
+    sa.ForeignKeyConstraint(['post_id'], ['post.id'], ),
+    sa.PrimaryKeyConstraint('period', 'post_id')
+    )
+    op.create_index('ix_post_score_period_score_post_id', 'post_score', ['period', 'score', 'post_id'], unique=False)
+    op.create_index('ix_like_created_at', 'like', ['created_at'], unique=False)
+    op.create_index('ix_comment_created_at', 'comment', ['created_at'], unique=False)
+
+
+def downgrade():
+    op.drop_index('ix_comment_created_at', table_name='comment')
+    op.drop_index('ix_like_created_at', table_name='like')
+    op.drop_index('ix_post_score_period_score_post_id', table_name='post_score')
+    op.drop_table('post_score')
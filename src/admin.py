@@ -1,16 +1,169 @@
+"""
+Admin list views that stay cheap on large tables.
+
+flask-admin's defaults count the whole table on every list page, page with
+OFFSET and load related objects row by row. LeanModelView instead:
+
+- shows the planner's row estimate on Postgres (pg_class.reltuples) or
+  MySQL (information_schema) and no count elsewhere, never COUNT(*);
+- pages by primary key (`?after=<id>`) in the default newest-first order,
+  falling back to OFFSET only when sorting by another column;
+- joins the many-to-one relations it displays in the same query;
+- searches only columns with an index, by exact value, and users through
+  the search index (search.py);
+- builds edit forms from plain columns, so no field loads a whole table.
+
+List pages are GET requests, so they read from the replica when
+DATABASE_REPLICA_URL is set (see config.RoutingSession), and on Postgres
+their queries are cut off after ADMIN_STATEMENT_TIMEOUT_MS.
+"""
 import os
+from flask import current_app, request, url_for
 from flask_admin import Admin
-from models import db, User
 from flask_admin.contrib.sqla import ModelView
+from sqlalchemy import Integer, false, or_, text
+from models import db, User, Post, Comment, Like, Follow, Story
+from search import search_users
+
+
+def estimated_count(model):
+    """The planner's row estimate for the table of `model`, None when the database has none."""
+    connection = db.session.connection()
+    table = model.__table__
+    if connection.dialect.name == 'postgresql':
+        name = connection.dialect.identifier_preparer.format_table(table)
+        estimate = connection.scalar(
+            text("SELECT reltuples::bigint FROM pg_class WHERE oid = to_regclass(:name)"), {"name": name}
+        )
+    elif connection.dialect.name == 'mysql':
+        estimate = connection.scalar(text(
+            "SELECT table_rows FROM information_schema.tables "
+            "WHERE table_schema = DATABASE() AND table_name = :name"
+        ), {"name": table.name})
+    else:
+        return None
+    # -1 until the table is first analyzed
+    return estimate if estimate is not None and estimate >= 0 else None
+
+
+def _username(view, context, model, name):
+    user = getattr(model, name)
+    return user.username if user is not None else None
+
+
+class LeanModelView(ModelView):
+    list_template = 'admin/lean_list.html'
+    page_size = 50
+    can_set_page_size = False
+    simple_list_pager = True
+    column_default_sort = ('id', True)
+    column_display_pk = True
+    # many-to-one relations in column_list are joined into the list query
+    column_auto_select_related = True
+    # exact matches only, each column must lead an index
+    column_searchable_list = ()
+
+    def get_list(self, page, sort_column, sort_desc, search, filters, execute=True, page_size=None):
+        timeout = current_app.config.get('ADMIN_STATEMENT_TIMEOUT_MS')
+        if timeout and db.session.connection().dialect.name == 'postgresql':
+            db.session.execute(text(f"SET LOCAL statement_timeout = {int(timeout)}"))
+        _, query = super().get_list(page, sort_column, sort_desc, search, filters, execute, page_size)
+        count = estimated_count(self.model) if not search and not filters else None
+        return count, query
+
+    def _after(self):
+        return request.args.get('after', type=int)
+
+    def _apply_sorting(self, query, joins, sort_column, sort_desc):
+        query, joins = super()._apply_sorting(query, joins, sort_column, sort_desc)
+        if sort_column is None and self._after() is not None:
+            query = query.filter(self.model.id < self._after())
+        return query, joins
+
+    def _apply_pagination(self, query, page, page_size):
+        if self._after() is not None:
+            page = 0
+        return super()._apply_pagination(query, page, page_size)
+
+    def keyset_url(self, after=None):
+        """This list, with the same search and filters, starting below id `after`."""
+        args = {key: value for key, value in request.args.items() if key not in ('page', 'after')}
+        return url_for('.index_view', after=after, **args)
+
+    def _search_terms(self, term):
+        clauses = []
+        for name in self.column_searchable_list:
+            column = getattr(self.model, name)
+            if isinstance(column.type, Integer):
+                if term.isdigit():
+                    clauses.append(column == int(term))
+            else:
+                clauses.append(column == term)
+        if term.isdigit():
+            clauses.append(self.model.id == int(term))
+        return clauses
+
+    def _apply_search(self, query, count_query, joins, count_joins, search):
+        clauses = self._search_terms(search.strip())
+        query = query.filter(or_(*clauses)) if clauses else query.filter(false())
+        return query, count_query, joins, count_joins
+
+
+class UserView(LeanModelView):
+    column_list = ('id', 'username', 'email', 'full_name', 'is_active', 'is_private',
+                   'posts_count', 'followers_count', 'following_count', 'created_at')
+    column_searchable_list = ('username', 'email')
+    form_columns = ('username', 'email', 'password', 'full_name', 'bio', 'profile_picture',
+                    'website', 'is_private', 'is_active')
+
+    def _search_terms(self, term):
+        clauses = super()._search_terms(term)
+        matches = [user.id for user in search_users(term, limit=self.page_size)]
+        if matches:
+            clauses.append(User.id.in_(matches))
+        return clauses
+
+
+class PostView(LeanModelView):
+    column_list = ('id', 'user', 'image_url', 'location', 'likes_count', 'comments_count', 'created_at')
+    column_formatters = {'user': _username}
+    column_searchable_list = ('user_id', 'location')
+    form_columns = ('user_id', 'image_url', 'caption', 'location')
+
+
+class CommentView(LeanModelView):
+    column_list = ('id', 'user', 'post_id', 'content', 'created_at')
+    column_formatters = {'user': _username}
+    column_searchable_list = ('post_id', 'user_id')
+    form_columns = ('user_id', 'post_id', 'content')
+
+
+class LikeView(LeanModelView):
+    column_list = ('id', 'user', 'post_id', 'created_at')
+    column_formatters = {'user': _username}
+    column_searchable_list = ('post_id', 'user_id')
+    form_columns = ('user_id', 'post_id')
+
+
+class FollowView(LeanModelView):
+    column_list = ('id', 'follower', 'following', 'created_at')
+    column_formatters = {'follower': _username, 'following': _username}
+    column_searchable_list = ('follower_id', 'following_id')
+    form_columns = ('follower_id', 'following_id')
+
+
+class StoryView(LeanModelView):
+    column_list = ('id', 'user', 'media_url', 'created_at', 'expires_at')
+    column_formatters = {'user': _username}
+    column_searchable_list = ('user_id',)
+    form_columns = ('user_id', 'media_url', 'expires_at')
+
 
 def setup_admin(app):
     app.secret_key = os.environ.get('FLASK_APP_KEY', 'sample key')
     app.config['FLASK_ADMIN_SWATCH'] = 'cerulean'
     admin = Admin(app, name='4Geeks Admin', template_mode='bootstrap3')
 
-    
-    # Add your models here, for example this is how we add a the User model to the admin
-    admin.add_view(ModelView(User, db.session))
-
-    # You can duplicate that line to add mew models
-    # admin.add_view(ModelView(YourModelName, db.session))
\ No newline at end of file
+    for view, model in ((UserView, User), (PostView, Post), (CommentView, Comment),
+                        (LikeView, Like), (FollowView, Follow), (StoryView, Story)):
+        admin.add_view(view(model, db.session))
@@ -1,51 +1,171 @@
 """
 This module takes care of starting the API Server, Loading the DB and Adding the endpoints
+
+create_app(features) builds the app with only the optional parts asked for
+(APP_FEATURES by default, a comma separated list of FEATURES or presets):
+
+    admin       the flask-admin views at /admin
+    swagger     the spec at /swagger.json
+    sitemap     the endpoint list at /
+    migrate     the `flask db` commands
+    cli         every other `flask` command
+    background  the story sweeper, job worker and timeline trimmer threads
+
+"all" is everything and the default; "api" is what a web worker needs,
+so `APP_FEATURES=api gunicorn wsgi` never imports flask-admin or alembic.
+
+Nothing here opens a database connection or starts a thread, which makes it
+safe for `gunicorn --preload`: the app is built once in the master and
+forked. Engines are disposed in every forked child so no connection is
+shared, and background threads start with a process's first request.
+
+`app` itself is built on first access, for the flask CLI and wsgi.py.
+`flask bench startup` measures import and first-request time per feature set.
 """
 import os
-from flask import Flask, request, jsonify, url_for
-from flask_migrate import Migrate
-from flask_swagger import swagger
+import threading
+import weakref
+from flask import Flask
 from flask_cors import CORS
-from utils import APIException, generate_sitemap
-from admin import setup_admin
-from models import db, User
+from werkzeug.middleware.proxy_fix import ProxyFix
+from models import db
+from config import configure_app, pool_metrics
+from cache import cache_metrics, init_cache
+from metrics import init_metrics
+from serializers import CompactJSONProvider
+from graph import init_graph
+from ratelimit import init_rate_limit
+from routes import register_routes
 #from models import Person
 
-app = Flask(__name__)
-app.url_map.strict_slashes = False
+FEATURES = ('admin', 'swagger', 'sitemap', 'migrate', 'cli', 'background')
+PRESETS = {'all': FEATURES, 'api': ('background',)}
+
+
+def parse_features(value):
+    features = set()
+    for name in filter(None, (part.strip() for part in value.split(','))):
+        if name not in PRESETS and name not in FEATURES:
+            raise ValueError(f"unknown feature {name!r}, expected one of {', '.join(PRESETS)}, {', '.join(FEATURES)}")
+        features.update(PRESETS.get(name, (name,)))
+    return features
+
+
+def include_object(*args):
+    from archive import include_object as archive_tables
+    from search import include_object as search_tables
+    # tables and indexes that are managed outside the models
+    return search_tables(*args) and archive_tables(*args)
+
+
+def _add_commands(app):
+    from counters import counters_cli
+    from timeline import timeline_cli
+    from stories import stories_cli
+    from datagen import seed_command
+    from bench import bench_cli
+    from export import export_cli
+    from search import search_cli
+    from tags import tags_cli
+    from jobs import jobs_cli
+    from graph import graph_cli
+    from explore import explore_cli
+    from archive import archive_cli
+    from ratelimit import ratelimit_cli
+    from media import media_cli
+    for command in (counters_cli, timeline_cli, stories_cli, seed_command, bench_cli, export_cli, search_cli,
+                    tags_cli, jobs_cli, graph_cli, explore_cli, archive_cli, ratelimit_cli, media_cli):
+        app.cli.add_command(command)
+
+
+def _start_background(app):
+    from stories import start_story_sweeper
+    from jobs import start_job_workers
+    from timeline import start_timeline_trimmer
+    started = {"pid": None}
+    lock = threading.Lock()
+
+    # threads don't survive a fork, so each process starts its own with its first request
+    @app.before_request
+    def _start_background_threads():
+        if started["pid"] == os.getpid():
+            return
+        with lock:
+            if started["pid"] != os.getpid():
+                start_story_sweeper(app)
+                start_job_workers(app)
+                start_timeline_trimmer(app)
+                started["pid"] = os.getpid()
+
+
+# apps whose engines a forked child disposes; one hook for however many apps are built
+_fork_apps = weakref.WeakSet()
+
+
+def _dispose_after_fork():
+    # connections made before a fork (e.g. in a --preload master) must not be shared with the children
+    for app in list(_fork_apps):
+        with app.app_context():
+            for engine in db.engines.values():
+                engine.dispose(close=False)
+
+
+os.register_at_fork(after_in_child=_dispose_after_fork)
+
+
+def _dispose_engines(app):
+    _fork_apps.add(app)
+
+
+def create_app(features=None):
+    features = parse_features(features if features is not None else os.getenv('APP_FEATURES', 'all'))
+    app = Flask(__name__)
+    app.url_map.strict_slashes = False
+    app.json = CompactJSONProvider(app)
 
-db_url = os.getenv("DATABASE_URL")
-if db_url is not None:
-    app.config['SQLALCHEMY_DATABASE_URI'] = db_url.replace("postgres://", "postgresql://")
-else:
-    app.config['SQLALCHEMY_DATABASE_URI'] = "sqlite:////tmp/test.db"
-app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
+    configure_app(app)
+    app.config['APP_FEATURES'] = sorted(features)
+    if app.config['TRUSTED_PROXY_HOPS']:
+        # request.remote_addr is then the client, not the proxy; rate limits are keyed on it
+        hops = app.config['TRUSTED_PROXY_HOPS']
+        app.wsgi_app = ProxyFix(app.wsgi_app, x_for=hops, x_proto=hops)
 
-MIGRATE = Migrate(app, db)
-db.init_app(app)
-CORS(app)
-setup_admin(app)
+    if 'migrate' in features:
+        from flask_migrate import Migrate
+        Migrate(app, db, include_object=include_object)
+    db.init_app(app)
+    CORS(app)
+    if 'admin' in features:
+        from admin import setup_admin
+        setup_admin(app)
+    init_cache(app)
+    init_metrics(app)
+    init_graph(app)
+    init_rate_limit(app)
+    app.extensions['metrics_collectors'] += [cache_metrics(app.extensions['response_cache']), pool_metrics(app, db)]
+    register_routes(app, features)
+    if 'cli' in features:
+        _add_commands(app)
+    if 'background' in features:
+        _start_background(app)
+    _dispose_engines(app)
+    return app
 
-# Handle/serialize errors like a JSON object
-@app.errorhandler(APIException)
-def handle_invalid_usage(error):
-    return jsonify(error.to_dict()), error.status_code
 
-# generate sitemap with all your endpoints
-@app.route('/')
-def sitemap():
-    return generate_sitemap(app)
+_app = None
 
-@app.route('/user', methods=['GET'])
-def handle_hello():
 
-    response_body = {
-        "msg": "Hello, this is your GET /user response "
-    }
+def __getattr__(name):
+    # `app` is only built when something asks for it, not when create_app is imported
+    global _app
+    if name != 'app':
+        raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+    if _app is None:
+        _app = create_app()
+    return _app
 
-    return jsonify(response_body), 200
 
 # this only runs if `$ python src/app.py` is executed
 if __name__ == '__main__':
     PORT = int(os.environ.get('PORT', 3000))
-    app.run(host='0.0.0.0', port=PORT, debug=False)
+    create_app().run(host='0.0.0.0', port=PORT, debug=False)
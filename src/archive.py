@@ -0,0 +1,184 @@
+"""
+Archival of cold likes and comments.
+
+Reads mostly touch recent engagement, so `flask archive run` moves rows
+older than ARCHIVE_AFTER_DAYS from `like` / `comment` into `like_archive` /
+`comment_archive`, in short batches like the story sweeper. On Postgres the
+archive tables are range-partitioned by created_at with one partition per
+month, created just before rows land in it. Queries bounded on created_at
+only open the months they need, and old months can be moved to a cheaper
+(e.g. compressed) tablespace with `flask archive tablespace`. Other
+databases, SQLite included, get plain tables with the same columns.
+
+The archive only holds rows older than everything left in the hot table,
+so paginate_with_archive() reads the hot table first and continues into
+the archive when it runs out. Counters keep counting archived rows.
+"""
+import re
+import time
+from datetime import datetime, timedelta
+import click
+from flask import current_app
+from flask.cli import AppGroup
+from sqlalchemy import and_, delete, exists, func, insert, or_, select, text, tuple_
+from sqlalchemy.orm import aliased
+from models import db, Like, Comment, LikeArchive, CommentArchive
+from pagination import decode_cursor, encode_cursor, paginate
+
+ARCHIVES = {Like: LikeArchive, Comment: CommentArchive}
+PARTITION = re.compile(r'^(like|comment)_archive_(y\d{4}m\d{2}|default)$')
+
+
+def include_object(obj, name, type_, reflected, compare_to):
+    # the monthly partitions are created at runtime, not from the models
+    return not (type_ == 'table' and reflected and compare_to is None and PARTITION.match(name or ''))
+
+
+def _month(value):
+    return datetime(value.year, value.month, 1)
+
+
+def _next_month(month):
+    return (month + timedelta(days=32)).replace(day=1)
+
+
+def partition_name(table, month):
+    return f"{table}_y{month:%Y}m{month:%m}"
+
+
+def ensure_partitions(connection, archive, start, end):
+    """Creates the monthly partitions of `archive` covering start..end; Postgres only."""
+    if connection.dialect.name != 'postgresql':
+        return
+    table = archive.__tablename__
+    month = _month(start)
+    while month <= end:
+        following = _next_month(month)
+        connection.execute(text(
+            f"CREATE TABLE IF NOT EXISTS {partition_name(table, month)} PARTITION OF {table} "
+            f"FOR VALUES FROM ('{month:%Y-%m-%d}') TO ('{following:%Y-%m-%d}')"
+        ))
+        month = following
+
+
+def archive_rows(model, before, batch_size=1000, max_batches=None):
+    """Moves rows of `model` created before `before` to its archive; returns rows moved."""
+    archive = ARCHIVES[model]
+    columns = [column.key for column in archive.__table__.columns]
+    moved = batches = 0
+    while max_batches is None or batches < max_batches:
+        ids = db.session.scalars(
+            select(model.id).where(model.created_at < before)
+            .order_by(model.created_at).limit(batch_size).with_for_update(skip_locked=True)
+        ).all()
+        if not ids:
+            break
+        connection = db.session.connection()
+        first, last = connection.execute(
+            select(func.min(model.created_at), func.max(model.created_at)).where(model.id.in_(ids))
+        ).one()
+        ensure_partitions(connection, archive, first, last)
+        connection.execute(insert(archive).from_select(
+            columns, select(*(getattr(model, name) for name in columns)).where(model.id.in_(ids))
+        ))
+        connection.execute(delete(model).where(model.id.in_(ids)))
+        db.session.commit()
+        moved += len(ids)
+        batches += 1
+    return moved
+
+
+def archived_keys(model, rows, columns):
+    """The `columns` tuples of `rows` that are already in the archive of `model`."""
+    archive = ARCHIVES.get(model)
+    if archive is None or not rows:
+        return set()
+    keys = {tuple(row[name] for name in columns) for row in rows}
+    key = tuple_(*(getattr(archive, name) for name in columns))
+    return set(db.session.execute(select(*(getattr(archive, name) for name in columns)).where(key.in_(keys))).all())
+
+
+def paginate_with_archive(model, where, cursor=None, limit=20, options=()):
+    """paginate() over `model`, continuing into its archive once the hot rows run out.
+
+    `where(entity)` returns the filters for either table. Archived rows come
+    back as `model` instances; `options` only apply to the hot rows.
+    """
+    rows, next_cursor = paginate(
+        select(model).where(*where(model)).options(*options), model.created_at, model.id, cursor, limit
+    )
+    if next_cursor:
+        return rows, next_cursor
+    cold = aliased(model, ARCHIVES[model].__table__, adapt_on_names=True)
+    after = encode_cursor(rows[-1].created_at, rows[-1].id) if rows else cursor
+    if len(rows) < limit:
+        archived, next_cursor = paginate(
+            select(cold).where(*where(cold)), cold.created_at, cold.id, after, limit - len(rows)
+        )
+        return rows + archived, next_cursor
+    # the page is full: only say there is more if the archive has it
+    created_at, row_id = decode_cursor(after)
+    more = db.session.scalar(select(exists().where(
+        *where(cold), cold.created_at <= created_at,
+        or_(cold.created_at < created_at, and_(cold.created_at == created_at, cold.id < row_id)),
+    )))
+    return rows, after if more else None
+
+
+def archive_before():
+    return datetime.utcnow() - timedelta(days=current_app.config.get('ARCHIVE_AFTER_DAYS', 90))
+
+
+archive_cli = AppGroup('archive', help='Move cold likes and comments to the archive tables.')
+
+
+@archive_cli.command('run')
+@click.option('--days', type=int, default=None, help='Archive rows older than this, ARCHIVE_AFTER_DAYS by default.')
+@click.option('--batch-size', default=1000, show_default=True, help='Rows moved per transaction.')
+@click.option('--max-batches', type=int, default=None, help='Stop after this many batches per table.')
+def run_command(days, batch_size, max_batches):
+    """Move old likes and comments into the archive."""
+    before = datetime.utcnow() - timedelta(days=days) if days is not None else archive_before()
+    for model in ARCHIVES:
+        started = time.perf_counter()
+        moved = archive_rows(model, before, batch_size, max_batches)
+        click.echo(f"{model.__tablename__}: {moved} rows archived in {time.perf_counter() - started:.1f}s")
+
+
+@archive_cli.command('partitions')
+@click.option('--months-ahead', default=3, show_default=True)
+def partitions_command(months_ahead):
+    """Create the upcoming monthly archive partitions (Postgres)."""
+    connection = db.session.connection()
+    if connection.dialect.name != 'postgresql':
+        raise click.ClickException('archive partitions only exist on Postgres')
+    start = archive_before()
+    end = start + timedelta(days=31 * months_ahead)
+    for archive in ARCHIVES.values():
+        ensure_partitions(connection, archive, start, end)
+    db.session.commit()
+    click.echo(f"partitions up to {end:%Y-%m} are in place")
+
+
+@archive_cli.command('tablespace')
+@click.argument('tablespace')
+@click.option('--before', required=True, help='Move partitions of months before YYYY-MM.')
+def tablespace_command(tablespace, before):
+    """Move old archive partitions to TABLESPACE, e.g. one on compressed storage (Postgres)."""
+    connection = db.session.connection()
+    if connection.dialect.name != 'postgresql':
+        raise click.ClickException('archive partitions only exist on Postgres')
+    cutoff = datetime.strptime(before, '%Y-%m')
+    moved = 0
+    for archive in ARCHIVES.values():
+        partitions = connection.scalars(text(
+            "SELECT c.relname FROM pg_inherits i JOIN pg_class c ON c.oid = i.inhrelid "
+            "JOIN pg_class p ON p.oid = i.inhparent WHERE p.relname = :parent"
+        ), {"parent": archive.__tablename__}).all()
+        for name in sorted(partitions):
+            match = PARTITION.match(name)
+            if match and match.group(2) != 'default' and datetime.strptime(match.group(2), 'y%Ym%m') < cutoff:
+                connection.execute(text(f'ALTER TABLE {name} SET TABLESPACE "{tablespace}"'))
+                moved += 1
+    db.session.commit()
+    click.echo(f"{moved} partitions moved to {tablespace}")
@@ -0,0 +1,240 @@
+"""
+Endpoint benchmarks through the Flask test client: `flask bench run`.
+
+Each scenario is requested against ids sampled from the current database
+(seed it first with `flask seed`). For every scenario the harness reports
+p50/p95/p99 latency and SQL statements per request. `--save` writes the
+result as the baseline and later runs fail when a scenario's p95 grows
+past the tolerance or it issues more queries than the baseline did.
+Scenarios that write (likes_batch) delete what they added once they are
+done, so every run measures the same data.
+
+`flask bench startup` times a cold worker instead: importing the app,
+building it and serving its first request, in fresh interpreters, for each
+APP_FEATURES set.
+"""
+import json
+import os
+import random
+import statistics
+import subprocess
+import sys
+import time
+import click
+from flask import current_app
+from flask.cli import AppGroup
+from sqlalchemy import delete, event, func, select, tuple_
+from sqlalchemy.engine import Engine
+from models import db, User, Post, Follow, Like, Job, Notification
+from counters import recount
+from cache import invalidate_rows
+
+DEFAULT_BASELINE = 'bench_baseline.json'
+
+
+def percentile(values, pct):
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, max(0, round(pct / 100 * len(ordered)) - 1))]
+
+
+class QueryCounter:
+
+    def __init__(self):
+        self.count = 0
+
+    def _count(self, *args):
+        self.count += 1
+
+    def __enter__(self):
+        event.listen(Engine, 'after_cursor_execute', self._count)
+        return self
+
+    def __exit__(self, *exc):
+        event.remove(Engine, 'after_cursor_execute', self._count)
+
+
+def _sample(column, k, rng, where=None):
+    stmt = select(column)
+    if where is not None:
+        stmt = stmt.where(where)
+    ids = db.session.scalars(stmt.order_by(func.random()).limit(k)).all()
+    if not ids:
+        raise click.ClickException('the database is empty, run `flask seed` first')
+    return [rng.choice(ids) for _ in range(k)]
+
+
+def _deep_feed(client, user_id, pages=10):
+    cursor = None
+    for _ in range(pages):
+        response = client.get('/feed', query_string={"user_id": user_id, "cursor": cursor or ''})
+        cursor = response.get_json().get("next_cursor")
+        if not cursor:
+            break
+    return response
+
+
+def undo_likes(batches):
+    """Returns a function deleting what the like batches added, so every run starts from the same data."""
+    pairs = {(like["user_id"], like["post_id"]) for batch in batches for like in batch}
+    existing = set(db.session.execute(
+        select(Like.user_id, Like.post_id).where(tuple_(Like.user_id, Like.post_id).in_(pairs))
+    ).all())
+    added = list(pairs - existing)
+
+    def undo():
+        if not added:
+            return
+        db.session.execute(delete(Like).where(tuple_(Like.user_id, Like.post_id).in_(added)))
+        db.session.execute(delete(Job).where(Job.idempotency_key.in_([f"like:{u}:{p}" for u, p in added])))
+        db.session.execute(delete(Notification).where(
+            Notification.kind == 'like', tuple_(Notification.actor_id, Notification.post_id).in_(added)
+        ))
+        recount(Like, {"likes_count": {post_id for _, post_id in added}})
+        # Core deletes skip the mapper events, so the cached payloads need new versions here
+        invalidate_rows(Like, [{"user_id": user_id, "post_id": post_id} for user_id, post_id in added])
+        db.session.commit()
+    return undo
+
+
+def scenarios(rng, k):
+    """Returns ({name: request}, {name: cleanup}) for `k` requests per scenario."""
+    users = _sample(User.id, k, rng)
+    posts = _sample(Post.id, k, rng)
+    followers = _sample(Follow.follower_id, k, rng)
+    likes = [[{"user_id": users[i], "post_id": post_id} for post_id in posts[:50]] for i in range(k)]
+    return {
+        "profile": lambda c, i: c.get(f"/users/{users[i]}"),
+        "post": lambda c, i: c.get(f"/posts/{posts[i]}"),
+        "feed": lambda c, i: c.get("/feed", query_string={"user_id": followers[i]}),
+        "feed_page_10": lambda c, i: _deep_feed(c, followers[i]),
+        "stories": lambda c, i: c.get(f"/users/{users[i]}/stories"),
+        "likes_batch": lambda c, i: c.post("/likes/batch", json={"likes": likes[i]}),
+    }, {
+        "likes_batch": undo_likes(likes),
+    }
+
+
+def run(requests=200, only=None, cold=False, seed=0):
+    rng = random.Random(seed)
+    client = current_app.test_client()
+    results = {}
+    requests_by_name, cleanups = scenarios(rng, requests)
+    for name, request in requests_by_name.items():
+        if only and name not in only:
+            continue
+        latencies, queries = [], []
+        try:
+            for i in range(requests):
+                if cold:
+                    current_app.extensions['response_cache'].backend.clear()
+                with QueryCounter() as counter:
+                    started = time.perf_counter()
+                    response = request(client, i)
+                    latencies.append(time.perf_counter() - started)
+                if response.status_code >= 500:
+                    raise click.ClickException(f"{name} answered {response.status_code}")
+                queries.append(counter.count)
+        finally:
+            if name in cleanups:
+                cleanups[name]()
+        results[name] = {
+            "p50_ms": percentile(latencies, 50) * 1000,
+            "p95_ms": percentile(latencies, 95) * 1000,
+            "p99_ms": percentile(latencies, 99) * 1000,
+            "queries_per_request": sum(queries) / len(queries),
+            "max_queries": max(queries),
+        }
+    return results
+
+
+def compare(results, baseline, tolerance):
+    """Returns a list of human readable regressions against `baseline`."""
+    regressions = []
+    for name, result in results.items():
+        before = baseline.get(name)
+        if before is None:
+            continue
+        if result["p95_ms"] > before["p95_ms"] * (1 + tolerance):
+            regressions.append(f"{name}: p95 {before['p95_ms']:.2f} -> {result['p95_ms']:.2f} ms")
+        if result["max_queries"] > before["max_queries"]:
+            regressions.append(f"{name}: queries {before['max_queries']} -> {result['max_queries']}")
+    return regressions
+
+
+bench_cli = AppGroup('bench', help='Benchmark the API endpoints.')
+
+
+@bench_cli.command('run')
+@click.option('--requests', default=200, show_default=True, help='Requests per scenario.')
+@click.option('--scenario', 'only', multiple=True, help='Only run these scenarios.')
+@click.option('--cold', is_flag=True, help='Clear the response cache before every request.')
+@click.option('--baseline', default=DEFAULT_BASELINE, show_default=True, type=click.Path())
+@click.option('--save', is_flag=True, help='Store this run as the new baseline.')
+@click.option('--tolerance', default=0.25, show_default=True, help='Allowed p95 growth over the baseline.')
+def run_command(requests, only, cold, baseline, save, tolerance):
+    """Measure latency percentiles and queries per request."""
+    results = run(requests, only, cold)
+    click.echo(f"{'scenario':<14}{'p50 ms':>9}{'p95 ms':>9}{'p99 ms':>9}{'queries':>9}")
+    for name, r in results.items():
+        click.echo(f"{name:<14}{r['p50_ms']:>9.2f}{r['p95_ms']:>9.2f}{r['p99_ms']:>9.2f}{r['queries_per_request']:>9.1f}")
+
+    if save:
+        with open(baseline, 'w') as f:
+            json.dump(results, f, indent=2)
+        click.echo(f"baseline saved to {baseline}")
+        return
+    try:
+        with open(baseline) as f:
+            regressions = compare(results, json.load(f), tolerance)
+    except FileNotFoundError:
+        click.echo(f"no baseline at {baseline}, run with --save to create one")
+        return
+    if regressions:
+        raise click.ClickException("regressions:\n  " + "\n  ".join(regressions))
+    click.echo("no regressions against the baseline")
+
+
+# run in a fresh interpreter: argv is the feature set and the path to request
+STARTUP_SCRIPT = """
+import json, sys, time
+started = time.perf_counter()
+from app import create_app
+imported = time.perf_counter()
+app = create_app(sys.argv[1])
+created = time.perf_counter()
+status = app.test_client().get(sys.argv[2]).status_code
+done = time.perf_counter()
+print(json.dumps({"import_ms": (imported - started) * 1000, "create_ms": (created - imported) * 1000,
+                  "first_request_ms": (done - created) * 1000, "status": status}))
+"""
+
+
+def startup(features, path, runs=5):
+    """Median startup timings of `runs` fresh processes for one feature set."""
+    samples = []
+    for _ in range(runs):
+        started = time.perf_counter()
+        result = subprocess.run([sys.executable, '-c', STARTUP_SCRIPT, features, path], capture_output=True,
+                                text=True, cwd=os.path.dirname(os.path.abspath(__file__)))
+        if result.returncode:
+            raise click.ClickException(f"startup with {features!r} failed:\n{result.stderr}")
+        sample = json.loads(result.stdout.strip().splitlines()[-1])
+        sample["process_ms"] = (time.perf_counter() - started) * 1000
+        samples.append(sample)
+    timings = {key: statistics.median(sample[key] for sample in samples)
+               for key in ('import_ms', 'create_ms', 'first_request_ms', 'process_ms')}
+    timings["status"] = samples[-1]["status"]
+    return timings
+
+
+@bench_cli.command('startup')
+@click.option('--features', 'feature_sets', multiple=True, help='APP_FEATURES values to compare, all and api by default.')
+@click.option('--path', default='/users/1', show_default=True, help='What the first request asks for.')
+@click.option('--runs', default=5, show_default=True, help='Fresh processes per feature set.')
+def startup_command(feature_sets, path, runs):
+    """Measure import, app creation and first-request time of a cold worker."""
+    click.echo(f"{'features':<24}{'import ms':>11}{'create ms':>11}{'first req':>11}{'process ms':>12}")
+    for features in feature_sets or ('all', 'api'):
+        r = startup(features, path, runs)
+        click.echo(f"{features:<24}{r['import_ms']:>11.1f}{r['create_ms']:>11.1f}"
+                   f"{r['first_request_ms']:>11.1f}{r['process_ms']:>12.1f}")
@@ -0,0 +1,147 @@
+"""
+Batch writes for likes, follows and comments.
+
+Each batch is one multi-row INSERT that skips rows already present
+(ON CONFLICT DO NOTHING on Postgres/SQLite, INSERT IGNORE on MySQL), so
+clients can replay queued offline actions as often as they like. The
+statement bypasses the mapper events in counters.py and notifications.py,
+so the affected counters are updated and the notifications queued here,
+in the same transaction.
+"""
+from collections import Counter
+from datetime import datetime
+from sqlalchemy import insert, select
+from models import db, User, Post, Comment, Like, Follow
+from archive import archived_keys
+from cache import invalidate_rows
+from graph import apply_follows
+from counters import COUNTERS, bump_counters, recount
+from notifications import enqueue_notifications
+from timeline import backfill_follows, fan_out_enabled
+from utils import APIException
+
+MAX_BATCH_SIZE = 500
+
+
+def _dialect_insert(model, dialect):
+    if dialect == 'postgresql':
+        from sqlalchemy.dialects.postgresql import insert as pg_insert
+        return pg_insert(model)
+    if dialect == 'sqlite':
+        from sqlalchemy.dialects.sqlite import insert as sqlite_insert
+        return sqlite_insert(model)
+    return insert(model)
+
+
+def insert_ignore(model, rows, conflict_columns, returning, connection=None):
+    """Inserts `rows`, skipping conflicts on `conflict_columns`.
+
+    Returns the `returning` columns of the inserted rows as dicts, or None
+    when the database cannot report them (MySQL has no RETURNING). Pass
+    `connection` from inside mapper events.
+    """
+    if not rows:
+        return []
+    connection = connection or db.session.connection()
+    dialect = connection.dialect.name
+    stmt = _dialect_insert(model, dialect).values(rows)
+    if dialect in ('postgresql', 'sqlite'):
+        stmt = stmt.on_conflict_do_nothing(index_elements=conflict_columns)
+        columns = [getattr(model, name) for name in returning]
+        return [row._asdict() for row in connection.execute(stmt.returning(*columns))]
+    if dialect == 'mysql':
+        stmt = stmt.prefix_with('IGNORE')
+    connection.execute(stmt)
+    return None
+
+
+def _update_counters(row_model, rows, inserted):
+    connection = db.session.connection()
+    for model, column, fk in COUNTERS[row_model]:
+        if inserted is None:
+            recount(row_model, {column: {row[fk] for row in rows}})
+        else:
+            bump_counters(connection, model, Counter(row[fk] for row in inserted), column)
+
+
+def _existing_ids(model, ids):
+    return set(db.session.scalars(select(model.id).where(model.id.in_(ids))))
+
+
+def _is_id(value):
+    # bool is an int subclass, so JSON true/false would pass as ids 1 and 0
+    return isinstance(value, int) and not isinstance(value, bool)
+
+
+def _check_batch(items, fields):
+    if not isinstance(items, list):
+        raise APIException('Expected a list of objects', status_code=400)
+    if len(items) > MAX_BATCH_SIZE:
+        raise APIException(f'Batches are limited to {MAX_BATCH_SIZE} items', status_code=400)
+    rows = []
+    for item in items:
+        if not isinstance(item, dict) or any(not _is_id(item.get(field)) for field in fields):
+            raise APIException(f'Every item needs integer {", ".join(fields)}', status_code=400)
+        rows.append({field: item[field] for field in fields})
+    return rows
+
+
+def _write(row_model, rows, conflict_columns, references, accept=None):
+    """Drops rows pointing at missing users/posts, inserts the rest, bumps counters."""
+    known = {}
+    for field, model in references.items():
+        known[field] = _existing_ids(model, {row[field] for row in rows})
+    valid = [
+        row for row in rows
+        if all(row[field] in known[field] for field in references) and (accept is None or accept(row))
+    ]
+    # the same action twice in one batch counts once, and so does one already archived
+    valid = list({tuple(row[name] for name in conflict_columns): row for row in valid}.values())
+    archived = archived_keys(row_model, valid, conflict_columns)
+    if archived:
+        valid = [row for row in valid if tuple(row[name] for name in conflict_columns) not in archived]
+
+    now = datetime.utcnow()
+    for row in valid:
+        row.setdefault('created_at', now)
+    returning = set(conflict_columns) | {fk for _, _, fk in COUNTERS[row_model]}
+    inserted = insert_ignore(row_model, valid, conflict_columns, returning)
+    _update_counters(row_model, valid, inserted)
+    if row_model is Follow and fan_out_enabled():
+        backfill_follows(db.session.connection(), valid if inserted is None else inserted)
+    enqueue_notifications(row_model, valid if inserted is None else inserted)
+    invalidate_rows(row_model, valid if inserted is None else inserted)
+    db.session.commit()
+    if row_model is Follow:
+        apply_follows(valid if inserted is None else inserted)
+    return {
+        "received": len(rows),
+        "skipped": len(rows) - len(valid),
+        "inserted": len(inserted) if inserted is not None else None,
+    }
+
+
+def bulk_like(items):
+    rows = _check_batch(items, ['user_id', 'post_id'])
+    return _write(Like, rows, ['user_id', 'post_id'], {'user_id': User, 'post_id': Post})
+
+
+def bulk_follow(items):
+    rows = _check_batch(items, ['follower_id', 'following_id'])
+    return _write(
+        Follow, rows, ['follower_id', 'following_id'], {'follower_id': User, 'following_id': User},
+        accept=lambda row: row['follower_id'] != row['following_id'],
+    )
+
+
+def bulk_comment(items):
+    rows = _check_batch(items, ['user_id', 'post_id'])
+    for row, item in zip(rows, items):
+        content, token = item.get('content'), item.get('client_token')
+        if not isinstance(content, str) or not content.strip():
+            raise APIException('Every comment needs content', status_code=400)
+        if not isinstance(token, str) or not 0 < len(token) <= 64:
+            raise APIException('Every comment needs a client_token of up to 64 characters', status_code=400)
+        row['content'] = content
+        row['client_token'] = token
+    return _write(Comment, rows, ['user_id', 'client_token'], {'user_id': User, 'post_id': Post})
@@ -0,0 +1,250 @@
+"""
+Read-through cache for the profile and post payloads.
+
+Entries are keyed by entity and version ("post:12:<version>"). Mapper events
+on User, Post, Like, Comment and Follow collect the entities a flush
+touched and write them a new version in the cache_version table, in the
+same transaction, so every worker sees the new version exactly when it sees
+the change. Stale entries are never read again and simply age out of the
+LRU. The version also serves as the response ETag. Every request reads it
+with one primary key lookup on cache_version. The payload is then taken
+from the cache, or loaded and serialized on a miss, before json_with_etag
+decides between 304 and the body. So a 304 saves the response body, not
+the database: it costs the version lookup, plus the entity's own queries
+when its payload isn't cached.
+
+The version is read before the payload is built and from the same
+database, so a payload is never stored under a version newer than its data,
+replica lag included.
+
+CACHE_BACKEND is "memory" (per process) or the dotted path of a
+CacheBackend subclass shared between workers; it only holds payloads.
+"""
+import threading
+import time
+from collections import OrderedDict
+from importlib import import_module
+from flask import current_app
+from sqlalchemy import event, select, update
+from sqlalchemy.orm import Session, object_session
+from models import db, User, Post, Comment, Like, Follow, CacheVersion
+
+
+class CacheBackend:
+
+    @classmethod
+    def from_config(cls, config):
+        return cls(max_entries=config.get('CACHE_MAX_ENTRIES', 10000), ttl=config.get('CACHE_TTL', 300))
+
+    def get(self, key):
+        raise NotImplementedError()
+
+    def set(self, key, value, ttl=None):
+        raise NotImplementedError()
+
+    def delete(self, key):
+        raise NotImplementedError()
+
+    def clear(self):
+        raise NotImplementedError()
+
+    def stats(self):
+        return {}
+
+
+class MemoryCache(CacheBackend):
+    """Thread-safe LRU with per-entry expiry."""
+
+    def __init__(self, max_entries=10000, ttl=300):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self._lock = threading.Lock()
+        self._entries = OrderedDict()
+        self._counts = {"hits": 0, "misses": 0, "evictions": 0, "expirations": 0}
+
+    def get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                self._counts["misses"] += 1
+                return None
+            value, expires_at = entry
+            if expires_at is not None and expires_at < time.monotonic():
+                del self._entries[key]
+                self._counts["expirations"] += 1
+                self._counts["misses"] += 1
+                return None
+            self._entries.move_to_end(key)
+            self._counts["hits"] += 1
+            return value
+
+    def set(self, key, value, ttl=None):
+        ttl = self.ttl if ttl is None else ttl
+        expires_at = time.monotonic() + ttl if ttl else None
+        with self._lock:
+            self._entries[key] = (value, expires_at)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+                self._counts["evictions"] += 1
+
+    def delete(self, key):
+        with self._lock:
+            self._entries.pop(key, None)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def stats(self):
+        with self._lock:
+            return dict(self._counts, entries=len(self._entries))
+
+
+def bump_versions(connection, keys):
+    """Gives every (kind, entity_id) in `keys` a new version, in the transaction of `connection`."""
+    from bulk import insert_ignore  # bulk.py imports this module
+    by_kind = {}
+    for kind, entity_id in keys:
+        if entity_id is not None:
+            by_kind.setdefault(kind, set()).add(entity_id)
+    if not by_kind:
+        return
+    # time-based so a version is never handed out twice, even after its row was lost
+    version = time.time_ns()
+    # insert first: a concurrent first write then waits on the row and its UPDATE wins
+    insert_ignore(CacheVersion, [{"kind": kind, "entity_id": entity_id, "version": version}
+                                 for kind, ids in by_kind.items() for entity_id in ids],
+                  ['kind', 'entity_id'], ['kind'], connection)
+    for kind, ids in by_kind.items():
+        connection.execute(
+            update(CacheVersion).where(CacheVersion.kind == kind, CacheVersion.entity_id.in_(ids))
+            .values(version=version)
+        )
+
+
+class ResponseCache:
+    """Versioned payloads on top of a backend; the versions themselves live in the database."""
+
+    def __init__(self, backend):
+        self.backend = backend
+
+    def version(self, kind, entity_id):
+        version = db.session.scalar(
+            select(CacheVersion.version).where(CacheVersion.kind == kind, CacheVersion.entity_id == entity_id)
+        )
+        return format(version or 0, 'x')
+
+    def fetch(self, kind, entity_id, build):
+        """Returns (payload, version); `build` runs on a miss and may return None."""
+        version = self.version(kind, entity_id)
+        key = f"{kind}:{entity_id}:{version}"
+        payload = self.backend.get(key)
+        if payload is None:
+            payload = build()
+            if payload is not None:
+                self.backend.set(key, payload)
+        return payload, version
+
+    def stats(self):
+        return self.backend.stats()
+
+
+def _load_backend(config):
+    name = config.get('CACHE_BACKEND', 'memory')
+    if name == 'memory':
+        return MemoryCache.from_config(config)
+    module, _, attr = name.rpartition('.')
+    return getattr(import_module(module), attr).from_config(config)
+
+
+def init_cache(app):
+    app.extensions['response_cache'] = ResponseCache(_load_backend(app.config))
+
+
+def get_cache():
+    return current_app.extensions['response_cache']
+
+
+def cache_metrics(cache):
+    """Collector for metrics.registry exposing the backend stats."""
+    def collect():
+        stats = cache.stats()
+        values = {f"cache_{name}_total": {"": value} for name, value in stats.items() if name != "entries"}
+        values["cache_entries"] = {"": stats.get("entries", 0)}
+        return values
+    return collect
+
+
+def _build_user(user_id):
+    user = db.session.get(User, user_id)
+    return user.serialize() if user else None
+
+
+def _build_post(post_id):
+    post = db.session.get(Post, post_id)
+    if post is None:
+        return None
+    payload = post.serialize()
+    # the author is cached separately so profile changes don't need a post invalidation
+    payload.pop("user")
+    return payload
+
+
+def cached_user(user_id):
+    """Returns (payload, etag) for User.serialize(), or (None, None)."""
+    payload, version = get_cache().fetch('user', user_id, lambda: _build_user(user_id))
+    if payload is None:
+        return None, None
+    return payload, f"user-{user_id}-{version}"
+
+
+def cached_post(post_id):
+    """Returns (payload, etag) for Post.serialize(), or (None, None)."""
+    cache = get_cache()
+    payload, version = cache.fetch('post', post_id, lambda: _build_post(post_id))
+    if payload is None:
+        return None, None
+    user, user_etag = cached_user(payload["user_id"])
+    return dict(payload, user=user), f"post-{post_id}-{version}.{user_etag}"
+
+
+# entity -> [(cache kind, attribute holding the id)] invalidated when it changes
+INVALIDATES = {
+    User: [('user', 'id')],
+    Post: [('post', 'id'), ('user', 'user_id')],
+    Like: [('post', 'post_id')],
+    Comment: [('post', 'post_id')],
+    Follow: [('user', 'follower_id'), ('user', 'following_id')],
+}
+
+
+def invalidate_rows(model, rows):
+    """For changes made without the ORM (see bulk.py); rows are dicts. Call before committing."""
+    bump_versions(db.session.connection(), {(kind, row[attr]) for kind, attr in INVALIDATES[model] for row in rows})
+
+
+def _collect(mapper, connection, target):
+    session = object_session(target)
+    if session is None:
+        return
+    pending = session.info.setdefault('cache_invalidations', set())
+    for kind, attr in INVALIDATES[type(target)]:
+        pending.add((kind, getattr(target, attr)))
+
+
+for _model in INVALIDATES:
+    for _name in ('after_insert', 'after_update', 'after_delete'):
+        event.listen(_model, _name, _collect)
+
+
+@event.listens_for(Session, 'after_flush_postexec')
+def _bump_flushed(session, flush_context):
+    pending = session.info.pop('cache_invalidations', ())
+    if pending:
+        bump_versions(session.connection(), pending)
+
+
+@event.listens_for(Session, 'after_rollback')
+def _discard_rolled_back(session):
+    session.info.pop('cache_invalidations', None)
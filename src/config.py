@@ -0,0 +1,202 @@
+"""
+App configuration built from environment variables.
+
+configure_app() reads every setting the app uses. For the database, the pool defaults depend on the dialect and can be overridden with:
+    DB_POOL_SIZE, DB_MAX_OVERFLOW, DB_POOL_TIMEOUT, DB_POOL_RECYCLE,
+    DB_POOL_PRE_PING, DB_STATEMENT_TIMEOUT_MS
+If DB_MAX_CONNECTIONS is set, the pool of each gunicorn worker is sized so
+that WEB_CONCURRENCY workers together stay under it.
+
+DATABASE_REPLICA_URL adds a "replica" engine; GET/HEAD requests read from
+it and everything else (including any flush) goes to the primary.
+"""
+import os
+from flask import g, has_request_context, request
+from flask_sqlalchemy.session import Session
+from sqlalchemy.engine import make_url
+
+DEFAULT_DATABASE_URL = "sqlite:////tmp/test.db"
+
+PROFILES = {
+    'postgresql': {
+        'pool_size': 5,
+        'max_overflow': 5,
+        'pool_timeout': 10,
+        'pool_recycle': 1800,
+        'pool_pre_ping': True,
+    },
+    'mysql': {
+        'pool_size': 5,
+        'max_overflow': 5,
+        'pool_timeout': 10,
+        # below the server's wait_timeout so idle connections are never reused after being dropped
+        'pool_recycle': 280,
+        'pool_pre_ping': True,
+    },
+    # SQLite has no server to exhaust; keep SQLAlchemy's own pool choice
+    'sqlite': {},
+}
+
+INT_OPTIONS = {
+    'DB_POOL_SIZE': 'pool_size',
+    'DB_MAX_OVERFLOW': 'max_overflow',
+    'DB_POOL_TIMEOUT': 'pool_timeout',
+    'DB_POOL_RECYCLE': 'pool_recycle',
+}
+
+
+def database_url(name='DATABASE_URL', default=None):
+    url = os.getenv(name)
+    if url is None:
+        return default
+    return url.replace("postgres://", "postgresql://")
+
+
+def engine_options(url, env=os.environ):
+    dialect = make_url(url).get_backend_name()
+    options = dict(PROFILES.get(dialect, {}))
+
+    if dialect != 'sqlite' and env.get('DB_MAX_CONNECTIONS'):
+        workers = max(1, int(env.get('WEB_CONCURRENCY', 1)))
+        budget = max(2, int(env['DB_MAX_CONNECTIONS']) // workers)
+        options['pool_size'] = budget // 2
+        options['max_overflow'] = budget - budget // 2
+
+    for name, option in INT_OPTIONS.items():
+        if env.get(name) and dialect != 'sqlite':
+            options[option] = int(env[name])
+    if env.get('DB_POOL_PRE_PING'):
+        options['pool_pre_ping'] = env['DB_POOL_PRE_PING'] == '1'
+
+    timeout_ms = int(env.get('DB_STATEMENT_TIMEOUT_MS', 0))
+    if timeout_ms:
+        if dialect == 'postgresql':
+            options['connect_args'] = {'options': f'-c statement_timeout={timeout_ms}'}
+        elif dialect == 'mysql':
+            options['connect_args'] = {'init_command': f'SET SESSION MAX_EXECUTION_TIME={timeout_ms}'}
+        elif dialect == 'sqlite':
+            # no statement timeout in SQLite; bound the wait on a locked database instead
+            options['connect_args'] = {'timeout': timeout_ms / 1000}
+    return options
+
+
+def configure_database(app):
+    url = database_url(default=DEFAULT_DATABASE_URL)
+    app.config['SQLALCHEMY_DATABASE_URI'] = url
+    app.config['SQLALCHEMY_ENGINE_OPTIONS'] = engine_options(url)
+    replica_url = database_url('DATABASE_REPLICA_URL')
+    if replica_url:
+        app.config['SQLALCHEMY_BINDS'] = {'replica': dict(engine_options(replica_url), url=replica_url)}
+
+
+def configure_app(app):
+    configure_database(app)
+    app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
+
+    # home feed: "read" joins follow/post per request, "write" fans posts out to timelines
+    app.config['FEED_MODE'] = os.getenv('FEED_MODE', 'read')
+    app.config['TIMELINE_STORE'] = os.getenv('TIMELINE_STORE', 'sql')
+    app.config['TIMELINE_CAPACITY'] = int(os.getenv('TIMELINE_CAPACITY', 800))
+    # seconds between trims of the SQL timelines that grew, in each process with background threads
+    app.config['TIMELINE_TRIM_INTERVAL'] = int(os.getenv('TIMELINE_TRIM_INTERVAL', 300))
+    app.config['FANOUT_MAX_FOLLOWERS'] = int(os.getenv('FANOUT_MAX_FOLLOWERS', 10000))
+    # queue the fan-out as a job instead of writing timelines in the request; needs TIMELINE_STORE=sql
+    app.config['FANOUT_ASYNC'] = os.getenv('FANOUT_ASYNC') == '1'
+
+    # seconds between in-process expired story sweeps, unset to only use `flask stories sweep`
+    app.config['STORY_SWEEP_INTERVAL'] = int(os.getenv('STORY_SWEEP_INTERVAL', 0))
+    app.config['STORY_SWEEP_BATCH_SIZE'] = int(os.getenv('STORY_SWEEP_BATCH_SIZE', 500))
+    app.config['STORY_SWEEP_ARCHIVE'] = os.getenv('STORY_SWEEP_ARCHIVE') == '1'
+
+    # profile/post payload cache: "memory" or the dotted path of a shared cache.CacheBackend
+    app.config['CACHE_BACKEND'] = os.getenv('CACHE_BACKEND', 'memory')
+    app.config['CACHE_MAX_ENTRIES'] = int(os.getenv('CACHE_MAX_ENTRIES', 10000))
+    app.config['CACHE_TTL'] = int(os.getenv('CACHE_TTL', 300))
+
+    # admin list pages give up after this long on Postgres, 0 keeps DB_STATEMENT_TIMEOUT_MS
+    app.config['ADMIN_STATEMENT_TIMEOUT_MS'] = int(os.getenv('ADMIN_STATEMENT_TIMEOUT_MS', 5000))
+
+    # proxies in front of the app whose X-Forwarded-For is trusted for the client address, 0 when exposed directly
+    app.config['TRUSTED_PROXY_HOPS'] = int(os.getenv('TRUSTED_PROXY_HOPS', 0))
+
+    # token-bucket limits like "120/m" or "5/10s", see ratelimit.py; all unset means no limiting
+    app.config['RATE_LIMIT_IP'] = os.getenv('RATE_LIMIT_IP')
+    app.config['RATE_LIMIT_ROUTES'] = os.getenv('RATE_LIMIT_ROUTES', '')
+    app.config['RATE_LIMIT_EXEMPT'] = [name for name in os.getenv('RATE_LIMIT_EXEMPT', 'sitemap,get_metrics,static').split(',') if name]
+    app.config['RATE_LIMIT_STORE'] = os.getenv('RATE_LIMIT_STORE', 'memory')
+    app.config['RATE_LIMIT_SHARDS'] = int(os.getenv('RATE_LIMIT_SHARDS', 64))
+    app.config['RATE_LIMIT_MAX_KEYS'] = int(os.getenv('RATE_LIMIT_MAX_KEYS', 100000))
+
+    # uploads under MEDIA_DIR are served as MEDIA_URL_PREFIX + path and processed by `flask media process`
+    app.config['MEDIA_DIR'] = os.getenv('MEDIA_DIR')
+    app.config['MEDIA_URL_PREFIX'] = os.getenv('MEDIA_URL_PREFIX', '/media/')
+    app.config['MEDIA_THUMB_SIZES'] = tuple(int(size) for size in os.getenv('MEDIA_THUMB_SIZES', '150,320,640').split(','))
+    app.config['MEDIA_WORKERS'] = int(os.getenv('MEDIA_WORKERS', 0))
+    app.config['MEDIA_MAX_PIXELS'] = int(os.getenv('MEDIA_MAX_PIXELS', 50_000_000))
+    app.config['MEDIA_PLACEHOLDER_COMPONENTS'] = tuple(int(n) for n in os.getenv('MEDIA_PLACEHOLDER_COMPONENTS', '4x3').split('x'))
+
+    # delta sync only returns likes/comments this old, so rows committed late aren't skipped
+    app.config['SYNC_SETTLE_SECONDS'] = float(os.getenv('SYNC_SETTLE_SECONDS', 2))
+
+    # likes and comments older than this move to the archive tables on `flask archive run`
+    app.config['ARCHIVE_AFTER_DAYS'] = int(os.getenv('ARCHIVE_AFTER_DAYS', 90))
+
+    # explore rankings, see explore.py
+    app.config['EXPLORE_TOP_K'] = int(os.getenv('EXPLORE_TOP_K', 1000))
+    app.config['EXPLORE_DECAY_HOURS'] = float(os.getenv('EXPLORE_DECAY_HOURS', 6))
+
+    # follow graph: mmap this snapshot (written by `flask graph snapshot`) instead of reading the table,
+    # and catch up with follows and unfollows from other processes every GRAPH_REFRESH_INTERVAL seconds
+    app.config['GRAPH_SNAPSHOT'] = os.getenv('GRAPH_SNAPSHOT')
+    app.config['GRAPH_REFRESH_INTERVAL'] = float(os.getenv('GRAPH_REFRESH_INTERVAL', 60))
+    # rows committed this long after a higher id was read are still picked up
+    app.config['GRAPH_SETTLE_SECONDS'] = float(os.getenv('GRAPH_SETTLE_SECONDS', 30))
+
+    # background jobs: JOB_WORKERS threads in the app process, or run `flask jobs work`
+    app.config['JOB_WORKERS'] = int(os.getenv('JOB_WORKERS', 0))
+    app.config['JOB_BATCH_SIZE'] = int(os.getenv('JOB_BATCH_SIZE', 100))
+    app.config['JOB_POLL_INTERVAL'] = float(os.getenv('JOB_POLL_INTERVAL', 1.0))
+    app.config['JOB_MAX_ATTEMPTS'] = int(os.getenv('JOB_MAX_ATTEMPTS', 5))
+    app.config['JOB_BACKOFF_BASE'] = float(os.getenv('JOB_BACKOFF_BASE', 5))
+    app.config['JOB_BACKOFF_MAX'] = float(os.getenv('JOB_BACKOFF_MAX', 3600))
+    app.config['JOB_LOCK_TIMEOUT'] = int(os.getenv('JOB_LOCK_TIMEOUT', 300))
+
+    # instrumentation: METRICS_DIR lets /metrics add up every gunicorn worker
+    app.config['METRICS_DIR'] = os.getenv('METRICS_DIR')
+    app.config['METRICS_FLUSH_INTERVAL'] = float(os.getenv('METRICS_FLUSH_INTERVAL', 1.0))
+    app.config['SLOW_QUERY_MS'] = float(os.getenv('SLOW_QUERY_MS', 0))
+
+
+def use_primary():
+    """Sends the rest of this request's reads to the primary (read-your-writes)."""
+    g.use_primary = True
+
+
+class RoutingSession(Session):
+    """Routes reads of GET/HEAD requests to the replica engine when one is configured."""
+
+    def get_bind(self, mapper=None, clause=None, bind=None, **kwargs):
+        if bind is None and not self._flushing and has_request_context() \
+                and request.method in ('GET', 'HEAD') and not g.get('use_primary'):
+            replica = self._db.engines.get('replica')
+            if replica is not None:
+                return replica
+        return super().get_bind(mapper, clause=clause, bind=bind, **kwargs)
+
+
+def pool_metrics(app, db):
+    """Collector for metrics.registry with the pool state of every engine."""
+    with app.app_context():
+        engines = {name or 'primary': engine for name, engine in db.engines.items()}
+
+    def collect():
+        values = {}
+        for name, engine in engines.items():
+            labels = f'engine="{name}"'
+            pool = engine.pool
+            for metric, attr in (('size', 'size'), ('checked_in', 'checkedin'),
+                                 ('checked_out', 'checkedout'), ('overflow', 'overflow')):
+                if hasattr(pool, attr):
+                    values.setdefault(f"db_pool_{metric}", {})[labels] = getattr(pool, attr)()
+        return values
+    return collect
@@ -0,0 +1,117 @@
+"""
+Keeps the denormalized counter columns on User and Post in sync.
+
+Counters are bumped from mapper events with a single UPDATE on the same
+connection as the INSERT/DELETE that caused them, so they commit or roll back
+together with it. `flask counters reconcile` rebuilds drifted values in bulk.
+"""
+import click
+from flask.cli import AppGroup
+from sqlalchemy import event, func, select, update
+from sqlalchemy.orm import Session, object_session
+from models import db, User, Post, Comment, Like, Follow, LikeArchive, CommentArchive
+
+# rows moved out by archive.py still count
+ARCHIVED = {Like: LikeArchive, Comment: CommentArchive}
+
+# row model -> [(counter model, counter column, foreign key on the row)]
+COUNTERS = {
+    Post: [(User, 'posts_count', 'user_id')],
+    Like: [(Post, 'likes_count', 'post_id')],
+    Comment: [(Post, 'comments_count', 'post_id')],
+    Follow: [
+        (User, 'followers_count', 'following_id'),
+        (User, 'following_count', 'follower_id'),
+    ],
+}
+
+
+def bump_counters(connection, model, key_counts, column, sign=1):
+    # key_counts: {primary key: number of rows added (or removed with sign=-1)}
+    counter = getattr(model, column)
+    for key, count in key_counts.items():
+        connection.execute(
+            update(model).where(model.id == key).values({column: counter + sign * count})
+        )
+
+
+def _apply(connection, target, sign):
+    session = object_session(target)
+    for model, column, fk in COUNTERS[type(target)]:
+        key = getattr(target, fk)
+        bump_counters(connection, model, {key: 1}, column, sign)
+        if session is not None:
+            session.info.setdefault('stale_counters', set()).add((model, key, column))
+
+
+def _after_insert(mapper, connection, target):
+    _apply(connection, target, 1)
+
+
+def _after_delete(mapper, connection, target):
+    _apply(connection, target, -1)
+
+
+for _model in COUNTERS:
+    event.listen(_model, 'after_insert', _after_insert)
+    event.listen(_model, 'after_delete', _after_delete)
+
+
+@event.listens_for(Session, 'after_flush_postexec')
+def _expire_stale_counters(session, flush_context):
+    # the UPDATEs above bypass the ORM, so reload the counters on next access
+    for model, key, column in session.info.pop('stale_counters', ()):
+        obj = session.identity_map.get(session.identity_key(model, key))
+        if obj is not None:
+            session.expire(obj, [column])
+
+
+def recount(row_model, keys=None):
+    """Recomputes the counters fed by `row_model`, for every row or only `keys`.
+
+    `keys` maps counter column -> ids to refresh. Returns {column: rows fixed}.
+    """
+    fixed = {}
+    for model, column, fk in COUNTERS[row_model]:
+        actual = (
+            select(func.count())
+            .select_from(row_model)
+            .where(getattr(row_model, fk) == model.id)
+            .scalar_subquery()
+        )
+        if row_model in ARCHIVED:
+            archive = ARCHIVED[row_model]
+            actual = actual + (
+                select(func.count())
+                .select_from(archive)
+                .where(getattr(archive, fk) == model.id)
+                .scalar_subquery()
+            )
+        stmt = update(model).where(getattr(model, column) != actual)
+        if keys is not None:
+            stmt = stmt.where(model.id.in_(keys.get(column, ())))
+        result = db.session.execute(
+            stmt.values({column: actual}).execution_options(synchronize_session=False)
+        )
+        fixed[f"{model.__tablename__}.{column}"] = result.rowcount
+    return fixed
+
+
+def reconcile_counters(commit=True):
+    """Rewrites every drifted counter with one correlated UPDATE per column."""
+    fixed = {}
+    for row_model in COUNTERS:
+        fixed.update(recount(row_model))
+    if commit:
+        db.session.commit()
+    return fixed
+
+
+counters_cli = AppGroup('counters', help='Maintain the denormalized counter columns.')
+
+
+@counters_cli.command('reconcile')
+def reconcile_command():
+    """Rebuild drifted counters from the source tables."""
+    for name, count in reconcile_counters().items():
+        click.echo(f"{name}: {count} rows fixed")
@@ -0,0 +1,199 @@
+"""
+Synthetic Instagram-shaped data for benchmarks: `flask seed`.
+
+The shape is skewed the way real traffic is: follower counts follow a
+power law (a few accounts are followed by a large share of users),
+likes arrive in bursts right after a post is published, and about half
+of the stories are already expired. Rows are written with Core
+executemany in chunks, bypassing the ORM, and the counter columns are
+rebuilt once at the end, like the search and hashtag indexes.
+"""
+import random
+import time
+from bisect import bisect_left
+from datetime import datetime, timedelta
+from itertools import accumulate
+import click
+from flask.cli import with_appcontext
+from sqlalchemy import func, insert, select
+from models import db, User, Post, Comment, Like, Follow, Story
+from counters import reconcile_counters
+from search import rebuild_search_index
+from tags import backfill_tags
+
+CHUNK_SIZE = 5000
+WORDS = ("sunset", "coffee", "travel", "friends", "food", "beach", "city", "art", "music", "gym")
+LOCATIONS = ("Madrid", "Miami", "Caracas", "Bogota", "Lisbon", "Mexico City", "Buenos Aires", "Lima")
+
+
+class Zipf:
+    """Draws ranks 0..n-1 with probability proportional to 1 / (rank + 1) ** alpha."""
+
+    def __init__(self, n, alpha, rng):
+        self.rng = rng
+        self.cumulative = list(accumulate(1 / (rank + 1) ** alpha for rank in range(n)))
+
+    def draw(self):
+        return bisect_left(self.cumulative, self.rng.random() * self.cumulative[-1])
+
+
+class BulkWriter:
+    """Buffers rows and writes them CHUNK_SIZE at a time so memory stays flat."""
+
+    def __init__(self, model):
+        self.model = model
+        self.rows = []
+        self.count = 0
+
+    def add(self, row):
+        self.rows.append(row)
+        if len(self.rows) >= CHUNK_SIZE:
+            self.flush()
+
+    def flush(self):
+        if self.rows:
+            db.session.execute(insert(self.model), self.rows)
+            db.session.commit()
+            self.count += len(self.rows)
+            self.rows = []
+
+    def close(self):
+        self.flush()
+        return self.count
+
+
+def _write(model, rows):
+    writer = BulkWriter(model)
+    for row in rows:
+        writer.add(row)
+    return writer.close()
+
+
+def _next_id(model):
+    return (db.session.scalar(select(func.max(model.id))) or 0) + 1
+
+
+def _advance_sequences(*models):
+    # ids written explicitly don't move Postgres sequences, the next ORM insert would reuse them
+    if db.session.connection().dialect.name != 'postgresql':
+        return
+    for model in models:
+        table = db.session.connection().dialect.identifier_preparer.format_table(model.__table__)
+        db.session.execute(select(func.setval(
+            func.pg_get_serial_sequence(table, 'id'), select(func.max(model.id)).scalar_subquery()
+        )))
+    db.session.commit()
+
+
+def generate(users=10000, follows_per_user=50, posts_per_user=5, likes_per_post=20,
+             comments_ratio=0.1, stories_ratio=0.2, seed=None, now=None):
+    """Inserts a synthetic dataset and returns {table: rows inserted}."""
+    rng = random.Random(seed)
+    now = now or datetime.utcnow()
+    counts = {}
+
+    first_user = _next_id(User)
+    user_ids = list(range(first_user, first_user + users))
+    popularity = list(user_ids)
+    rng.shuffle(popularity)
+    counts['user'] = _write(User, ({
+        "id": user_id,
+        "username": f"user{user_id}",
+        "email": f"user{user_id}@example.com",
+        "password": "x",
+        "full_name": f"{rng.choice(WORDS).title()} {rng.choice(WORDS).title()} {user_id}",
+        "is_private": rng.random() < 0.1,
+        "is_active": True,
+        "created_at": now - timedelta(days=rng.uniform(30, 720)),
+    } for user_id in user_ids))
+
+    # power-law in-degree: `popularity[rank]` is the rank-th most followed account
+    zipf = Zipf(users, 1.1, rng)
+    follows = BulkWriter(Follow)
+    for follower_id in user_ids:
+        wanted = min(users - 1, int(rng.paretovariate(1.5) * follows_per_user / 3))
+        targets = set()
+        for _ in range(wanted * 2):
+            if len(targets) >= wanted:
+                break
+            target = popularity[zipf.draw()]
+            if target != follower_id:
+                targets.add(target)
+        for target in targets:
+            follows.add({
+                "follower_id": follower_id,
+                "following_id": target,
+                "created_at": now - timedelta(days=rng.uniform(0, 365)),
+            })
+    counts['follow'] = follows.close()
+
+    next_post = _next_id(Post)
+    posts = BulkWriter(Post)
+    published = []
+    for user_id in user_ids:
+        for _ in range(int(rng.expovariate(1 / posts_per_user))):
+            created_at = now - timedelta(hours=rng.uniform(0, 24 * 90))
+            published.append((next_post, created_at))
+            posts.add({
+                "id": next_post,
+                "image_url": f"https://picsum.photos/seed/{next_post}/1080/1080",
+                "caption": " ".join(f"#{word}" if rng.random() < 0.3 else word
+                                    for word in rng.sample(WORDS, rng.randint(2, 6))),
+                "location": rng.choice(LOCATIONS) if rng.random() < 0.4 else None,
+                "user_id": user_id,
+                "created_at": created_at,
+            })
+            next_post += 1
+    counts['post'] = posts.close()
+
+    likes, comments = BulkWriter(Like), BulkWriter(Comment)
+    liker = Zipf(users, 0.8, rng)
+    for post_id, published_at in published:
+        wanted = min(users, int(rng.paretovariate(1.3) * likes_per_post / 4))
+        likers = {user_ids[liker.draw()] for _ in range(wanted)}
+        for user_id in likers:
+            # bursty: most likes land in the first hours after publishing
+            created_at = min(now, published_at + timedelta(hours=rng.expovariate(1 / 3)))
+            likes.add({"user_id": user_id, "post_id": post_id, "created_at": created_at})
+            if rng.random() < comments_ratio:
+                comments.add({
+                    "user_id": user_id,
+                    "post_id": post_id,
+                    "content": " ".join(rng.sample(WORDS, 3)),
+                    "created_at": created_at + timedelta(minutes=rng.uniform(0, 30)),
+                })
+    counts['like'] = likes.close()
+    counts['comment'] = comments.close()
+
+    stories = []
+    for user_id in rng.sample(user_ids, int(users * stories_ratio)):
+        created_at = now - timedelta(hours=rng.uniform(0, 48))
+        stories.append({
+            "media_url": f"https://picsum.photos/seed/story{user_id}/1080/1920",
+            "user_id": user_id,
+            "created_at": created_at,
+            "expires_at": created_at + timedelta(hours=24),
+        })
+    counts['story'] = _write(Story, stories)
+
+    _advance_sequences(User, Post)
+    reconcile_counters()
+    rebuild_search_index()
+    backfill_tags()
+    return counts
+
+
+@click.command('seed')
+@with_appcontext
+@click.option('--users', default=10000, show_default=True)
+@click.option('--follows-per-user', default=50, show_default=True, help='Scale of the follow distribution.')
+@click.option('--posts-per-user', default=5, show_default=True, help='Mean posts per user.')
+@click.option('--likes-per-post', default=20, show_default=True, help='Scale of the like distribution.')
+@click.option('--seed', type=int, default=None, help='Random seed for a reproducible dataset.')
+def seed_command(users, follows_per_user, posts_per_user, likes_per_post, seed):
+    """Fill the database with a synthetic, skewed dataset."""
+    started = time.perf_counter()
+    counts = generate(users, follows_per_user, posts_per_user, likes_per_post, seed=seed)
+    for table, count in counts.items():
+        click.echo(f"{table}: {count} rows")
+    click.echo(f"done in {time.perf_counter() - started:.1f}s")
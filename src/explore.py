@@ -0,0 +1,120 @@
+"""
+Explore: recent public posts ranked by engagement, served from post_score.
+
+`flask explore compute` (run it from cron, or with --every) scores every
+period in one set-based INSERT ... SELECT: each like and comment made in
+the period counts its weight divided by 1 + age / EXPLORE_DECAY_HOURS, so
+fresh engagement counts most. Only the top EXPLORE_TOP_K posts are kept,
+and the old rows of the period are replaced in the same transaction.
+GET /explore only reads that table.
+"""
+import base64
+import time
+from datetime import datetime, timedelta
+import click
+from flask import current_app
+from flask.cli import AppGroup
+from sqlalchemy import and_, delete, event, func, insert, literal, or_, select, text, union_all
+from models import db, User, Post, Comment, Like, PostScore
+from utils import APIException
+
+PERIODS = {'24h': timedelta(hours=24), '7d': timedelta(days=7)}
+WEIGHTS = ((Like, 1.0), (Comment, 3.0))
+
+
+def encode_cursor(score, post_id):
+    return base64.urlsafe_b64encode(f"{score!r}|{post_id}".encode()).decode().rstrip('=')
+
+
+def decode_cursor(token):
+    try:
+        raw = base64.urlsafe_b64decode(token + '=' * (-len(token) % 4)).decode()
+        score, post_id = raw.split('|')
+        return float(score), int(post_id)
+    except (ValueError, UnicodeDecodeError):
+        raise APIException('Invalid cursor', status_code=400)
+
+
+def _hours_since(column, now, dialect):
+    if dialect == 'sqlite':
+        return (func.julianday(literal(now)) - func.julianday(column)) * 24
+    if dialect == 'postgresql':
+        return func.extract('epoch', literal(now) - column) / 3600
+    return func.timestampdiff(text('SECOND'), column, literal(now)) / 3600
+
+
+def compute_scores(period, now=None, top_k=None):
+    """Rewrites the top `top_k` posts of `period`; returns how many were stored."""
+    now = now or datetime.utcnow()
+    since = now - PERIODS[period]
+    top_k = top_k or current_app.config.get('EXPLORE_TOP_K', 1000)
+    decay = current_app.config.get('EXPLORE_DECAY_HOURS', 6.0)
+    dialect = db.session.get_bind().dialect.name
+
+    events = union_all(*(
+        select(model.post_id.label('post_id'),
+               (literal(weight) / (1 + _hours_since(model.created_at, now, dialect) / decay)).label('points'))
+        .join(Post, Post.id == model.post_id)
+        .join(User, User.id == Post.user_id)
+        .where(model.created_at >= since, Post.created_at >= since, User.is_private.is_(False))
+        for model, weight in WEIGHTS
+    )).subquery()
+    score = func.sum(events.c.points)
+    top = (
+        select(literal(period), events.c.post_id, score, literal(now))
+        .group_by(events.c.post_id)
+        .order_by(score.desc(), events.c.post_id.desc())
+        .limit(top_k)
+    )
+    db.session.execute(delete(PostScore).where(PostScore.period == period))
+    result = db.session.execute(
+        insert(PostScore).from_select(['period', 'post_id', 'score', 'computed_at'], top)
+    )
+    db.session.commit()
+    return result.rowcount
+
+
+def explore_page(period, cursor=None, limit=20, options=()):
+    if period not in PERIODS:
+        raise APIException(f"period must be one of {', '.join(PERIODS)}", status_code=400)
+    stmt = select(PostScore.score, PostScore.post_id).where(PostScore.period == period)
+    if cursor:
+        score, post_id = decode_cursor(cursor)
+        stmt = stmt.where(or_(
+            PostScore.score < score,
+            and_(PostScore.score == score, PostScore.post_id < post_id),
+        ))
+    rows = db.session.execute(
+        stmt.order_by(PostScore.score.desc(), PostScore.post_id.desc()).limit(limit + 1)
+    ).all()
+    next_cursor = encode_cursor(*rows[limit - 1]) if len(rows) > limit else None
+    rows = rows[:limit]
+    posts = {post.id: post for post in db.session.scalars(
+        select(Post).where(Post.id.in_([post_id for _, post_id in rows])).options(*options)
+    )} if rows else {}
+    return [posts[post_id] for _, post_id in rows if post_id in posts], next_cursor
+
+
+@event.listens_for(Post, 'before_delete')
+def _drop_scores(mapper, connection, target):
+    connection.execute(delete(PostScore).where(PostScore.post_id == target.id))
+
+
+explore_cli = AppGroup('explore', help='Maintain the explore rankings.')
+
+
+@explore_cli.command('compute')
+@click.option('--period', 'periods', multiple=True, type=click.Choice(list(PERIODS)),
+              help='Only these periods, all by default.')
+@click.option('--top-k', type=int, default=None, help='Posts kept per period, EXPLORE_TOP_K by default.')
+@click.option('--every', type=float, default=None, help='Keep running, recomputing every N seconds.')
+def compute_command(periods, top_k, every):
+    """Score recent posts by weighted, decayed engagement."""
+    while True:
+        for period in periods or PERIODS:
+            started = time.perf_counter()
+            count = compute_scores(period, top_k=top_k)
+            click.echo(f"{period}: {count} posts scored in {time.perf_counter() - started:.2f}s")
+        if not every:
+            return
+        time.sleep(every)
@@ -0,0 +1,85 @@
+"""
+Streaming NDJSON export of everything an account wrote: its posts, likes
+and comments. GET /users/<id>/export and `flask export user`.
+
+Rows are read by primary key with yield_per, which turns on server-side
+cursors where the driver has them, and written one JSON line at a time,
+so memory stays flat whatever the size of the account. Every line carries
+a cursor; passing the last one received resumes the export right after it.
+"""
+import base64
+import json
+from datetime import datetime
+import click
+from flask.cli import AppGroup
+from sqlalchemy import select
+from models import db, Post, Like, Comment, LikeArchive, CommentArchive
+from utils import APIException
+
+# exported in this order, each one by ascending id: (section, row type, model)
+SECTIONS = (
+    ('post', 'post', Post),
+    ('like_archive', 'like', LikeArchive),
+    ('like', 'like', Like),
+    ('comment_archive', 'comment', CommentArchive),
+    ('comment', 'comment', Comment),
+)
+YIELD_PER = 1000
+
+
+def encode_cursor(section, row_id):
+    return base64.urlsafe_b64encode(f"{section}|{row_id}".encode()).decode().rstrip('=')
+
+
+def decode_cursor(token):
+    try:
+        raw = base64.urlsafe_b64decode(token + '=' * (-len(token) % 4)).decode()
+        section, row_id = raw.split('|')
+        if section not in [name for name, _, _ in SECTIONS]:
+            raise ValueError(section)
+        return section, int(row_id)
+    except (ValueError, UnicodeDecodeError):
+        raise APIException('Invalid cursor', status_code=400)
+
+
+def _json(value):
+    return value.isoformat() if isinstance(value, datetime) else value
+
+
+def export_rows(user_id, cursor=None, yield_per=YIELD_PER):
+    """Yields (row type, cursor, row dict) for every row `user_id` wrote."""
+    names = [name for name, _, _ in SECTIONS]
+    start, after = (names[0], 0) if not cursor else decode_cursor(cursor)
+    for name, kind, model in SECTIONS[names.index(start):]:
+        table = model.__table__
+        stmt = (select(table)
+                .where(table.c.user_id == user_id, table.c.id > (after if name == start else 0))
+                .order_by(table.c.id)
+                .execution_options(yield_per=yield_per))
+        for row in db.session.execute(stmt):
+            data = {key: _json(value) for key, value in row._mapping.items()}
+            yield kind, encode_cursor(name, data['id']), data
+
+
+def export_ndjson(user_id, cursor=None):
+    for kind, row_cursor, data in export_rows(user_id, cursor):
+        yield json.dumps({"type": kind, "cursor": row_cursor, "data": data}, separators=(',', ':')) + "\n"
+
+
+export_cli = AppGroup('export', help='Export account data as NDJSON.')
+
+
+@export_cli.command('user')
+@click.argument('user_id', type=int)
+@click.option('--output', type=click.File('w'), default='-', help='File to write, stdout by default.')
+@click.option('--cursor', default=None, help='Resume after the line carrying this cursor.')
+def export_user_command(user_id, output, cursor):
+    """Write the posts, likes and comments of USER_ID, one JSON object per line."""
+    count = 0
+    try:
+        for line in export_ndjson(user_id, cursor):
+            output.write(line)
+            count += 1
+    except APIException as error:
+        raise click.BadParameter(error.message, param_hint='--cursor')
+    click.echo(f"exported {count} rows", err=True)
@@ -0,0 +1,55 @@
+"""
+Home feed: posts from the accounts a user follows, newest first.
+
+With FEED_MODE=read (the default) the feed is a keyset query served by
+uq_follow_follower_id_following_id and ix_post_user_id_created_at_id.
+With FEED_MODE=write it is read from the materialized timeline (see
+timeline.py) and posts from followed accounts too large to fan out are
+merged in at query time.
+"""
+from sqlalchemy import select
+from models import db, User, Post, Follow
+from pagination import decode_cursor, encode_cursor, keyset_query, paginate
+from timeline import fan_out_enabled, fanout_limit, get_timeline_store
+
+
+def followed_ids(user_id):
+    return select(Follow.following_id).where(Follow.follower_id == user_id)
+
+
+def read_feed(user_id, cursor=None, limit=20, options=()):
+    if fan_out_enabled():
+        return read_materialized_feed(user_id, cursor, limit, options)
+    stmt = select(Post).where(Post.user_id.in_(followed_ids(user_id))).options(*options)
+    return paginate(stmt, Post.created_at, Post.id, cursor, limit)
+
+
+def read_materialized_feed(user_id, cursor=None, limit=20, options=()):
+    before = decode_cursor(cursor) if cursor else None
+    entries = get_timeline_store().range(user_id, before, limit + 1)
+
+    # accounts over the fan-out limit never write to timelines
+    celebrities = followed_ids(user_id).join(User, User.id == Follow.following_id).where(
+        User.followers_count > fanout_limit()
+    )
+    # limit + 1 from each source, so the merged page knows whether either has more
+    merged = db.session.scalars(keyset_query(
+        select(Post).where(Post.user_id.in_(celebrities)).options(*options), Post.created_at, Post.id, cursor, limit + 1
+    )).all()
+    keys = {(post.created_at, post.id) for post in merged}
+    keys.update(entries)
+    keys = sorted(keys, reverse=True)[:limit + 1]
+
+    posts = {post.id: post for post in merged}
+    missing = [post_id for _, post_id in keys if post_id not in posts]
+    if missing:
+        posts.update((post.id, post) for post in db.session.scalars(
+            select(Post).where(Post.id.in_(missing)).options(*options)
+        ))
+
+    next_cursor = None
+    if len(keys) > limit:
+        keys = keys[:limit]
+        next_cursor = encode_cursor(*keys[-1])
+    # posts deleted after being fanned out are simply skipped
+    return [posts[post_id] for _, post_id in keys if post_id in posts], next_cursor
@@ -0,0 +1,460 @@
+"""
+The follow graph held in memory as compressed sparse rows (CSR).
+
+Each direction is two flat arrays: `offsets[u]:offsets[u + 1]` is the slice
+of `targets` holding the sorted ids u follows (or is followed by), so the
+whole graph costs about 8 bytes per user id and 4 per edge in each
+direction, and a follow check is a binary search. Follows and unfollows
+committed in this process land in a small overlay on top of the arrays.
+
+Each process builds its graph in a background thread, or mmaps the
+snapshot `flask graph snapshot` wrote to GRAPH_SNAPSHOT. Until it is ready,
+requests are answered by SQLFollowGraph from the follow table. Every
+GRAPH_REFRESH_INTERVAL seconds the thread reloads a newer snapshot. It
+also catches up with other processes: follows with a higher id than it
+has seen, and unfollows, which leave a row in follow_tombstone. Each
+tombstoned pair is checked against the follow table, so an unfollow and a
+follow again end up in the right order.
+
+Ids are taken at insert but only visible at commit, so a row can show up
+after one with a higher id was read. Each catch-up therefore also re-reads
+the rows written in the GRAPH_SETTLE_SECONDS before the previous one, like
+the settle window of sync.py; applying a row twice changes nothing.
+Tombstones older than TOMBSTONE_RETENTION are purged by the refresh, and
+a snapshot that old is rebuilt from the table instead of loaded.
+"""
+import logging
+import mmap
+import os
+import struct
+import threading
+import time
+from array import array
+from bisect import bisect_left
+from collections import Counter
+from datetime import datetime, timedelta
+import click
+from flask import current_app, has_app_context
+from flask.cli import AppGroup
+from sqlalchemy import delete, event, func, insert, or_, select, tuple_
+from sqlalchemy.orm import Session, object_session
+from models import db, User, Follow, FollowTombstone
+
+logger = logging.getLogger(__name__)
+
+MAGIC = b'FGRAPH02'
+# magic, offsets length, edge count, highest follow id, highest tombstone id, build time
+HEADER = struct.Struct('<8sQQQQd')
+MAX_SUGGESTION_SOURCES = 500
+# a worker further behind than this has long reloaded the graph
+TOMBSTONE_RETENTION = timedelta(days=1)
+
+
+def _csr(pairs, size):
+    """Offsets and targets for (source, target) pairs sorted by source then target."""
+    offsets = array('q', bytes(8 * (size + 1)))
+    targets = array('i')
+    for source, target in pairs:
+        offsets[source + 1] += 1
+        targets.append(target)
+    for i in range(size):
+        offsets[i + 1] += offsets[i]
+    return offsets, targets
+
+
+def _pad(f):
+    f.write(bytes(-f.tell() % 8))
+
+
+class CSR:
+
+    def __init__(self, offsets, targets):
+        self.offsets = offsets
+        self.targets = targets
+
+    def row(self, node):
+        if node < 0 or node + 1 >= len(self.offsets):
+            return self.targets[0:0]
+        return self.targets[self.offsets[node]:self.offsets[node + 1]]
+
+    def has(self, source, target):
+        row = self.row(source)
+        i = bisect_left(row, target)
+        return i < len(row) and row[i] == target
+
+    def degree(self, node):
+        if node < 0 or node + 1 >= len(self.offsets):
+            return 0
+        return self.offsets[node + 1] - self.offsets[node]
+
+
+class FollowGraph:
+
+    def __init__(self, following, followers, watermark=0, tombstone_watermark=0, built_at=0.0):
+        self.following = following
+        self.followers = followers
+        self.watermark = watermark
+        self.tombstone_watermark = tombstone_watermark
+        self.built_at = built_at
+        # highest follow and tombstone ids applied, from the arrays or caught up since
+        self.seen_id = watermark
+        self.seen_tombstone_id = tombstone_watermark
+        # when the table was last read; the next catch-up re-reads the settle window before it
+        self.read_at = datetime.utcfromtimestamp(built_at)
+        self._lock = threading.Lock()
+        # direction -> node -> ids added to / removed from its array row
+        self._added = {'out': {}, 'in': {}}
+        self._removed = {'out': {}, 'in': {}}
+
+    @classmethod
+    def build(cls, connection=None):
+        connection = connection or db.session.connection()
+        built_at = time.time()
+        # read before the edges: anything deleted while they are read is caught up later
+        tombstone_watermark = connection.scalar(select(func.max(FollowTombstone.id))) or 0
+        watermark = connection.scalar(select(func.max(Follow.id))) or 0
+        size = max(connection.scalar(select(func.max(Follow.follower_id))) or 0,
+                   connection.scalar(select(func.max(Follow.following_id))) or 0) + 1
+        directions = []
+        for source, target in ((Follow.follower_id, Follow.following_id), (Follow.following_id, Follow.follower_id)):
+            rows = connection.execute(
+                select(source, target).where(Follow.id <= watermark)
+                .order_by(source, target).execution_options(yield_per=10000)
+            )
+            directions.append(CSR(*_csr(rows, size)))
+        return cls(*directions, watermark=watermark, tombstone_watermark=tombstone_watermark, built_at=built_at)
+
+    def save(self, path):
+        with open(path + '.tmp', 'wb') as f:
+            f.write(HEADER.pack(MAGIC, len(self.following.offsets), len(self.following.targets),
+                                self.watermark, self.tombstone_watermark, self.built_at))
+            for csr in (self.following, self.followers):
+                _pad(f)
+                csr.offsets.tofile(f)
+                _pad(f)
+                csr.targets.tofile(f)
+        os.replace(path + '.tmp', path)
+
+    @classmethod
+    def load(cls, path):
+        """Maps a snapshot read-only; the arrays are views on the page cache, not copies."""
+        with open(path, 'rb') as f:
+            data = memoryview(mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ))
+        magic, size, edges, watermark, tombstone_watermark, built_at = HEADER.unpack_from(data)
+        if magic != MAGIC:
+            raise ValueError(f"{path} is not a follow graph snapshot")
+        position = HEADER.size
+        parts = []
+        for _ in range(2):
+            for code, length in (('q', size), ('i', edges)):
+                position += -position % 8
+                width = array(code).itemsize
+                parts.append(data[position:position + width * length].cast(code))
+                position += width * length
+        return cls(CSR(parts[0], parts[1]), CSR(parts[2], parts[3]), watermark, tombstone_watermark, built_at)
+
+    def apply(self, follower_id, following_id, added):
+        in_arrays = self.following.has(follower_id, following_id)
+        with self._lock:
+            for direction, source, target in (('out', follower_id, following_id), ('in', following_id, follower_id)):
+                extra, missing = self._added[direction], self._removed[direction]
+                if added:
+                    missing.get(source, set()).discard(target)
+                    if not in_arrays:
+                        extra.setdefault(source, set()).add(target)
+                else:
+                    extra.get(source, set()).discard(target)
+                    if in_arrays:
+                        missing.setdefault(source, set()).add(target)
+
+    def _ids(self, csr, direction, node):
+        row = csr.row(node)
+        with self._lock:
+            extra = self._added[direction].get(node)
+            missing = self._removed[direction].get(node)
+            if not extra and not missing:
+                return row
+            return sorted(set(row).difference(missing or ()).union(extra or ()))
+
+    def following_ids(self, user_id):
+        return self._ids(self.following, 'out', user_id)
+
+    def follower_ids(self, user_id):
+        return self._ids(self.followers, 'in', user_id)
+
+    def follows(self, follower_id, following_id):
+        with self._lock:
+            if following_id in self._removed['out'].get(follower_id, ()):
+                return False
+            if following_id in self._added['out'].get(follower_id, ()):
+                return True
+        return self.following.has(follower_id, following_id)
+
+    def mutuals(self, user_id):
+        """Accounts `user_id` follows that follow it back."""
+        return sorted(set(self.following_ids(user_id)).intersection(self.follower_ids(user_id)))
+
+    def followed_by(self, user_id, target_id):
+        """Accounts `user_id` follows that also follow `target_id`."""
+        return sorted(set(self.following_ids(user_id)).intersection(self.follower_ids(target_id)))
+
+    def suggestions(self, user_id, limit=20):
+        """Two hops away, ranked by how many of the accounts `user_id` follows follow them."""
+        following = self.following_ids(user_id)
+        scores = Counter()
+        for followed in following[:MAX_SUGGESTION_SOURCES]:
+            scores.update(self.following_ids(followed))
+        scores.pop(user_id, None)
+        for followed in following:
+            scores.pop(followed, None)
+        top = sorted(scores.items(), key=lambda item: (-item[1], item[0]))[:limit * 4]
+        # ties go to the accounts with more followers
+        top.sort(key=lambda item: (-item[1], -self.followers.degree(item[0]), item[0]))
+        return top[:limit]
+
+    def catch_up(self, connection, settle=0):
+        """Applies follows and unfollows committed elsewhere since this graph last looked, and
+        those committed in the `settle` seconds before that with a lower id than it had seen."""
+        read_at = datetime.utcnow()
+        window = self.read_at - timedelta(seconds=settle)
+        follows = connection.execute(
+            select(Follow.id, Follow.follower_id, Follow.following_id)
+            .where(or_(Follow.id > self.seen_id, Follow.created_at >= window)).order_by(Follow.id)
+        ).all()
+        for follow_id, follower_id, following_id in follows:
+            self.apply(follower_id, following_id, True)
+            self.seen_id = max(self.seen_id, follow_id)
+        unfollows = connection.execute(
+            select(FollowTombstone.id, FollowTombstone.follower_id, FollowTombstone.following_id)
+            .where(or_(FollowTombstone.id > self.seen_tombstone_id, FollowTombstone.deleted_at >= window))
+            .order_by(FollowTombstone.id)
+        ).all()
+        if unfollows:
+            # the pair may have been followed again since, the follow table has the last word
+            pairs = {(follower_id, following_id) for _, follower_id, following_id in unfollows}
+            live = set(connection.execute(
+                select(Follow.follower_id, Follow.following_id)
+                .where(tuple_(Follow.follower_id, Follow.following_id).in_(pairs))
+            ).all())
+            for follower_id, following_id in pairs:
+                self.apply(follower_id, following_id, (follower_id, following_id) in live)
+            self.seen_tombstone_id = max(self.seen_tombstone_id, unfollows[-1][0])
+        self.read_at = read_at
+        return self
+
+    def stats(self):
+        return {
+            "user_ids": len(self.following.offsets) - 1,
+            "edges": len(self.following.targets),
+            "overlay": sum(len(ids) for changes in (self._added['out'], self._removed['out'])
+                           for ids in changes.values()),
+            "watermark": self.watermark,
+            "seen_id": self.seen_id,
+            "seen_tombstone_id": self.seen_tombstone_id,
+            "built_at": datetime.utcfromtimestamp(self.built_at).isoformat(),
+        }
+
+
+class SQLFollowGraph:
+    """The FollowGraph queries answered from the follow table, while the graph is being built."""
+
+    def following_ids(self, user_id):
+        return db.session.scalars(
+            select(Follow.following_id).where(Follow.follower_id == user_id).order_by(Follow.following_id)
+        ).all()
+
+    def follower_ids(self, user_id):
+        return db.session.scalars(
+            select(Follow.follower_id).where(Follow.following_id == user_id).order_by(Follow.follower_id)
+        ).all()
+
+    def follows(self, follower_id, following_id):
+        return db.session.scalar(
+            select(Follow.id).where(Follow.follower_id == follower_id, Follow.following_id == following_id).limit(1)
+        ) is not None
+
+    def mutuals(self, user_id):
+        return sorted(set(self.following_ids(user_id)).intersection(self.follower_ids(user_id)))
+
+    def followed_by(self, user_id, target_id):
+        return sorted(set(self.following_ids(user_id)).intersection(self.follower_ids(target_id)))
+
+    def suggestions(self, user_id, limit=20):
+        following = select(Follow.following_id).where(Follow.follower_id == user_id)
+        sources = following.order_by(Follow.following_id).limit(MAX_SUGGESTION_SOURCES).subquery()
+        score = func.count().label('score')
+        return [tuple(row) for row in db.session.execute(
+            select(Follow.following_id, score)
+            .join(User, User.id == Follow.following_id)
+            .where(Follow.follower_id.in_(select(sources.c.following_id)),
+                   Follow.following_id != user_id, Follow.following_id.not_in(following))
+            .group_by(Follow.following_id, User.followers_count)
+            .order_by(score.desc(), User.followers_count.desc(), Follow.following_id)
+            .limit(limit)
+        )]
+
+
+class GraphRefresher(threading.Thread):
+
+    def __init__(self, app, holder):
+        super().__init__(name='follow-graph', daemon=True)
+        self.app = app
+        self.holder = holder
+        self._stopped = threading.Event()
+
+    def stop(self):
+        self._stopped.set()
+
+    def run(self):
+        while True:
+            with self.app.app_context():
+                try:
+                    self.holder.refresh()
+                except Exception:
+                    db.session.rollback()
+                    logger.exception("refreshing the follow graph failed")
+                finally:
+                    db.session.remove()
+            if self._stopped.wait(max(1.0, self.holder.refresh_interval)):
+                return
+
+
+class GraphHolder:
+    """The process-wide graph, built or mapped and then kept fresh by a GraphRefresher."""
+
+    def __init__(self, app, path=None, refresh_interval=60, settle=30):
+        self.app = app
+        self.path = path
+        self.refresh_interval = refresh_interval
+        self.settle = settle
+        self.graph = None
+        self._loaded_mtime = None
+        self._lock = threading.Lock()
+        self._refresher_pid = None
+
+    def _snapshot_time(self):
+        if not self.path or not os.path.exists(self.path):
+            return None
+        return os.stat(self.path).st_mtime
+
+    def refresh(self):
+        """Loads a newer snapshot (or builds the graph the first time) and catches up with the table."""
+        with self._lock:
+            connection = db.session.connection()
+            mtime = self._snapshot_time()
+            if self.graph is None or mtime != self._loaded_mtime:
+                graph = FollowGraph.load(self.path) if mtime is not None else None
+                if graph is not None and time.time() - graph.built_at > TOMBSTONE_RETENTION.total_seconds():
+                    # the unfollows since it was written may have been purged already
+                    logger.warning("follow graph snapshot %s is too old, building from the table", self.path)
+                    graph = None
+                graph = graph or FollowGraph.build(connection)
+                # swapped in only once it is current
+                self.graph = graph.catch_up(connection, self.settle)
+                self._loaded_mtime = mtime
+            else:
+                self.graph.catch_up(connection, self.settle)
+            purge_tombstones()
+            db.session.commit()
+        return self.graph
+
+    def get(self):
+        # threads don't survive a fork, so each process starts its own
+        if self._refresher_pid != os.getpid():
+            with self._lock:
+                if self._refresher_pid != os.getpid():
+                    GraphRefresher(self.app, self).start()
+                    self._refresher_pid = os.getpid()
+        return self.graph if self.graph is not None else SQLFollowGraph()
+
+
+def init_graph(app):
+    app.extensions['follow_graph'] = GraphHolder(
+        app, app.config.get('GRAPH_SNAPSHOT'), app.config.get('GRAPH_REFRESH_INTERVAL', 60),
+        app.config.get('GRAPH_SETTLE_SECONDS', 30),
+    )
+
+
+def purge_tombstones(retention=TOMBSTONE_RETENTION):
+    """Deletes the tombstones every graph still in use has caught up with; returns how many."""
+    return db.session.execute(
+        delete(FollowTombstone).where(FollowTombstone.deleted_at < datetime.utcnow() - retention)
+    ).rowcount
+
+
+def get_graph():
+    return current_app.extensions['follow_graph'].get()
+
+
+def load_users(ids):
+    """Users for `ids` in the same order, skipping ids that no longer exist."""
+    ids = list(ids)
+    users = {user.id: user for user in db.session.scalars(select(User).where(User.id.in_(ids)))} if ids else {}
+    return [users[user_id] for user_id in ids if user_id in users]
+
+
+def _loaded_graph():
+    if not has_app_context() or 'follow_graph' not in current_app.extensions:
+        return None
+    return current_app.extensions['follow_graph'].graph
+
+
+def apply_follows(rows, added=True):
+    """For follows written without the ORM (see bulk.py); rows are dicts."""
+    graph = _loaded_graph()
+    for row in rows if graph is not None else ():
+        graph.apply(row['follower_id'], row['following_id'], added)
+
+
+def _collect(added):
+    def collect(mapper, connection, target):
+        session = object_session(target)
+        if session is not None:
+            session.info.setdefault('graph_changes', []).append((target.follower_id, target.following_id, added))
+    return collect
+
+
+event.listen(Follow, 'after_insert', _collect(True))
+event.listen(Follow, 'after_delete', _collect(False))
+
+
+@event.listens_for(Follow, 'after_delete')
+def _tombstone(mapper, connection, target):
+    # lets the graphs of other processes drop it, see FollowGraph.catch_up
+    connection.execute(insert(FollowTombstone).values(
+        follower_id=target.follower_id, following_id=target.following_id, deleted_at=datetime.utcnow()
+    ))
+
+
+@event.listens_for(Session, 'after_commit')
+def _apply_committed(session):
+    changes = session.info.pop('graph_changes', ())
+    graph = _loaded_graph() if changes else None
+    for follower_id, following_id, added in changes if graph is not None else ():
+        graph.apply(follower_id, following_id, added)
+
+
+@event.listens_for(Session, 'after_rollback')
+def _discard_rolled_back(session):
+    session.info.pop('graph_changes', None)
+
+
+graph_cli = AppGroup('graph', help='Maintain the in-memory follow graph.')
+
+
+@graph_cli.command('snapshot')
+@click.option('--path', default=None, help='Where to write it, GRAPH_SNAPSHOT by default.')
+def snapshot_command(path):
+    """Build the graph from the follow table and write it for workers to mmap."""
+    path = path or current_app.config.get('GRAPH_SNAPSHOT')
+    if not path:
+        raise click.ClickException('set GRAPH_SNAPSHOT or pass --path')
+    started = time.perf_counter()
+    graph = FollowGraph.build()
+    graph.save(path)
+    stats = graph.stats()
+    click.echo(f"{stats['edges']} follows over {stats['user_ids']} user ids written to {path} "
+               f"in {time.perf_counter() - started:.1f}s")
+    purged = purge_tombstones()
+    db.session.commit()
+    click.echo(f"{purged} old unfollow tombstones removed")
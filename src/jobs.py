@@ -0,0 +1,244 @@
+"""
+Background jobs kept in the `job` table, so workers need nothing but the database.
+
+enqueue() inserts jobs in the caller's transaction: they become visible to
+workers only if the write that produced them commits. A job with an
+idempotency key is inserted at most once. Workers (`flask jobs work`, or
+JOB_WORKERS threads inside the app) claim runnable jobs in batches and hand
+all the jobs of one kind to its handler in a single call. A failed batch is
+retried job by job, and failing jobs go back to the queue with exponential
+backoff until JOB_MAX_ATTEMPTS, after which they are marked failed.
+"""
+import json
+import logging
+import os
+import random
+import threading
+import uuid
+from collections import defaultdict
+from datetime import datetime, timedelta
+import click
+from flask import current_app
+from flask.cli import AppGroup
+from sqlalchemy import and_, delete, func, or_, select, update
+from models import db, Job
+
+logger = logging.getLogger(__name__)
+
+# kind -> callable taking the list of payloads of a batch
+HANDLERS = {}
+
+
+def handler(kind):
+    def register(fn):
+        HANDLERS[kind] = fn
+        return fn
+    return register
+
+
+def enqueue(kind, payloads, keys=None, delay=0, connection=None):
+    """Queues one job per payload; keys[i], when not None, dedupes payloads[i]."""
+    from bulk import insert_ignore  # bulk enqueues jobs itself
+    if not payloads:
+        return
+    now = datetime.utcnow()
+    keys = keys or [None] * len(payloads)
+    rows = [{
+        "kind": kind,
+        "payload": json.dumps(payload, default=str),
+        "idempotency_key": key,
+        "status": 'pending',
+        "attempts": 0,
+        "run_at": now + timedelta(seconds=delay),
+        "created_at": now,
+    } for payload, key in zip(payloads, keys)]
+    insert_ignore(Job, rows, ['idempotency_key'], ['id'], connection)
+
+
+def backoff(attempts):
+    config = current_app.config
+    seconds = min(config.get('JOB_BACKOFF_MAX', 3600), config.get('JOB_BACKOFF_BASE', 5) * 2 ** (attempts - 1))
+    return seconds * random.uniform(0.8, 1.2)
+
+
+def claim(worker_id, batch_size=100, kinds=None, now=None):
+    """Marks up to `batch_size` runnable jobs as running for this worker and returns them."""
+    now = now or datetime.utcnow()
+    # a running job whose worker died is picked up again once its lock times out
+    stale = now - timedelta(seconds=current_app.config.get('JOB_LOCK_TIMEOUT', 300))
+    runnable = or_(
+        and_(Job.status == 'pending', Job.run_at <= now),
+        and_(Job.status == 'running', Job.locked_at < stale),
+    )
+    stmt = select(Job.id).where(runnable)
+    if kinds:
+        stmt = stmt.where(Job.kind.in_(kinds))
+    ids = db.session.scalars(
+        stmt.order_by(Job.run_at, Job.id).limit(batch_size).with_for_update(skip_locked=True)
+    ).all()
+    if not ids:
+        db.session.commit()
+        return []
+    token = f"{worker_id}:{uuid.uuid4().hex[:12]}"[-64:]
+    # re-checking `runnable` keeps two workers from claiming a job where SKIP LOCKED doesn't exist
+    db.session.execute(
+        update(Job).where(Job.id.in_(ids), runnable)
+        .values(status='running', locked_by=token, locked_at=now, attempts=Job.attempts + 1)
+        .execution_options(synchronize_session=False)
+    )
+    db.session.commit()
+    return db.session.scalars(select(Job).where(Job.locked_by == token).order_by(Job.id)).all()
+
+
+def _finish(ids, **values):
+    db.session.execute(
+        update(Job).where(Job.id.in_(ids)).values(locked_by=None, locked_at=None, **values)
+        .execution_options(synchronize_session=False)
+    )
+
+
+def _run(kind, jobs):
+    ids = [job.id for job in jobs]
+    try:
+        if kind not in HANDLERS:
+            raise LookupError(f"no handler for job kind {kind!r}")
+        HANDLERS[kind]([json.loads(job.payload) for job in jobs])
+        _finish(ids, status='done', finished_at=datetime.utcnow(), last_error=None)
+        db.session.commit()
+        return True
+    except Exception as error:
+        db.session.rollback()
+        if len(jobs) > 1:
+            return False
+        job = jobs[0]
+        logger.exception("job %s (%s) failed on attempt %d", job.id, kind, job.attempts)
+        if job.attempts >= current_app.config.get('JOB_MAX_ATTEMPTS', 5):
+            _finish(ids, status='failed', finished_at=datetime.utcnow(), last_error=repr(error))
+        else:
+            _finish(ids, status='pending', last_error=repr(error),
+                    run_at=datetime.utcnow() + timedelta(seconds=backoff(job.attempts)))
+        db.session.commit()
+        return False
+
+
+def run_jobs(jobs):
+    """Runs claimed jobs grouped by kind; returns {"done", "failed"} counts."""
+    by_kind = defaultdict(list)
+    for job in jobs:
+        by_kind[job.kind].append(job)
+    done = 0
+    for kind, batch in by_kind.items():
+        if _run(kind, batch):
+            done += len(batch)
+            continue
+        # find the jobs that broke the batch so the others don't pay for them
+        for job in batch if len(batch) > 1 else ():
+            done += _run(kind, [job])
+    return {"done": done, "failed": len(jobs) - done}
+
+
+def work_once(worker_id, batch_size=100, kinds=None):
+    jobs = claim(worker_id, batch_size, kinds)
+    return run_jobs(jobs) if jobs else None
+
+
+class JobWorker(threading.Thread):
+
+    def __init__(self, app, number=0, batch_size=100, poll_interval=1.0, kinds=None):
+        super().__init__(name=f'job-worker-{number}', daemon=True)
+        self.app = app
+        self.worker_id = f"{os.uname().nodename}:{os.getpid()}:{number}"
+        self.batch_size = batch_size
+        self.poll_interval = poll_interval
+        self.kinds = kinds
+        self._stopped = threading.Event()
+
+    def stop(self):
+        self._stopped.set()
+
+    def run(self):
+        while not self._stopped.is_set():
+            with self.app.app_context():
+                try:
+                    result = work_once(self.worker_id, self.batch_size, self.kinds)
+                except Exception:
+                    db.session.rollback()
+                    logger.exception("job worker %s failed", self.worker_id)
+                    result = None
+                finally:
+                    db.session.remove()
+            if result is None:
+                self._stopped.wait(self.poll_interval)
+
+
+def start_job_workers(app, count=None, kinds=None):
+    count = app.config.get('JOB_WORKERS', 0) if count is None else count
+    workers = [
+        JobWorker(app, number, app.config.get('JOB_BATCH_SIZE', 100),
+                  app.config.get('JOB_POLL_INTERVAL', 1.0), kinds)
+        for number in range(count)
+    ]
+    for worker in workers:
+        worker.start()
+    return workers
+
+
+jobs_cli = AppGroup('jobs', help='Run and inspect background jobs.')
+
+
+@jobs_cli.command('work')
+@click.option('--threads', default=1, show_default=True, help='Worker threads in this process.')
+@click.option('--kind', 'kinds', multiple=True, help='Only run jobs of these kinds.')
+@click.option('--once', is_flag=True, help='Drain the runnable jobs and exit.')
+def work_command(threads, kinds, once):
+    """Run jobs; start several processes for more throughput."""
+    if once:
+        worker_id = f"{os.uname().nodename}:{os.getpid()}"
+        totals = {"done": 0, "failed": 0}
+        while True:
+            result = work_once(worker_id, current_app.config.get('JOB_BATCH_SIZE', 100), kinds)
+            if result is None:
+                break
+            totals = {key: totals[key] + result[key] for key in totals}
+        click.echo(f"{totals['done']} jobs done, {totals['failed']} failed")
+        return
+    workers = start_job_workers(current_app._get_current_object(), threads, kinds)
+    click.echo(f"{len(workers)} job workers running, Ctrl+C to stop")
+    try:
+        for worker in workers:
+            worker.join()
+    except KeyboardInterrupt:
+        for worker in workers:
+            worker.stop()
+
+
+@jobs_cli.command('stats')
+def stats_command():
+    """Jobs per kind and status."""
+    rows = db.session.execute(
+        select(Job.kind, Job.status, func.count()).group_by(Job.kind, Job.status).order_by(Job.kind, Job.status)
+    ).all()
+    for kind, status, count in rows:
+        click.echo(f"{kind:<20}{status:<10}{count:>8}")
+
+
+@jobs_cli.command('retry')
+@click.option('--kind', 'kinds', multiple=True, help='Only retry jobs of these kinds.')
+def retry_command(kinds):
+    """Put failed jobs back in the queue."""
+    stmt = update(Job).where(Job.status == 'failed')
+    if kinds:
+        stmt = stmt.where(Job.kind.in_(kinds))
+    result = db.session.execute(stmt.values(status='pending', attempts=0, run_at=datetime.utcnow()))
+    db.session.commit()
+    click.echo(f"{result.rowcount} jobs requeued")
+
+
+@jobs_cli.command('purge')
+@click.option('--days', default=7, show_default=True, help='Keep finished jobs this recent.')
+def purge_command(days):
+    """Delete finished jobs; their idempotency keys are released too."""
+    cutoff = datetime.utcnow() - timedelta(days=days)
+    result = db.session.execute(delete(Job).where(Job.status == 'done', Job.finished_at < cutoff))
+    db.session.commit()
+    click.echo(f"{result.rowcount} jobs deleted")
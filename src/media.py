@@ -0,0 +1,287 @@
+"""
+Uploaded media: validation, thumbnails and placeholders, and grid payloads.
+
+Uploads are files under MEDIA_DIR, referenced from posts, stories and
+profiles by MEDIA_URL_PREFIX + their path in it. `flask media process`
+walks the directory and hands the files it hasn't seen to a process pool
+(MEDIA_WORKERS). Each file is checked (decodable, at most MEDIA_MAX_PIXELS)
+and shrunk to every MEDIA_THUMB_SIZES, written as JPEG under
+MEDIA_DIR/thumbs/<size>/<path>.jpg, the original extension kept so a.png and
+a.jpg don't overwrite each other. Its dimensions, thumbnails and a BlurHash
+placeholder go to the `media` table keyed by URL; files that fail the
+checks are recorded as invalid and skipped on later runs.
+
+The grid endpoints return only that metadata (optionally a single size),
+so clients paint placeholders straight away and never download the
+originals to fill a grid. Files processed before MEDIA_THUMB_SIZES changed
+answer with their closest size.
+
+Needs Pillow (in the Pipfile) to process files; serving grids doesn't.
+"""
+import json
+import math
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor
+from datetime import datetime
+from functools import partial
+import click
+from flask import current_app, request
+from flask.cli import AppGroup
+from sqlalchemy import delete, func, select
+from sqlalchemy.orm import load_only
+from models import db, Post, Media
+from bulk import insert_ignore
+from pagination import paginate
+from tags import tag_feed
+from utils import APIException
+
+try:
+    from PIL import Image, ImageOps
+except ImportError:  # optional, only `flask media process` needs it
+    Image = ImageOps = None
+
+EXTENSIONS = {'.jpg', '.jpeg', '.png', '.webp', '.gif'}
+THUMBS_DIR = 'thumbs'
+BASE83 = '0123456789ABCDEFGHIJKLMNOPQRSTUVWXYZabcdefghijklmnopqrstuvwxyz#$%*+,-.:;=?@[]^_{|}~'
+# EXIF orientations that swap width and height
+TRANSPOSED = {5, 6, 7, 8}
+
+
+def _base83(value, length):
+    return ''.join(BASE83[value // 83 ** (length - i) % 83] for i in range(1, length + 1))
+
+
+def _to_linear(value):
+    value /= 255
+    return value / 12.92 if value <= 0.04045 else ((value + 0.055) / 1.055) ** 2.4
+
+
+def _to_srgb(value):
+    value = max(0.0, min(1.0, value))
+    return int(value * 12.92 * 255 + 0.5) if value <= 0.0031308 else int((1.055 * value ** (1 / 2.4) - 0.055) * 255 + 0.5)
+
+
+def blurhash(pixels, width, height, x_components=4, y_components=3):
+    """BlurHash of `pixels`, (r, g, b) tuples row by row; any BlurHash decoder renders it."""
+    linear = [tuple(_to_linear(channel) for channel in pixel[:3]) for pixel in pixels]
+    cos_x = [[math.cos(math.pi * i * x / width) for x in range(width)] for i in range(x_components)]
+    cos_y = [[math.cos(math.pi * j * y / height) for y in range(height)] for j in range(y_components)]
+    factors = []
+    for j in range(y_components):
+        for i in range(x_components):
+            scale = (1 if i == 0 and j == 0 else 2) / (width * height)
+            r = g = b = 0.0
+            for y in range(height):
+                row, basis_y = y * width, cos_y[j][y] * scale
+                for x in range(width):
+                    basis = cos_x[i][x] * basis_y
+                    pr, pg, pb = linear[row + x]
+                    r += basis * pr
+                    g += basis * pg
+                    b += basis * pb
+            factors.append((r, g, b))
+
+    dc, ac = factors[0], factors[1:]
+    result = _base83(x_components - 1 + (y_components - 1) * 9, 1)
+    if ac:
+        quantised = max(0, min(82, int(max(abs(v) for factor in ac for v in factor) * 166 - 0.5)))
+        maximum = (quantised + 1) / 166
+    else:
+        quantised, maximum = 0, 1
+    result += _base83(quantised, 1)
+    result += _base83((_to_srgb(dc[0]) << 16) + (_to_srgb(dc[1]) << 8) + _to_srgb(dc[2]), 4)
+
+    def quantise(value):
+        signed = math.copysign(abs(value / maximum) ** 0.5, value)
+        return max(0, min(18, int(math.floor(signed * 9 + 9.5))))
+
+    for r, g, b in ac:
+        result += _base83(quantise(r) * 19 * 19 + quantise(g) * 19 + quantise(b), 2)
+    return result
+
+
+def process_file(path, url, media_dir, url_prefix, sizes, max_pixels, components):
+    """Validates one upload and writes its thumbnails; returns its `media` row. Runs in the pool."""
+    # every row of a batch goes into one multi-row INSERT, so they all need every column
+    row = {"url": url, "processed_at": datetime.utcnow(), "bytes": None, "width": None, "height": None,
+           "placeholder": None, "thumbnails": None, "error": None}
+    try:
+        # the file may be gone since the directory was walked
+        row["bytes"] = os.path.getsize(path)
+        with Image.open(path) as image:
+            width, height = image.size
+            if width * height > max_pixels:
+                raise ValueError(f"{width}x{height} is over the {max_pixels} pixel limit")
+            if image.getexif().get(0x0112) in TRANSPOSED:
+                width, height = height, width
+            # JPEGs can decode straight at a fraction of their size
+            image.draft('RGB', (max(sizes), max(sizes)))
+            image = ImageOps.exif_transpose(image).convert('RGB')
+    except (OSError, ValueError, Image.DecompressionBombError) as error:
+        return {**row, "status": 'invalid', "error": str(error)[:500]}
+
+    name = os.path.relpath(path, media_dir) + '.jpg'
+    thumbnails = {}
+    # largest first, each thumbnail shrunk from the previous one
+    for size in sorted(sizes, reverse=True):
+        image.thumbnail((size, size), Image.Resampling.LANCZOS)
+        target = os.path.join(media_dir, THUMBS_DIR, str(size), name)
+        os.makedirs(os.path.dirname(target), exist_ok=True)
+        image.save(target, 'JPEG', quality=80, optimize=True, progressive=True)
+        thumbnails[str(size)] = {
+            "url": f"{url_prefix}{THUMBS_DIR}/{size}/{name.replace(os.sep, '/')}",
+            "width": image.width,
+            "height": image.height,
+        }
+    image.thumbnail((32, 32))
+    return {
+        **row,
+        "status": 'ready',
+        "width": width,
+        "height": height,
+        "placeholder": blurhash(list(image.getdata()), image.width, image.height, *components),
+        "thumbnails": json.dumps(dict(sorted(thumbnails.items(), key=lambda item: int(item[0])))),
+    }
+
+
+def pending_uploads(media_dir, url_prefix, batch_size=200, retry_invalid=False):
+    """Yields batches of (path, url) for the files under `media_dir` with no `media` row yet."""
+    def unseen(batch):
+        urls = [url for _, url in batch]
+        stmt = select(Media.url).where(Media.url.in_(urls))
+        if retry_invalid:
+            stmt = stmt.where(Media.status == 'ready')
+        seen = set(db.session.scalars(stmt))
+        return [(path, url) for path, url in batch if url not in seen]
+
+    batch = []
+    for root, dirs, files in os.walk(media_dir):
+        # our own output
+        if root == media_dir and THUMBS_DIR in dirs:
+            dirs.remove(THUMBS_DIR)
+        for filename in sorted(files):
+            if os.path.splitext(filename)[1].lower() not in EXTENSIONS:
+                continue
+            path = os.path.join(root, filename)
+            batch.append((path, url_prefix + os.path.relpath(path, media_dir).replace(os.sep, '/')))
+            if len(batch) >= batch_size:
+                yield unseen(batch)
+                batch = []
+    if batch:
+        yield unseen(batch)
+
+
+def process_uploads(media_dir, workers=None, batch_size=200, retry_invalid=False):
+    """Processes every new upload; returns {"ready", "invalid"} counts."""
+    config = current_app.config
+    sizes = config.get('MEDIA_THUMB_SIZES', (150, 320, 640))
+    worker = partial(process_file, media_dir=media_dir, url_prefix=config.get('MEDIA_URL_PREFIX', '/media/'),
+                     sizes=sizes, max_pixels=config.get('MEDIA_MAX_PIXELS', 50_000_000),
+                     components=config.get('MEDIA_PLACEHOLDER_COMPONENTS', (4, 3)))
+    counts = {"ready": 0, "invalid": 0}
+    workers = workers or config.get('MEDIA_WORKERS') or os.cpu_count()
+    with ProcessPoolExecutor(workers) as pool:
+        for batch in pending_uploads(media_dir, config.get('MEDIA_URL_PREFIX', '/media/'), batch_size, retry_invalid):
+            if not batch:
+                continue
+            paths, urls = zip(*batch)
+            rows = list(pool.map(worker, paths, urls, chunksize=max(1, len(batch) // (workers * 4))))
+            if retry_invalid:
+                db.session.execute(delete(Media).where(Media.url.in_(urls), Media.status == 'invalid'))
+            insert_ignore(Media, rows, ['url'], ['id'])
+            db.session.commit()
+            for row in rows:
+                counts[row['status']] += 1
+    return counts
+
+
+def media_for(urls):
+    """Processed `media` rows for `urls`, by URL."""
+    urls = {url for url in urls if url}
+    if not urls:
+        return {}
+    return {media.url: media for media in db.session.scalars(
+        select(Media).where(Media.url.in_(urls), Media.status == 'ready')
+    )}
+
+
+def grid_size():
+    """The ?size= thumbnail asked for, or None for all of them."""
+    size = request.args.get('size')
+    if size is None:
+        return None
+    if not size.isdigit() or int(size) not in current_app.config.get('MEDIA_THUMB_SIZES', ()):
+        sizes = ', '.join(map(str, current_app.config.get('MEDIA_THUMB_SIZES', ())))
+        raise APIException(f"size must be one of {sizes}", status_code=400)
+    return size
+
+
+def closest_thumbnail(thumbnails, size):
+    """{size: thumbnail} for the generated size nearest to `size`, the larger one on a tie."""
+    closest = min(thumbnails, key=lambda item: (abs(int(item) - int(size)), -int(item)))
+    return {closest: thumbnails[closest]}
+
+
+def grid_items(posts, size=None):
+    """Grid cells for `posts`: thumbnail metadata, or the original URL until it is processed."""
+    media = media_for(post.image_url for post in posts)
+    items = []
+    for post in posts:
+        found = media.get(post.image_url)
+        if found is None:
+            items.append({"id": post.id, "image_url": post.image_url})
+            continue
+        thumbnails = json.loads(found.thumbnails)
+        items.append({
+            "id": post.id,
+            "width": found.width,
+            "height": found.height,
+            "placeholder": found.placeholder,
+            "thumbnails": closest_thumbnail(thumbnails, size) if size else thumbnails,
+        })
+    return items
+
+
+GRID_COLUMNS = load_only(Post.id, Post.image_url, Post.user_id, Post.created_at)
+
+
+def user_grid(user_id, cursor=None, limit=20, size=None):
+    stmt = select(Post).where(Post.user_id == user_id).options(GRID_COLUMNS)
+    posts, next_cursor = paginate(stmt, Post.created_at, Post.id, cursor, limit)
+    return grid_items(posts, size), next_cursor
+
+
+def tag_grid(tag, cursor=None, limit=20, size=None):
+    posts, next_cursor = tag_feed(tag, cursor, limit, [GRID_COLUMNS])
+    return grid_items(posts, size), next_cursor
+
+
+media_cli = AppGroup('media', help='Process uploaded media.')
+
+
+@media_cli.command('process')
+@click.option('--dir', 'media_dir', default=None, help='Upload directory, MEDIA_DIR by default.')
+@click.option('--workers', type=int, default=None, help='Processes, MEDIA_WORKERS (or one per CPU) by default.')
+@click.option('--batch-size', default=200, show_default=True, help='Files per transaction.')
+@click.option('--retry-invalid', is_flag=True, help='Process files that failed validation before again.')
+def process_command(media_dir, workers, batch_size, retry_invalid):
+    """Validate new uploads, write their thumbnails and record their metadata."""
+    if Image is None:
+        raise click.ClickException('processing media needs Pillow: pip install Pillow')
+    media_dir = media_dir or current_app.config.get('MEDIA_DIR')
+    if not media_dir or not os.path.isdir(media_dir):
+        raise click.ClickException('set MEDIA_DIR or pass --dir with an existing directory')
+    started = time.perf_counter()
+    counts = process_uploads(os.path.abspath(media_dir), workers, batch_size, retry_invalid)
+    click.echo(f"{counts['ready']} files processed, {counts['invalid']} invalid "
+               f"in {time.perf_counter() - started:.1f}s")
+
+
+@media_cli.command('stats')
+def stats_command():
+    """Processed files per status."""
+    for status, count, size in db.session.execute(
+        select(Media.status, func.count(), func.sum(Media.bytes)).group_by(Media.status).order_by(Media.status)
+    ):
+        click.echo(f"{status:<10}{count:>8}{(size or 0) / 2 ** 20:>10.1f} MiB")
@@ -0,0 +1,293 @@
+"""
+Per-endpoint latency and SQL instrumentation, exported as Prometheus text.
+
+Every request records its latency, the number of SQL statements it issued
+and the time spent in them; the SQL side comes from engine cursor events.
+Under gunicorn each worker has its own numbers, so when METRICS_DIR is set
+every worker periodically writes a snapshot there and GET /metrics adds up
+the snapshots of all live workers. Counters and histograms are summed;
+gauges are reported per worker with a `pid` label. When a worker exits,
+its counters and histograms are folded into metrics-aggregate.json and its
+gauges are dropped, so the totals never go down when gunicorn recycles a
+worker (Prometheus would read that as a counter reset).
+
+SLOW_QUERY_MS turns on a log line for every statement slower than that,
+with the endpoint that issued it.
+"""
+import atexit
+import fcntl
+import glob
+import json
+import logging
+import os
+import threading
+import time
+from contextlib import contextmanager
+from flask import current_app, g, has_app_context, has_request_context, request
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
+logger = logging.getLogger(__name__)
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+STATEMENT_BUCKETS = (0, 1, 2, 3, 5, 10, 20, 50, 100, 250)
+
+HELP = {
+    "http_request_duration_seconds": ("histogram", "Request latency by endpoint."),
+    "db_statements_per_request": ("histogram", "SQL statements issued per request."),
+    "db_statements_total": ("counter", "SQL statements issued."),
+    "db_time_seconds_total": ("counter", "Time spent executing SQL."),
+    "cache_hits_total": ("counter", "Response cache hits."),
+    "cache_misses_total": ("counter", "Response cache misses."),
+    "cache_evictions_total": ("counter", "Response cache LRU evictions."),
+    "cache_expirations_total": ("counter", "Response cache TTL expirations."),
+    "http_rate_limited_total": ("counter", "Requests answered 429 by the rate limiter."),
+    "cache_entries": ("gauge", "Entries held by the response cache."),
+    "db_pool_size": ("gauge", "Configured connection pool size."),
+    "db_pool_checked_in": ("gauge", "Idle connections in the pool."),
+    "db_pool_checked_out": ("gauge", "Connections in use."),
+    "db_pool_overflow": ("gauge", "Connections opened beyond pool_size."),
+}
+
+
+class Registry:
+    """Histograms and counters keyed by metric name and rendered label set."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.histograms = {}
+        self.counters = {}
+        # callables returning {name: {labels: value}} read at snapshot time, for the whole process;
+        # an app's own are in app.extensions['metrics_collectors']
+        self.collectors = []
+
+    def observe(self, name, labels, value, buckets):
+        with self._lock:
+            series = self.histograms.setdefault(name, {}).setdefault(
+                labels, {"le": list(buckets), "buckets": [0] * len(buckets), "sum": 0.0, "count": 0}
+            )
+            for i, bound in enumerate(buckets):
+                if value <= bound:
+                    series["buckets"][i] += 1
+            series["sum"] += value
+            series["count"] += 1
+
+    def inc(self, name, labels, value=1):
+        with self._lock:
+            series = self.counters.setdefault(name, {})
+            series[labels] = series.get(labels, 0) + value
+
+    def snapshot(self, collectors=()):
+        with self._lock:
+            snapshot = json.loads(json.dumps({"histograms": self.histograms, "counters": self.counters}))
+        for collector in [*self.collectors, *collectors]:
+            for name, series in collector().items():
+                snapshot["counters"].setdefault(name, {}).update(series)
+        return snapshot
+
+
+registry = Registry()
+_last_flush = 0.0
+
+
+def _series(name, labels):
+    return f"{name}{{{labels}}}" if labels else name
+
+
+def _labels(**values):
+    return ",".join(f'{key}="{value}"' for key, value in values.items())
+
+
+def _is_gauge(name):
+    return HELP.get(name, ("gauge",))[0] == "gauge"
+
+
+def merge(snapshots):
+    merged = {"histograms": {}, "counters": {}}
+    for snapshot in snapshots:
+        pid = snapshot.get("pid")
+        for name, series in snapshot.get("histograms", {}).items():
+            for labels, data in series.items():
+                target = merged["histograms"].setdefault(name, {}).setdefault(
+                    labels, {"le": data["le"], "buckets": [0] * len(data["le"]), "sum": 0.0, "count": 0}
+                )
+                target["buckets"] = [a + b for a, b in zip(target["buckets"], data["buckets"])]
+                target["sum"] += data["sum"]
+                target["count"] += data["count"]
+        for name, series in snapshot.get("counters", {}).items():
+            for labels, value in series.items():
+                # a gauge is a worker's current state; adding them up across workers means nothing
+                if _is_gauge(name):
+                    labels = ",".join(filter(None, (labels, _labels(pid=pid))))
+                target = merged["counters"].setdefault(name, {})
+                target[labels] = target.get(labels, 0) + value
+    return merged
+
+
+def render(snapshot):
+    lines = []
+    for name, series in sorted(snapshot["histograms"].items()):
+        kind, text = HELP.get(name, ("histogram", name))
+        lines += [f"# HELP {name} {text}", f"# TYPE {name} histogram"]
+        for labels, data in sorted(series.items()):
+            prefix = f"{labels}," if labels else ""
+            for bound, count in zip(data["le"], data["buckets"]):
+                lines.append(f'{name}_bucket{{{prefix}le="{bound}"}} {count}')
+            lines.append(f'{name}_bucket{{{prefix}le="+Inf"}} {data["count"]}')
+            lines.append(f"{_series(name + '_sum', labels)} {data['sum']}")
+            lines.append(f"{_series(name + '_count', labels)} {data['count']}")
+    for name, series in sorted(snapshot["counters"].items()):
+        kind, text = HELP.get(name, ("gauge", name))
+        lines += [f"# HELP {name} {text}", f"# TYPE {name} {kind}"]
+        for labels, value in sorted(series.items()):
+            lines.append(f"{_series(name, labels)} {value}")
+    return "\n".join(lines) + "\n"
+
+
+def _app_collectors():
+    return current_app.extensions.get('metrics_collectors', ()) if has_app_context() else ()
+
+
+def _snapshot_path(directory):
+    return os.path.join(directory, f"metrics-{os.getpid()}.json")
+
+
+def flush(directory, interval=0):
+    """Writes this worker's snapshot to `directory`, at most once per `interval` seconds."""
+    global _last_flush
+    now = time.monotonic()
+    if not directory or now - _last_flush < interval:
+        return
+    _last_flush = now
+    path = _snapshot_path(directory)
+    with open(path + ".tmp", "w") as f:
+        json.dump(dict(registry.snapshot(_app_collectors()), pid=os.getpid()), f)
+    os.replace(path + ".tmp", path)
+
+
+AGGREGATE = "metrics-aggregate.json"
+
+
+@contextmanager
+def _locked(directory, mode):
+    # shared while snapshots are read, exclusive while a dead worker's move to the aggregate
+    with open(os.path.join(directory, "metrics.lock"), "a") as lock:
+        fcntl.flock(lock, mode)
+        try:
+            yield
+        finally:
+            fcntl.flock(lock, fcntl.LOCK_UN)
+
+
+def _read(path):
+    with open(path) as f:
+        return json.load(f)
+
+
+def _retire(directory, path):
+    """Folds an exited worker's counters and histograms into the aggregate and deletes its snapshot."""
+    with _locked(directory, fcntl.LOCK_EX):
+        try:
+            dead = _read(path)
+        except FileNotFoundError:
+            # another worker got to it first
+            return
+        except ValueError:
+            dead = {}
+        dead["counters"] = {name: series for name, series in dead.get("counters", {}).items() if not _is_gauge(name)}
+        aggregate = os.path.join(directory, AGGREGATE)
+        try:
+            merged = merge([_read(aggregate), dead])
+        except FileNotFoundError:
+            merged = merge([dead])
+        with open(aggregate + ".tmp", "w") as f:
+            json.dump(merged, f)
+        os.replace(aggregate + ".tmp", aggregate)
+        os.remove(path)
+
+
+def _is_alive(pid):
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        pass
+    return True
+
+
+def collect():
+    """Prometheus text for this process, or for every worker when METRICS_DIR is set."""
+    directory = current_app.config.get('METRICS_DIR')
+    if not directory:
+        return render(registry.snapshot(_app_collectors()))
+    flush(directory)
+    for path in glob.glob(os.path.join(directory, "metrics-*.json")):
+        pid = os.path.basename(path)[len("metrics-"):-len(".json")]
+        if pid.isdigit() and not _is_alive(int(pid)):
+            # a worker that exited (or was restarted); its gauges would stay forever
+            _retire(directory, path)
+    snapshots = []
+    with _locked(directory, fcntl.LOCK_SH):
+        for path in glob.glob(os.path.join(directory, "metrics-*.json")):
+            try:
+                snapshots.append(_read(path))
+            except (OSError, ValueError):
+                continue
+    return render(merge(snapshots))
+
+
+@event.listens_for(Engine, 'before_cursor_execute')
+def _before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    conn.info.setdefault('query_started', []).append((context, time.perf_counter()))
+
+
+@event.listens_for(Engine, 'handle_error')
+def _failed_cursor_execute(context):
+    # after_cursor_execute never runs for a failed statement
+    started = context.connection.info.get('query_started') if context.connection is not None else None
+    if started and started[-1][0] is context.execution_context:
+        started.pop()
+
+
+@event.listens_for(Engine, 'after_cursor_execute')
+def _after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    elapsed = time.perf_counter() - conn.info['query_started'].pop()[1]
+    if not has_request_context() or 'sql_count' not in g:
+        return
+    g.sql_count += 1
+    g.sql_time += elapsed
+    slow_ms = current_app.config.get('SLOW_QUERY_MS')
+    if slow_ms and elapsed * 1000 >= slow_ms:
+        logger.warning("slow query (%.1f ms) from %s %s: %s",
+                       elapsed * 1000, request.method, request.endpoint, statement)
+
+
+def init_metrics(app):
+    # kept per app: create_app can run many times in one process (tests, `flask bench startup`)
+    app.extensions['metrics_collectors'] = []
+    if app.config.get('METRICS_DIR'):
+        os.makedirs(app.config['METRICS_DIR'], exist_ok=True)
+        # don't lose whatever happened since the last throttled flush
+        atexit.register(flush, app.config['METRICS_DIR'])
+
+    @app.before_request
+    def _start_request_metrics():
+        g.request_started = time.perf_counter()
+        g.sql_count = 0
+        g.sql_time = 0.0
+
+    @app.after_request
+    def _record_request_metrics(response):
+        if 'request_started' not in g:
+            return response
+        endpoint = request.endpoint or 'unmatched'
+        labels = _labels(endpoint=endpoint, method=request.method, status=response.status_code)
+        registry.observe("http_request_duration_seconds", labels,
+                         time.perf_counter() - g.request_started, LATENCY_BUCKETS)
+        labels = _labels(endpoint=endpoint)
+        registry.observe("db_statements_per_request", labels, g.sql_count, STATEMENT_BUCKETS)
+        registry.inc("db_statements_total", labels, g.sql_count)
+        registry.inc("db_time_seconds_total", labels, g.sql_time)
+        flush(app.config.get('METRICS_DIR'), app.config.get('METRICS_FLUSH_INTERVAL', 1.0))
+        return response
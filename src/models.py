@@ -1,9 +1,11 @@
 from flask_sqlalchemy import SQLAlchemy
-from sqlalchemy import String, Boolean, Text, DateTime, ForeignKey, Integer
+from sqlalchemy import String, Boolean, Text, DateTime, Float, ForeignKey, Integer, BigInteger, Index, UniqueConstraint
 from sqlalchemy.orm import Mapped, mapped_column, relationship
+import json
 from datetime import datetime
+from config import RoutingSession
 
-db = SQLAlchemy()
+db = SQLAlchemy(session_options={"class_": RoutingSession})
 
 class User(db.Model):
     __tablename__ = 'user'
@@ -19,6 +21,11 @@ class User(db.Model):
     is_private: Mapped[bool] = mapped_column(Boolean(), default=False)
     is_active: Mapped[bool] = mapped_column(Boolean(), default=True)
     created_at: Mapped[DateTime] = mapped_column(DateTime, default=datetime.utcnow)
+
+    # Denormalized counters, maintained by counters.py
+    posts_count: Mapped[int] = mapped_column(Integer, default=0, server_default='0', nullable=False)
+    followers_count: Mapped[int] = mapped_column(Integer, default=0, server_default='0', nullable=False)
+    following_count: Mapped[int] = mapped_column(Integer, default=0, server_default='0', nullable=False)
     
     # Relationships
     posts: Mapped[list['Post']] = relationship('Post', back_populates='user')
@@ -49,13 +56,19 @@ class User(db.Model):
             "website": self.website,
             "is_private": self.is_private,
             "created_at": self.created_at.isoformat(),
-            "posts_count": len(self.posts),
-            "followers_count": len(self.followers),
-            "following_count": len(self.following)
+            "posts_count": self.posts_count,
+            "followers_count": self.followers_count,
+            "following_count": self.following_count
         }
 
 class Post(db.Model):
     __tablename__ = 'post'
+    __table_args__ = (
+        # author timelines in feed order, used by the home feed
+        Index('ix_post_user_id_created_at_id', 'user_id', 'created_at', 'id'),
+        # location feeds, see tags.py
+        Index('ix_post_location_created_at_id', 'location', 'created_at', 'id'),
+    )
     
     id: Mapped[int] = mapped_column(primary_key=True)
     image_url: Mapped[str] = mapped_column(String(255), nullable=False)
@@ -63,6 +76,10 @@ class Post(db.Model):
     location: Mapped[str] = mapped_column(String(100), nullable=True)
     user_id: Mapped[int] = mapped_column(ForeignKey('user.id'), nullable=False)
     created_at: Mapped[DateTime] = mapped_column(DateTime, default=datetime.utcnow)
+
+    # Denormalized counters, maintained by counters.py
+    likes_count: Mapped[int] = mapped_column(Integer, default=0, server_default='0', nullable=False)
+    comments_count: Mapped[int] = mapped_column(Integer, default=0, server_default='0', nullable=False)
     
     # Relationships
     user: Mapped['User'] = relationship('User', back_populates='posts')
@@ -77,18 +94,27 @@ class Post(db.Model):
             "location": self.location,
             "user_id": self.user_id,
             "created_at": self.created_at.isoformat(),
-            "likes_count": len(self.likes),
-            "comments_count": len(self.comments),
+            "likes_count": self.likes_count,
+            "comments_count": self.comments_count,
             "user": self.user.serialize() if self.user else None
         }
 
 class Comment(db.Model):
     __tablename__ = 'comment'
+    __table_args__ = (
+        # lets clients replay queued comments without creating duplicates
+        UniqueConstraint('user_id', 'client_token', name='uq_comment_user_id_client_token'),
+        # engagement windows scanned by explore.py
+        Index('ix_comment_created_at', 'created_at'),
+        # a post's comments in time order: comment pages and delta sync (sync.py)
+        Index('ix_comment_post_id_created_at_id', 'post_id', 'created_at', 'id'),
+    )
     
     id: Mapped[int] = mapped_column(primary_key=True)
     content: Mapped[str] = mapped_column(Text, nullable=False)
     user_id: Mapped[int] = mapped_column(ForeignKey('user.id'), nullable=False)
     post_id: Mapped[int] = mapped_column(ForeignKey('post.id'), nullable=False)
+    client_token: Mapped[str] = mapped_column(String(64), nullable=True)
     created_at: Mapped[DateTime] = mapped_column(DateTime, default=datetime.utcnow)
     
     # Relationships
@@ -107,6 +133,12 @@ class Comment(db.Model):
 
 class Like(db.Model):
     __tablename__ = 'like'
+    __table_args__ = (
+        UniqueConstraint('user_id', 'post_id', name='uq_like_user_id_post_id'),
+        Index('ix_like_created_at', 'created_at'),
+        # a post's likes in time order, for delta sync (sync.py)
+        Index('ix_like_post_id_created_at_id', 'post_id', 'created_at', 'id'),
+    )
     
     id: Mapped[int] = mapped_column(primary_key=True)
     user_id: Mapped[int] = mapped_column(ForeignKey('user.id'), nullable=False)
@@ -127,11 +159,15 @@ class Like(db.Model):
 
 class Follow(db.Model):
     __tablename__ = 'follow'
+    __table_args__ = (
+        UniqueConstraint('follower_id', 'following_id', name='uq_follow_follower_id_following_id'),
+    )
     
     id: Mapped[int] = mapped_column(primary_key=True)
     follower_id: Mapped[int] = mapped_column(ForeignKey('user.id'), nullable=False)
-    following_id: Mapped[int] = mapped_column(ForeignKey('user.id'), nullable=False)
-    created_at: Mapped[DateTime] = mapped_column(DateTime, default=datetime.utcnow)
+    following_id: Mapped[int] = mapped_column(ForeignKey('user.id'), nullable=False, index=True)
+    # indexed for the follow graph's settle window, see graph.py
+    created_at: Mapped[DateTime] = mapped_column(DateTime, default=datetime.utcnow, index=True)
     
     # Relationships
     follower: Mapped['User'] = relationship('User', foreign_keys=[follower_id], back_populates='following')
@@ -147,6 +183,11 @@ class Follow(db.Model):
 
 class Story(db.Model):
     __tablename__ = 'story'
+    __table_args__ = (
+        # active stories of a user, and the expiry sweep in stories.py
+        Index('ix_story_user_id_expires_at', 'user_id', 'expires_at'),
+        Index('ix_story_expires_at', 'expires_at'),
+    )
     
     id: Mapped[int] = mapped_column(primary_key=True)
     media_url: Mapped[str] = mapped_column(String(255), nullable=False)
@@ -165,124 +206,168 @@ class Story(db.Model):
             "created_at": self.created_at.isoformat(),
             "expires_at": self.expires_at.isoformat(),
             "user": self.user.serialize() if self.user else None
-        }from flask_sqlalchemy import SQLAlchemy
-from sqlalchemy import String, Boolean, Text, DateTime, ForeignKey, Integer
-from sqlalchemy.orm import Mapped, mapped_column, relationship
-from datetime import datetime
+        }
 
-db = SQLAlchemy()
+class StoryArchive(db.Model):
+    __tablename__ = 'story_archive'
 
-class User(db.Model):
-    __tablename__ = 'user'
-    
-    id: Mapped[int] = mapped_column(primary_key=True)
-    username: Mapped[str] = mapped_column(String(30), unique=True, nullable=False)
-    email: Mapped[str] = mapped_column(String(120), unique=True, nullable=False)
-    password: Mapped[str] = mapped_column(nullable=False)
-    full_name: Mapped[str] = mapped_column(String(100), nullable=False)
-    bio: Mapped[str] = mapped_column(Text, nullable=True)
-    profile_picture: Mapped[str] = mapped_column(String(255), nullable=True)
-    website: Mapped[str] = mapped_column(String(255), nullable=True)
-    is_private: Mapped[bool] = mapped_column(Boolean(), default=False)
-    is_active: Mapped[bool] = mapped_column(Boolean(), default=True)
-    created_at: Mapped[DateTime] = mapped_column(DateTime, default=datetime.utcnow)
-    
-    # Relationships
-    posts: Mapped[list['Post']] = relationship('Post', back_populates='user')
-    comments: Mapped[list['Comment']] = relationship('Comment', back_populates='user')
-    likes: Mapped[list['Like']] = relationship('Like', back_populates='user')
-    stories: Mapped[list['Story']] = relationship('Story', back_populates='user')
-    
-    # Follow relationships
-    followers: Mapped[list['Follow']] = relationship(
-        'Follow', 
-        foreign_keys='Follow.following_id', 
-        back_populates='following'
-    )
-    following: Mapped[list['Follow']] = relationship(
-        'Follow', 
-        foreign_keys='Follow.follower_id', 
-        back_populates='follower'
-    )
+    # expired stories moved here by `flask stories sweep --archive`
+    id: Mapped[int] = mapped_column(primary_key=True, autoincrement=False)
+    media_url: Mapped[str] = mapped_column(String(255), nullable=False)
+    user_id: Mapped[int] = mapped_column(ForeignKey('user.id'), nullable=False, index=True)
+    created_at: Mapped[DateTime] = mapped_column(DateTime, nullable=False)
+    expires_at: Mapped[DateTime] = mapped_column(DateTime, nullable=False)
+    archived_at: Mapped[DateTime] = mapped_column(DateTime, default=datetime.utcnow)
 
     def serialize(self):
         return {
             "id": self.id,
-            "username": self.username,
-            "email": self.email,
-            "full_name": self.full_name,
-            "bio": self.bio,
-            "profile_picture": self.profile_picture,
-            "website": self.website,
-            "is_private": self.is_private,
+            "media_url": self.media_url,
+            "user_id": self.user_id,
             "created_at": self.created_at.isoformat(),
-            "posts_count": len(self.posts),
-            "followers_count": len(self.followers),
-            "following_count": len(self.following)
+            "expires_at": self.expires_at.isoformat(),
+            "archived_at": self.archived_at.isoformat()
         }
 
-class Post(db.Model):
-    __tablename__ = 'post'
-    
+class TimelineEntry(db.Model):
+    __tablename__ = 'timeline_entry'
+    __table_args__ = (
+        Index('ix_timeline_entry_owner_id_created_at_post_id', 'owner_id', 'created_at', 'post_id'),
+    )
+
+    # materialized home feed rows, written by timeline.SQLTimelineStore
+    owner_id: Mapped[int] = mapped_column(ForeignKey('user.id'), primary_key=True)
+    post_id: Mapped[int] = mapped_column(ForeignKey('post.id'), primary_key=True)
+    created_at: Mapped[DateTime] = mapped_column(DateTime, nullable=False)
+
+    def serialize(self):
+        return {
+            "owner_id": self.owner_id,
+            "post_id": self.post_id,
+            "created_at": self.created_at.isoformat()
+        }
+
+class Tag(db.Model):
+    __tablename__ = 'tag'
+
+    # hashtags parsed out of Post.caption by tags.py, lowercased without the '#'
     id: Mapped[int] = mapped_column(primary_key=True)
-    image_url: Mapped[str] = mapped_column(String(255), nullable=False)
-    caption: Mapped[str] = mapped_column(Text, nullable=True)
-    location: Mapped[str] = mapped_column(String(100), nullable=True)
-    user_id: Mapped[int] = mapped_column(ForeignKey('user.id'), nullable=False)
-    created_at: Mapped[DateTime] = mapped_column(DateTime, default=datetime.utcnow)
-    
-    # Relationships
-    user: Mapped['User'] = relationship('User', back_populates='posts')
-    comments: Mapped[list['Comment']] = relationship('Comment', back_populates='post')
-    likes: Mapped[list['Like']] = relationship('Like', back_populates='post')
+    name: Mapped[str] = mapped_column(String(100), unique=True, nullable=False)
 
     def serialize(self):
         return {
             "id": self.id,
-            "image_url": self.image_url,
-            "caption": self.caption,
-            "location": self.location,
-            "user_id": self.user_id,
+            "name": self.name
+        }
+
+class PostTag(db.Model):
+    __tablename__ = 'post_tag'
+    __table_args__ = (
+        Index('ix_post_tag_tag_id_created_at_post_id', 'tag_id', 'created_at', 'post_id'),
+    )
+
+    # inverted index from tags to posts; created_at is the post's, for keyset paging
+    post_id: Mapped[int] = mapped_column(ForeignKey('post.id'), primary_key=True)
+    tag_id: Mapped[int] = mapped_column(ForeignKey('tag.id'), primary_key=True)
+    created_at: Mapped[DateTime] = mapped_column(DateTime, nullable=False)
+
+    def serialize(self):
+        return {
+            "post_id": self.post_id,
+            "tag_id": self.tag_id,
+            "created_at": self.created_at.isoformat()
+        }
+
+class Job(db.Model):
+    __tablename__ = 'job'
+    __table_args__ = (
+        # what workers poll: runnable jobs in order
+        Index('ix_job_status_run_at', 'status', 'run_at'),
+    )
+
+    # background work queued by jobs.enqueue() and run by `flask jobs work`
+    id: Mapped[int] = mapped_column(primary_key=True)
+    kind: Mapped[str] = mapped_column(String(50), nullable=False)
+    payload: Mapped[str] = mapped_column(Text, nullable=False)
+    idempotency_key: Mapped[str] = mapped_column(String(120), unique=True, nullable=True)
+    status: Mapped[str] = mapped_column(String(16), default='pending', nullable=False)
+    attempts: Mapped[int] = mapped_column(Integer, default=0, nullable=False)
+    run_at: Mapped[DateTime] = mapped_column(DateTime, default=datetime.utcnow, nullable=False)
+    locked_by: Mapped[str] = mapped_column(String(64), nullable=True)
+    locked_at: Mapped[DateTime] = mapped_column(DateTime, nullable=True)
+    last_error: Mapped[str] = mapped_column(Text, nullable=True)
+    created_at: Mapped[DateTime] = mapped_column(DateTime, default=datetime.utcnow, nullable=False)
+    finished_at: Mapped[DateTime] = mapped_column(DateTime, nullable=True)
+
+    def serialize(self):
+        return {
+            "id": self.id,
+            "kind": self.kind,
+            "status": self.status,
+            "attempts": self.attempts,
+            "run_at": self.run_at.isoformat(),
+            "last_error": self.last_error,
             "created_at": self.created_at.isoformat(),
-            "likes_count": len(self.likes),
-            "comments_count": len(self.comments),
-            "user": self.user.serialize() if self.user else None
+            "finished_at": self.finished_at.isoformat() if self.finished_at else None
         }
 
-class Comment(db.Model):
-    __tablename__ = 'comment'
-    
+class Notification(db.Model):
+    __tablename__ = 'notification'
+    __table_args__ = (
+        Index('ix_notification_user_id_created_at_id', 'user_id', 'created_at', 'id'),
+    )
+
+    # written by the notify job in notifications.py
     id: Mapped[int] = mapped_column(primary_key=True)
-    content: Mapped[str] = mapped_column(Text, nullable=False)
     user_id: Mapped[int] = mapped_column(ForeignKey('user.id'), nullable=False)
-    post_id: Mapped[int] = mapped_column(ForeignKey('post.id'), nullable=False)
-    created_at: Mapped[DateTime] = mapped_column(DateTime, default=datetime.utcnow)
-    
-    # Relationships
-    user: Mapped['User'] = relationship('User', back_populates='comments')
-    post: Mapped['Post'] = relationship('Post', back_populates='comments')
+    actor_id: Mapped[int] = mapped_column(ForeignKey('user.id'), nullable=False)
+    kind: Mapped[str] = mapped_column(String(16), nullable=False)
+    post_id: Mapped[int] = mapped_column(ForeignKey('post.id'), nullable=True)
+    created_at: Mapped[DateTime] = mapped_column(DateTime, default=datetime.utcnow, nullable=False)
 
     def serialize(self):
         return {
             "id": self.id,
-            "content": self.content,
             "user_id": self.user_id,
+            "actor_id": self.actor_id,
+            "kind": self.kind,
             "post_id": self.post_id,
-            "created_at": self.created_at.isoformat(),
-            "user": self.user.serialize() if self.user else None
+            "created_at": self.created_at.isoformat()
         }
 
-class Like(db.Model):
-    __tablename__ = 'like'
-    
-    id: Mapped[int] = mapped_column(primary_key=True)
+class PostScore(db.Model):
+    __tablename__ = 'post_score'
+    __table_args__ = (
+        Index('ix_post_score_period_score_post_id', 'period', 'score', 'post_id'),
+    )
+
+    # top posts per explore period ("24h", "7d"), rewritten by `flask explore compute`
+    period: Mapped[str] = mapped_column(String(8), primary_key=True)
+    post_id: Mapped[int] = mapped_column(ForeignKey('post.id'), primary_key=True)
+    score: Mapped[float] = mapped_column(Float, nullable=False)
+    computed_at: Mapped[DateTime] = mapped_column(DateTime, nullable=False)
+
+    def serialize(self):
+        return {
+            "period": self.period,
+            "post_id": self.post_id,
+            "score": self.score,
+            "computed_at": self.computed_at.isoformat()
+        }
+
+class LikeArchive(db.Model):
+    __tablename__ = 'like_archive'
+    __table_args__ = (
+        Index('ix_like_archive_user_id_post_id', 'user_id', 'post_id'),
+        Index('ix_like_archive_post_id', 'post_id'),
+    )
+
+    # likes older than ARCHIVE_AFTER_DAYS, moved here by archive.py; range-partitioned
+    # by created_at on Postgres, which is why created_at is part of the key
+    id: Mapped[int] = mapped_column(primary_key=True, autoincrement=False)
+    created_at: Mapped[DateTime] = mapped_column(DateTime, primary_key=True)
     user_id: Mapped[int] = mapped_column(ForeignKey('user.id'), nullable=False)
     post_id: Mapped[int] = mapped_column(ForeignKey('post.id'), nullable=False)
-    created_at: Mapped[DateTime] = mapped_column(DateTime, default=datetime.utcnow)
-    
-    # Relationships
-    user: Mapped['User'] = relationship('User', back_populates='likes')
-    post: Mapped['Post'] = relationship('Post', back_populates='likes')
 
     def serialize(self):
         return {
@@ -292,44 +377,80 @@ class Like(db.Model):
             "created_at": self.created_at.isoformat()
         }
 
-class Follow(db.Model):
-    __tablename__ = 'follow'
-    
-    id: Mapped[int] = mapped_column(primary_key=True)
-    follower_id: Mapped[int] = mapped_column(ForeignKey('user.id'), nullable=False)
-    following_id: Mapped[int] = mapped_column(ForeignKey('user.id'), nullable=False)
-    created_at: Mapped[DateTime] = mapped_column(DateTime, default=datetime.utcnow)
-    
-    # Relationships
-    follower: Mapped['User'] = relationship('User', foreign_keys=[follower_id], back_populates='following')
-    following: Mapped['User'] = relationship('User', foreign_keys=[following_id], back_populates='followers')
+class CommentArchive(db.Model):
+    __tablename__ = 'comment_archive'
+    __table_args__ = (
+        Index('ix_comment_archive_post_id_created_at_id', 'post_id', 'created_at', 'id'),
+        Index('ix_comment_archive_user_id_client_token', 'user_id', 'client_token'),
+    )
+
+    # comments older than ARCHIVE_AFTER_DAYS, see LikeArchive
+    id: Mapped[int] = mapped_column(primary_key=True, autoincrement=False)
+    created_at: Mapped[DateTime] = mapped_column(DateTime, primary_key=True)
+    content: Mapped[str] = mapped_column(Text, nullable=False)
+    user_id: Mapped[int] = mapped_column(ForeignKey('user.id'), nullable=False)
+    post_id: Mapped[int] = mapped_column(ForeignKey('post.id'), nullable=False)
+    client_token: Mapped[str] = mapped_column(String(64), nullable=True)
 
     def serialize(self):
         return {
             "id": self.id,
-            "follower_id": self.follower_id,
-            "following_id": self.following_id,
+            "content": self.content,
+            "user_id": self.user_id,
+            "post_id": self.post_id,
             "created_at": self.created_at.isoformat()
         }
 
-class Story(db.Model):
-    __tablename__ = 'story'
-    
+class Media(db.Model):
+    __tablename__ = 'media'
+
+    # an uploaded file, keyed by the URL posts, stories and profiles store; written by `flask media process`
     id: Mapped[int] = mapped_column(primary_key=True)
-    media_url: Mapped[str] = mapped_column(String(255), nullable=False)
-    user_id: Mapped[int] = mapped_column(ForeignKey('user.id'), nullable=False)
-    created_at: Mapped[DateTime] = mapped_column(DateTime, default=datetime.utcnow)
-    expires_at: Mapped[DateTime] = mapped_column(DateTime, nullable=False)
-    
-    # Relationships
-    user: Mapped['User'] = relationship('User', back_populates='stories')
+    url: Mapped[str] = mapped_column(String(255), unique=True, nullable=False)
+    status: Mapped[str] = mapped_column(String(16), nullable=False)
+    width: Mapped[int] = mapped_column(Integer, nullable=True)
+    height: Mapped[int] = mapped_column(Integer, nullable=True)
+    bytes: Mapped[int] = mapped_column(Integer, nullable=True)
+    placeholder: Mapped[str] = mapped_column(String(64), nullable=True)
+    # JSON: thumbnail size -> {"url", "width", "height"}
+    thumbnails: Mapped[str] = mapped_column(Text, nullable=True)
+    error: Mapped[str] = mapped_column(Text, nullable=True)
+    processed_at: Mapped[DateTime] = mapped_column(DateTime, default=datetime.utcnow, nullable=False)
 
     def serialize(self):
         return {
             "id": self.id,
-            "media_url": self.media_url,
-            "user_id": self.user_id,
-            "created_at": self.created_at.isoformat(),
-            "expires_at": self.expires_at.isoformat(),
-            "user": self.user.serialize() if self.user else None
-        }
\ No newline at end of file
+            "url": self.url,
+            "status": self.status,
+            "width": self.width,
+            "height": self.height,
+            "placeholder": self.placeholder,
+            "thumbnails": json.loads(self.thumbnails) if self.thumbnails else None,
+            "processed_at": self.processed_at.isoformat()
+        }
+
+class RateLimitBucket(db.Model):
+    __tablename__ = 'rate_limit_bucket'
+
+    # token buckets shared by every worker when RATE_LIMIT_STORE=sql, see ratelimit.py
+    key: Mapped[str] = mapped_column(String(200), primary_key=True)
+    tokens: Mapped[float] = mapped_column(Float(precision=53), nullable=False)
+    # unix time; double precision so MySQL keeps sub-second resolution
+    updated_at: Mapped[float] = mapped_column(Float(precision=53), nullable=False)
+
+class CacheVersion(db.Model):
+    __tablename__ = 'cache_version'
+
+    # current version of a cached profile/post payload, written with the change itself, see cache.py
+    kind: Mapped[str] = mapped_column(String(16), primary_key=True)
+    entity_id: Mapped[int] = mapped_column(Integer, primary_key=True, autoincrement=False)
+    version: Mapped[int] = mapped_column(BigInteger, nullable=False)
+
+class FollowTombstone(db.Model):
+    __tablename__ = 'follow_tombstone'
+
+    # unfollows, read by every worker's in-memory follow graph, see graph.py
+    id: Mapped[int] = mapped_column(primary_key=True)
+    follower_id: Mapped[int] = mapped_column(Integer, nullable=False)
+    following_id: Mapped[int] = mapped_column(Integer, nullable=False)
+    deleted_at: Mapped[DateTime] = mapped_column(DateTime, default=datetime.utcnow, nullable=False, index=True)
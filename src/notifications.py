@@ -0,0 +1,72 @@
+"""
+Like, comment and follow notifications, written by the "notify" job.
+
+Writes only enqueue a job (see jobs.py): ORM inserts through the mapper
+events below, batch writes through enqueue_notifications() in bulk.py.
+The idempotency key is derived from the action, so replaying the same
+batch never notifies twice.
+"""
+from sqlalchemy import delete, event, insert, select
+from models import db, Post, Comment, Like, Follow, Notification
+from jobs import enqueue, handler
+from pagination import paginate
+
+
+def _notification(row_model, row):
+    """(payload, idempotency key) for an inserted like/comment/follow row."""
+    if row_model is Like:
+        return ({"kind": 'like', "actor_id": row['user_id'], "post_id": row['post_id']},
+                f"like:{row['user_id']}:{row['post_id']}")
+    if row_model is Comment:
+        key = f"comment:{row['user_id']}:{row['client_token']}" if row.get('client_token') \
+            else f"comment:{row['id']}"
+        return {"kind": 'comment', "actor_id": row['user_id'], "post_id": row['post_id']}, key
+    return ({"kind": 'follow', "actor_id": row['follower_id'], "user_id": row['following_id']},
+            f"follow:{row['follower_id']}:{row['following_id']}")
+
+
+def enqueue_notifications(row_model, rows, connection=None):
+    if not rows:
+        return
+    payloads, keys = zip(*(_notification(row_model, row) for row in rows))
+    enqueue('notify', list(payloads), list(keys), connection=connection)
+
+
+@handler('notify')
+def notify(payloads):
+    post_ids = {payload['post_id'] for payload in payloads if payload.get('post_id')}
+    authors = dict(db.session.execute(select(Post.id, Post.user_id).where(Post.id.in_(post_ids))).all()) \
+        if post_ids else {}
+    rows = []
+    for payload in payloads:
+        recipient = payload.get('user_id') or authors.get(payload.get('post_id'))
+        # no notification for your own post, or for a post deleted since
+        if recipient is None or recipient == payload['actor_id']:
+            continue
+        rows.append({
+            "user_id": recipient,
+            "actor_id": payload['actor_id'],
+            "kind": payload['kind'],
+            "post_id": payload.get('post_id'),
+        })
+    if rows:
+        db.session.execute(insert(Notification), rows)
+
+
+def user_notifications(user_id, cursor=None, limit=20):
+    stmt = select(Notification).where(Notification.user_id == user_id)
+    return paginate(stmt, Notification.created_at, Notification.id, cursor, limit)
+
+
+def _after_insert(mapper, connection, target):
+    row = {column.key: getattr(target, column.key) for column in mapper.columns}
+    enqueue_notifications(type(target), [row], connection)
+
+
+for _model in (Like, Comment, Follow):
+    event.listen(_model, 'after_insert', _after_insert)
+
+
+@event.listens_for(Post, 'before_delete')
+def _delete_post_notifications(mapper, connection, target):
+    connection.execute(delete(Notification).where(Notification.post_id == target.id))
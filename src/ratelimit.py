@@ -0,0 +1,240 @@
+"""
+Token-bucket rate limiting per client IP and per route.
+
+A limit like "120/m" is a bucket of 120 tokens refilled at 120 per minute;
+every request takes one token from each bucket that applies to it:
+
+    RATE_LIMIT_IP       every request, keyed by the client address
+    RATE_LIMIT_ROUTES   "endpoint=limit,..." per endpoint, keyed by the client address
+
+There is no per-user bucket: requests only name a user (`?user_id=`), and
+anyone could name someone else to use up their quota. It can come back
+keyed on an authenticated identity once there is one. Behind a proxy the
+client address comes from X-Forwarded-For, trusting TRUSTED_PROXY_HOPS
+proxies (see app.py); otherwise every client would share the proxy's bucket.
+
+An empty bucket answers 429 with Retry-After through APIException. With no
+limit configured the hook isn't installed at all.
+
+RATE_LIMIT_STORE=memory (the default) keeps buckets in this process,
+spread over RATE_LIMIT_SHARDS independently locked dicts so threads rarely
+wait on each other; each gunicorn worker then enforces its own share.
+RATE_LIMIT_STORE=sql keeps them in the rate_limit_bucket table, shared by
+every worker, at the cost of a short primary transaction per bucket.
+`flask ratelimit bench` measures what the limiter adds to a request.
+"""
+import random
+import re
+import threading
+import time
+from collections import namedtuple
+import click
+from flask import current_app, request
+from flask.cli import AppGroup
+from sqlalchemy import case, delete, select, update
+from models import db, RateLimitBucket
+from bulk import insert_ignore
+from metrics import registry
+from utils import APIException
+
+PERIODS = {'s': 1, 'm': 60, 'h': 3600}
+LIMIT = re.compile(r'^\s*(\d+)\s*/\s*(\d*)\s*([smh])\s*$')
+
+# tokens added per second, and the most the bucket holds
+Limit = namedtuple('Limit', 'rate capacity')
+
+
+def parse_limit(value):
+    """"30/m" or "5/10s" -> Limit; the count is also the burst size."""
+    match = LIMIT.match(value or '')
+    if not match or not int(match.group(1)):
+        raise ValueError(f"invalid rate limit {value!r}, expected e.g. 30/m or 5/10s")
+    count = int(match.group(1))
+    seconds = int(match.group(2) or 1) * PERIODS[match.group(3)]
+    return Limit(count / seconds, count)
+
+
+def parse_route_limits(value):
+    limits = {}
+    for item in filter(None, (part.strip() for part in (value or '').split(','))):
+        endpoint, _, limit = item.partition('=')
+        limits[endpoint.strip()] = parse_limit(limit)
+    return limits
+
+
+class MemoryBuckets:
+    """Buckets of this process, sharded by key hash."""
+
+    def __init__(self, shards=64, max_keys=100000):
+        self._shards = [(threading.Lock(), {}) for _ in range(shards)]
+        self.max_keys_per_shard = max(1, max_keys // shards)
+
+    def take(self, key, limit, cost=1):
+        """Takes `cost` tokens; returns 0 if it could, else the seconds until it can."""
+        now = time.monotonic()
+        lock, buckets = self._shards[hash(key) % len(self._shards)]
+        with lock:
+            bucket = buckets.get(key)
+            if bucket is None:
+                if len(buckets) >= self.max_keys_per_shard:
+                    self._prune(buckets, now)
+                tokens = limit.capacity
+            else:
+                tokens = min(limit.capacity, bucket[0] + (now - bucket[1]) * limit.rate)
+            if tokens >= cost:
+                tokens -= cost
+                buckets[key] = (tokens, now, now + (limit.capacity - tokens) / limit.rate)
+                return 0.0
+            buckets[key] = (tokens, now, now + (limit.capacity - tokens) / limit.rate)
+            return (cost - tokens) / limit.rate
+
+    def _prune(self, buckets, now):
+        # a full bucket is the same as no bucket
+        for key in [key for key, (_, _, full_at) in buckets.items() if full_at <= now]:
+            del buckets[key]
+        # still too many active clients: forget the oldest ones
+        while len(buckets) >= self.max_keys_per_shard:
+            del buckets[next(iter(buckets))]
+
+    def clear(self):
+        for lock, buckets in self._shards:
+            with lock:
+                buckets.clear()
+
+    def __len__(self):
+        return sum(len(buckets) for _, buckets in self._shards)
+
+
+class SQLBuckets:
+    """Buckets in the rate_limit_bucket table, shared by all workers."""
+
+    def take(self, key, limit, cost=1):
+        now = time.time()
+        refilled = RateLimitBucket.tokens + (now - RateLimitBucket.updated_at) * limit.rate
+        refilled = case((refilled > limit.capacity, limit.capacity), else_=refilled)
+        # tokens is assigned before updated_at (table order), which MySQL's left-to-right SET needs
+        take = (
+            update(RateLimitBucket)
+            .where(RateLimitBucket.key == key, refilled >= cost)
+            .values(tokens=refilled - cost, updated_at=now)
+        )
+        # its own short transaction on the primary, whatever the request is doing
+        with db.engine.begin() as connection:
+            if connection.execute(take).rowcount:
+                return 0.0
+            insert_ignore(RateLimitBucket, [{"key": key, "tokens": limit.capacity, "updated_at": now}],
+                          ['key'], ['key'], connection)
+            if connection.execute(take).rowcount:
+                return 0.0
+            tokens, updated_at = connection.execute(
+                select(RateLimitBucket.tokens, RateLimitBucket.updated_at).where(RateLimitBucket.key == key)
+            ).one()
+        tokens = min(limit.capacity, tokens + (now - updated_at) * limit.rate)
+        return max(0.0, (cost - tokens) / limit.rate)
+
+    def purge(self, idle_seconds):
+        """Deletes buckets untouched for `idle_seconds`, which are full by then."""
+        with db.engine.begin() as connection:
+            return connection.execute(
+                delete(RateLimitBucket).where(RateLimitBucket.updated_at < time.time() - idle_seconds)
+            ).rowcount
+
+
+class RateLimiter:
+
+    def __init__(self, store, ip_limit=None, route_limits=None, exempt=()):
+        self.store = store
+        self.ip_limit = ip_limit
+        self.route_limits = route_limits or {}
+        self.exempt = set(exempt)
+
+    @classmethod
+    def from_config(cls, config):
+        store = SQLBuckets() if config.get('RATE_LIMIT_STORE') == 'sql' else \
+            MemoryBuckets(config.get('RATE_LIMIT_SHARDS', 64), config.get('RATE_LIMIT_MAX_KEYS', 100000))
+        return cls(
+            store,
+            parse_limit(config['RATE_LIMIT_IP']) if config.get('RATE_LIMIT_IP') else None,
+            parse_route_limits(config.get('RATE_LIMIT_ROUTES')),
+            config.get('RATE_LIMIT_EXEMPT', ()),
+        )
+
+    @property
+    def enabled(self):
+        return bool(self.ip_limit or self.route_limits)
+
+    def check(self, endpoint, address):
+        """Takes a token from every bucket that applies; returns the longest wait, 0 if none."""
+        wait = 0.0
+        if self.ip_limit:
+            wait = self.store.take(f"ip:{address}", self.ip_limit)
+        route_limit = self.route_limits.get(endpoint)
+        if route_limit:
+            wait = max(wait, self.store.take(f"route:{endpoint}:ip:{address}", route_limit))
+        return wait
+
+    def limit_request(self):
+        endpoint = request.endpoint
+        if endpoint is None or endpoint in self.exempt or request.path.startswith('/admin'):
+            return
+        wait = self.check(endpoint, request.remote_addr)
+        if wait:
+            registry.inc("http_rate_limited_total", f'endpoint="{endpoint}"')
+            raise APIException('Too many requests, slow down', status_code=429,
+                               payload={"retry_after": round(wait, 3)},
+                               headers={"Retry-After": str(max(1, round(wait + 0.5)))})
+
+
+def init_rate_limit(app):
+    limiter = RateLimiter.from_config(app.config)
+    app.extensions['rate_limiter'] = limiter
+    if limiter.enabled:
+        app.before_request(limiter.limit_request)
+
+
+def bench_limiter(limiter, calls=100000, keys=10000, seed=0):
+    """Per-call timings in microseconds of limiter.check() over `keys` clients."""
+    rng = random.Random(seed)
+    endpoints = list(limiter.route_limits) or ['get_user']
+    clients = [(rng.choice(endpoints), f"10.{i >> 16 & 255}.{i >> 8 & 255}.{i & 255}") for i in range(keys)]
+    timings = []
+    clock = time.perf_counter_ns
+    for _ in range(calls):
+        endpoint, address = clients[rng.randrange(keys)]
+        started = clock()
+        limiter.check(endpoint, address)
+        timings.append((clock() - started) / 1000)
+    return timings
+
+
+ratelimit_cli = AppGroup('ratelimit', help='Inspect and maintain the rate limiter.')
+
+
+@ratelimit_cli.command('bench')
+@click.option('--calls', default=100000, show_default=True)
+@click.option('--keys', default=10000, show_default=True, help='Distinct clients.')
+@click.option('--store', type=click.Choice(['memory', 'sql']), default='memory', show_default=True)
+def bench_command(calls, keys, store):
+    """Time the limiter alone, with every kind of limit on and nothing throttled."""
+    limiter = RateLimiter(
+        SQLBuckets() if store == 'sql' else MemoryBuckets(current_app.config.get('RATE_LIMIT_SHARDS', 64)),
+        Limit(1e6, 1e6), {"get_user": Limit(1e6, 1e6), "create_likes_batch": Limit(1e6, 1e6)},
+    )
+    timings = sorted(bench_limiter(limiter, calls, keys))
+    mean = sum(timings) / len(timings)
+    click.echo(f"{calls} checks over {keys} clients ({store}): mean {mean:.1f}us, "
+               f"p50 {timings[len(timings) // 2]:.1f}us, p99 {timings[int(len(timings) * 0.99)]:.1f}us")
+
+    # the whole before_request hook, request parsing included
+    with current_app.test_request_context('/users/1'):
+        started = time.perf_counter()
+        for _ in range(calls):
+            limiter.limit_request()
+        click.echo(f"before_request hook: {(time.perf_counter() - started) / calls * 1e6:.1f}us per request")
+
+
+@ratelimit_cli.command('purge')
+@click.option('--idle', default=3600, show_default=True, help='Delete buckets idle for this many seconds.')
+def purge_command(idle):
+    """Delete idle buckets from the shared SQL store."""
+    click.echo(f"{SQLBuckets().purge(idle)} buckets deleted")
@@ -0,0 +1,221 @@
+"""
+The API endpoints, added to each app by register_routes().
+
+Routes are collected by @route instead of being bound to a global app, so
+the factory in app.py can build as many apps as it likes and skip the
+routes of disabled features.
+"""
+from flask import current_app, request, jsonify, Response, abort, send_from_directory, stream_with_context
+from utils import APIException, generate_sitemap, json_with_etag
+from models import db, User, Post, Comment, Story
+from feed import read_feed
+from bulk import bulk_comment, bulk_follow, bulk_like
+from cache import cached_post, cached_user, get_cache
+from metrics import collect
+from pagination import get_limit
+from serializers import load_fields, page_payload, parse_fieldset, serialize_page
+from stories import active_stories
+from archive import paginate_with_archive
+from search import search_users
+from tags import location_feed, tag_feed
+from notifications import user_notifications
+from graph import get_graph, load_users
+from explore import explore_page
+from export import decode_cursor as decode_export_cursor, export_ndjson
+from media import grid_size, tag_grid, user_grid
+from sync import activity_response
+
+# (rule, view, feature, options); feature None means always on
+ROUTES = []
+
+
+def route(rule, feature=None, **options):
+    def register(fn):
+        ROUTES.append((rule, fn, feature, options))
+        return fn
+    return register
+
+
+def register_routes(app, features=()):
+    app.register_error_handler(APIException, handle_invalid_usage)
+    for rule, view, feature, options in ROUTES:
+        if feature is None or feature in features:
+            app.add_url_rule(rule, view_func=view, **options)
+
+
+# Handle/serialize errors like a JSON object
+def handle_invalid_usage(error):
+    return jsonify(error.to_dict()), error.status_code, error.headers or {}
+
+# generate sitemap with all your endpoints
+@route('/', feature='sitemap')
+def sitemap():
+    return generate_sitemap(current_app)
+
+@route('/user', methods=['GET'])
+def handle_hello():
+
+    response_body = {
+        "msg": "Hello, this is your GET /user response "
+    }
+
+    return jsonify(response_body), 200
+
+@route('/users/search', methods=['GET'])
+def search_users_endpoint():
+    fieldset = parse_fieldset(User)
+    users = search_users(request.args.get('q', ''), min(get_limit(), 20))
+    results, _ = serialize_page(users, fields=fieldset["fields"])
+    return jsonify({"results": results}), 200
+
+@route('/users/<int:user_id>', methods=['GET'])
+def get_user(user_id):
+    payload, etag = cached_user(user_id)
+    if payload is None:
+        raise APIException('User not found', status_code=404)
+    return json_with_etag(payload, etag)
+
+@route('/posts/<int:post_id>', methods=['GET'])
+def get_post(post_id):
+    payload, etag = cached_post(post_id)
+    if payload is None:
+        raise APIException('Post not found', status_code=404)
+    return json_with_etag(payload, etag)
+
+@route('/posts/<int:post_id>/activity', methods=['GET'])
+def get_post_activity(post_id):
+    return activity_response(post_id, get_limit())
+
+@route('/cache/stats', methods=['GET'])
+def get_cache_stats():
+    return jsonify(get_cache().stats()), 200
+
+@route('/metrics', methods=['GET'])
+def get_metrics():
+    return Response(collect(), mimetype='text/plain; version=0.0.4')
+
+@route('/feed', methods=['GET'])
+def get_feed():
+    user_id = request.args.get('user_id', type=int)
+    if user_id is None:
+        raise APIException('user_id is required', status_code=400)
+    if db.session.get(User, user_id) is None:
+        raise APIException('User not found', status_code=404)
+
+    fieldset = parse_fieldset(Post)
+    posts, next_cursor = read_feed(user_id, request.args.get('cursor'), get_limit(),
+                                   load_fields(Post, fieldset["fields"]))
+    return jsonify(page_payload(posts, fieldset, next_cursor=next_cursor)), 200
+
+@route('/users/<int:user_id>/export', methods=['GET'])
+def export_user(user_id):
+    if db.session.get(User, user_id) is None:
+        raise APIException('User not found', status_code=404)
+    cursor = request.args.get('cursor')
+    if cursor:
+        decode_export_cursor(cursor)  # reject a bad cursor before the 200 goes out
+    return Response(stream_with_context(export_ndjson(user_id, cursor)), mimetype='application/x-ndjson')
+
+@route('/users/<int:user_id>/follows/<int:other_id>', methods=['GET'])
+def get_follow_status(user_id, other_id):
+    graph = get_graph()
+    return jsonify({"follows": graph.follows(user_id, other_id), "followed_by": graph.follows(other_id, user_id)}), 200
+
+@route('/users/<int:user_id>/mutuals', methods=['GET'])
+def get_mutuals(user_id):
+    fieldset = parse_fieldset(User)
+    ids = get_graph().mutuals(user_id)
+    results, _ = serialize_page(load_users(ids[:get_limit()]), fields=fieldset["fields"])
+    return jsonify({"count": len(ids), "results": results}), 200
+
+@route('/users/<int:user_id>/followed-by/<int:target_id>', methods=['GET'])
+def get_followed_by(user_id, target_id):
+    fieldset = parse_fieldset(User)
+    ids = get_graph().followed_by(user_id, target_id)
+    results, _ = serialize_page(load_users(ids[:get_limit()]), fields=fieldset["fields"])
+    return jsonify({"count": len(ids), "results": results}), 200
+
+@route('/users/<int:user_id>/suggestions', methods=['GET'])
+def get_suggestions(user_id):
+    fieldset = parse_fieldset(User)
+    scores = dict(get_graph().suggestions(user_id, get_limit()))
+    users = load_users(scores)
+    results, _ = serialize_page(users, fields=fieldset["fields"])
+    for user, result in zip(users, results):
+        result["followed_by_count"] = scores[user.id]
+    return jsonify({"results": results}), 200
+
+@route('/users/<int:user_id>/notifications', methods=['GET'])
+def get_notifications(user_id):
+    notifications, next_cursor = user_notifications(user_id, request.args.get('cursor'), get_limit())
+    return jsonify({"results": [n.serialize() for n in notifications], "next_cursor": next_cursor}), 200
+
+@route('/tags/<tag>/posts', methods=['GET'])
+def get_tag_posts(tag):
+    fieldset = parse_fieldset(Post)
+    posts, next_cursor = tag_feed(tag, request.args.get('cursor'), get_limit(), load_fields(Post, fieldset["fields"]))
+    return jsonify(page_payload(posts, fieldset, next_cursor=next_cursor)), 200
+
+@route('/locations/<path:location>/posts', methods=['GET'])
+def get_location_posts(location):
+    fieldset = parse_fieldset(Post)
+    posts, next_cursor = location_feed(location, request.args.get('cursor'), get_limit(),
+                                       load_fields(Post, fieldset["fields"]))
+    return jsonify(page_payload(posts, fieldset, next_cursor=next_cursor)), 200
+
+@route('/users/<int:user_id>/grid', methods=['GET'])
+def get_user_grid(user_id):
+    items, next_cursor = user_grid(user_id, request.args.get('cursor'), get_limit(), grid_size())
+    return jsonify({"results": items, "next_cursor": next_cursor}), 200
+
+@route('/tags/<tag>/grid', methods=['GET'])
+def get_tag_grid(tag):
+    items, next_cursor = tag_grid(tag, request.args.get('cursor'), get_limit(), grid_size())
+    return jsonify({"results": items, "next_cursor": next_cursor}), 200
+
+# uploads and their thumbnails; in production the web server or a CDN should serve MEDIA_DIR
+@route('/media/<path:filename>', methods=['GET'])
+def get_media(filename):
+    if not current_app.config.get('MEDIA_DIR'):
+        abort(404)
+    return send_from_directory(current_app.config['MEDIA_DIR'], filename, max_age=86400)
+
+@route('/explore', methods=['GET'])
+def get_explore():
+    fieldset = parse_fieldset(Post)
+    posts, next_cursor = explore_page(request.args.get('period', '24h'), request.args.get('cursor'), get_limit(),
+                                      load_fields(Post, fieldset["fields"]))
+    return jsonify(page_payload(posts, fieldset, next_cursor=next_cursor)), 200
+
+@route('/posts/<int:post_id>/comments', methods=['GET'])
+def get_post_comments(post_id):
+    fieldset = parse_fieldset(Comment)
+    comments, next_cursor = paginate_with_archive(
+        Comment, lambda entity: [entity.post_id == post_id], request.args.get('cursor'), get_limit(),
+        load_fields(Comment, fieldset["fields"]),
+    )
+    return jsonify(page_payload(comments, fieldset, next_cursor=next_cursor)), 200
+
+@route('/users/<int:user_id>/stories', methods=['GET'])
+def get_active_stories(user_id):
+    return jsonify(page_payload(active_stories(user_id), parse_fieldset(Story))), 200
+
+@route('/likes/batch', methods=['POST'])
+def create_likes_batch():
+    body = request.get_json(silent=True) or {}
+    return jsonify(bulk_like(body.get('likes'))), 200
+
+@route('/follows/batch', methods=['POST'])
+def create_follows_batch():
+    body = request.get_json(silent=True) or {}
+    return jsonify(bulk_follow(body.get('follows'))), 200
+
+@route('/comments/batch', methods=['POST'])
+def create_comments_batch():
+    body = request.get_json(silent=True) or {}
+    return jsonify(bulk_comment(body.get('comments'))), 200
+
+@route('/swagger.json', feature='swagger', methods=['GET'])
+def get_swagger():
+    from flask_swagger import swagger  # only loaded when the spec is asked for
+    return jsonify(swagger(current_app)), 200
@@ -0,0 +1,136 @@
+"""
+Username / full name autocomplete for GET /users/search.
+
+Postgres answers from the indexes created in migrations c8f3a61d2e97 and
+6b8e2f4a1c07: a C-collated index on lower(username) for prefixes and
+pg_trgm GIN indexes for matches inside a name. SQLite answers from the
+`user_search` FTS5 table, kept in sync by the User mapper events below;
+rows written with Core (`flask seed`) are picked up by `flask search
+rebuild`. Other dialects fall back to prefix LIKE on the unique username
+index.
+
+Matches are ranked username prefix first, then full name prefix, then
+by follower count. Queries shorter than a trigram match too many names
+to rank, and can't use the trigram indexes anyway: they only match
+username prefixes, in username order, so the LIMIT stops the index scan.
+"""
+import click
+from flask.cli import AppGroup
+from sqlalchemy import case, column, event, func, inspect, literal_column, select, table, text
+from models import db, User
+
+SEARCH_TABLE = 'user_search'
+MIN_QUERY_LENGTH = 2
+# below this only username prefixes are searched
+TRIGRAM_LENGTH = 3
+
+user_search = table(SEARCH_TABLE, column('rowid'), column('username'), column('full_name'))
+
+
+def include_object(obj, name, type_, reflected, compare_to):
+    # the FTS5 table, its shadow tables and the expression indexes live outside the models
+    return not (reflected and compare_to is None and name and name.startswith(SEARCH_TABLE)) \
+        and not (type_ == 'index' and name and name.startswith('ix_user_search_'))
+
+
+def _fts_query(q):
+    # every word becomes a quoted prefix term, so user input can't use FTS syntax
+    return ' '.join('"{}"*'.format(word.replace('"', '""')) for word in q.split())
+
+
+def _username_prefix(q, dialect, limit):
+    if dialect == 'sqlite':
+        matches = User.id.in_(
+            select(user_search.c.rowid).where(literal_column(SEARCH_TABLE).match(f"username: {_fts_query(q)}"))
+        )
+        order = func.lower(User.username)
+    elif dialect == 'postgresql':
+        # the expression of ix_user_search_username_c, which serves both the LIKE and the ORDER BY
+        order = func.lower(User.username).collate('C')
+        matches = order.startswith(q, autoescape=True)
+    else:
+        order = User.username
+        matches = User.username.startswith(q, autoescape=True)
+    stmt = select(User).where(matches, User.is_active).order_by(order).limit(limit)
+    return db.session.scalars(stmt).all()
+
+
+def search_users(q, limit=10):
+    q = q.strip().lower()
+    if len(q) < MIN_QUERY_LENGTH:
+        return []
+    dialect = db.session.get_bind().dialect.name
+    if len(q) < TRIGRAM_LENGTH:
+        return _username_prefix(q, dialect, limit)
+    username, full_name = func.lower(User.username), func.lower(User.full_name)
+    if dialect == 'sqlite':
+        matches = User.id.in_(
+            select(user_search.c.rowid).where(literal_column(SEARCH_TABLE).match(_fts_query(q)))
+        )
+    elif dialect == 'postgresql':
+        matches = username.collate('C').startswith(q, autoescape=True) | full_name.contains(q, autoescape=True)
+    else:
+        # MySQL's default collations already compare case-insensitively, lower() would skip the index
+        matches = User.username.startswith(q, autoescape=True) | User.full_name.startswith(q, autoescape=True)
+    rank = case(
+        (username.startswith(q, autoescape=True), 0),
+        (full_name.startswith(q, autoescape=True), 1),
+        else_=2,
+    )
+    stmt = select(User).where(matches, User.is_active).order_by(rank, User.followers_count.desc(), User.id)
+    return db.session.scalars(stmt.limit(limit)).all()
+
+
+def rebuild_search_index():
+    """Refills the SQLite FTS table from the user table; a no-op elsewhere."""
+    if db.session.get_bind().dialect.name != 'sqlite':
+        return
+    db.session.execute(text(f"DELETE FROM {SEARCH_TABLE}"))
+    db.session.execute(text(
+        f"INSERT INTO {SEARCH_TABLE} (rowid, username, full_name) "
+        f"SELECT id, username, coalesce(full_name, '') FROM user"
+    ))
+    db.session.commit()
+
+
+def _index_user(connection, target):
+    connection.execute(
+        text(f"INSERT INTO {SEARCH_TABLE} (rowid, username, full_name) VALUES (:id, :username, :full_name)"),
+        {"id": target.id, "username": target.username, "full_name": target.full_name or ''},
+    )
+
+
+def _unindex_user(connection, target):
+    connection.execute(text(f"DELETE FROM {SEARCH_TABLE} WHERE rowid = :id"), {"id": target.id})
+
+
+@event.listens_for(User, 'after_insert')
+def _index_new_user(mapper, connection, target):
+    if connection.dialect.name == 'sqlite':
+        _index_user(connection, target)
+
+
+@event.listens_for(User, 'after_update')
+def _reindex_user(mapper, connection, target):
+    if connection.dialect.name != 'sqlite':
+        return
+    state = inspect(target)
+    if state.attrs.username.history.has_changes() or state.attrs.full_name.history.has_changes():
+        _unindex_user(connection, target)
+        _index_user(connection, target)
+
+
+@event.listens_for(User, 'after_delete')
+def _unindex_deleted_user(mapper, connection, target):
+    if connection.dialect.name == 'sqlite':
+        _unindex_user(connection, target)
+
+
+search_cli = AppGroup('search', help='Maintain the user search index.')
+
+
+@search_cli.command('rebuild')
+def rebuild_command():
+    """Refill the SQLite FTS table from the user table."""
+    rebuild_search_index()
+    click.echo("user search index rebuilt")
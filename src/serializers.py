@@ -0,0 +1,173 @@
+"""
+Batch serialization for lists of Posts, Comments and Stories.
+
+Calling `serialize()` in a loop lazy-loads `item.user` once per row. These
+helpers load every author of a page with a single SELECT ... IN and attach
+them to the items first, so a page costs a constant number of queries no
+matter how long it is. The dicts are exactly what `serialize()` returns.
+
+serialize_page() adds the compact forms on top: `?fields=` sparse fieldsets
+(plus `fields[user]=` for the embedded author) and `?include=users`, which
+replaces the nested author with a top-level `users` map so every user is
+serialized once per page. load_fields() narrows the SELECT to the same
+columns. Without these parameters the output is unchanged.
+
+The compact forms leave timestamps as datetimes: CompactJSONProvider hands
+them to orjson, which writes the same ISO 8601 text as isoformat() without
+a Python call per value.
+"""
+import json
+from datetime import datetime
+from flask import request
+from flask.json.provider import DefaultJSONProvider
+from sqlalchemy import inspect, select
+from sqlalchemy.orm import load_only, selectinload
+from sqlalchemy.orm.attributes import set_committed_value
+from models import db, User, Post, Comment, Story
+from utils import APIException
+
+try:
+    import orjson
+except ImportError:  # in the Pipfile; without it the stdlib encoder is used
+    orjson = None
+
+# the keys produced by each model's serialize(), in order
+SERIALIZED_FIELDS = {
+    User: ('id', 'username', 'email', 'full_name', 'bio', 'profile_picture', 'website',
+           'is_private', 'created_at', 'posts_count', 'followers_count', 'following_count'),
+    Post: ('id', 'image_url', 'caption', 'location', 'user_id', 'created_at',
+           'likes_count', 'comments_count', 'user'),
+    Comment: ('id', 'content', 'user_id', 'post_id', 'created_at', 'user'),
+    Story: ('id', 'media_url', 'user_id', 'created_at', 'expires_at', 'user'),
+}
+
+
+def with_users(stmt, model):
+    # use this when building the query: authors arrive in one extra SELECT
+    return stmt.options(selectinload(model.user))
+
+
+def attach_users(items):
+    pending = [item for item in items if 'user' in inspect(item).unloaded]
+    user_ids = {item.user_id for item in pending}
+    if not user_ids:
+        return
+    users = {user.id: user for user in db.session.scalars(select(User).where(User.id.in_(user_ids)))}
+    for item in pending:
+        set_committed_value(item, 'user', users.get(item.user_id))
+
+
+def serialize_many(items):
+    items = list(items)
+    attach_users(items)
+    return [item.serialize() for item in items]
+
+
+serialize_posts = serialize_many
+serialize_comments = serialize_many
+serialize_stories = serialize_many
+
+
+def _parse(param, model):
+    value = request.args.get(param)
+    if not value:
+        return None
+    fields = tuple(name.strip() for name in value.split(',') if name.strip())
+    unknown = set(fields) - set(SERIALIZED_FIELDS[model])
+    if unknown:
+        raise APIException(f"Unknown fields for {param}: {', '.join(sorted(unknown))}", status_code=400)
+    return fields
+
+
+def parse_fieldset(model):
+    """Reads ?fields=, ?fields[user]= and ?include=users for a list of `model`."""
+    include = {name.strip() for name in request.args.get('include', '').split(',') if name.strip()}
+    if include - {'users'}:
+        raise APIException('Only include=users is supported', status_code=400)
+    return {
+        "fields": _parse('fields', model),
+        "user_fields": _parse('fields[user]', User),
+        "include_users": 'users' in include,
+    }
+
+
+def load_fields(model, fields):
+    """Loader options that SELECT only the columns `fields` needs (plus keys and ordering)."""
+    if not fields:
+        return []
+    names = {'id', 'user_id', 'created_at'} | set(fields)
+    columns = [getattr(model, name) for name in SERIALIZED_FIELDS[model] if name in names and name != 'user']
+    return [load_only(*columns)]
+
+
+def _pick(obj, fields):
+    return {name: getattr(obj, name) for name in fields}
+
+
+def serialize_page(items, fields=None, user_fields=None, include_users=False):
+    """Returns (results, users) where users is the side-loaded map or None."""
+    items = list(items)
+    if fields is None and user_fields is None and not include_users:
+        return serialize_many(items), None
+    if not items:
+        return [], {} if include_users else None
+
+    fields = fields or SERIALIZED_FIELDS[type(items[0])]
+    user_fields = user_fields or SERIALIZED_FIELDS[User]
+    embed = 'user' in fields and not include_users
+    if embed or include_users:
+        attach_users(items)
+
+    # each author is turned into a dict once, however often they appear
+    users = {}
+    results = []
+    for item in items:
+        row = {name: getattr(item, name) for name in fields if name != 'user'}
+        if embed or include_users:
+            if item.user_id not in users:
+                users[item.user_id] = _pick(item.user, user_fields) if item.user else None
+            if embed:
+                row['user'] = users[item.user_id]
+            else:
+                row['user_id'] = item.user_id
+        results.append(row)
+    if include_users:
+        return results, {str(user_id): user for user_id, user in users.items()}
+    return results, None
+
+
+def page_payload(items, fieldset, **extra):
+    """{"results": [...], **extra}, plus "users" when they are side-loaded."""
+    results, users = serialize_page(items, **fieldset)
+    payload = {"results": results}
+    if users is not None:
+        payload["users"] = users
+    payload.update(extra)
+    return payload
+
+
+class CompactJSONProvider(DefaultJSONProvider):
+    """Unsorted, whitespace-free JSON, datetimes in ISO 8601; uses orjson when it is installed."""
+
+    sort_keys = False
+    compact = True
+
+    @staticmethod
+    def default(obj):
+        # what orjson writes for them, instead of Flask's HTTP date
+        if isinstance(obj, datetime):
+            return obj.isoformat()
+        return DefaultJSONProvider.default(obj)
+
+    def dumps(self, obj, **kwargs):
+        # response() always asks for compact separators, which is what orjson writes
+        if orjson is not None and kwargs in ({}, {'separators': (',', ':')}):
+            try:
+                return orjson.dumps(obj, option=orjson.OPT_NON_STR_KEYS).decode()
+            except TypeError:
+                pass  # types orjson doesn't know; the default encoder handles them
+        kwargs.setdefault('default', self.default)
+        kwargs.setdefault('ensure_ascii', self.ensure_ascii)
+        kwargs.setdefault('sort_keys', self.sort_keys)
+        kwargs.setdefault('separators', (',', ':'))
+        return json.dumps(obj, **kwargs)
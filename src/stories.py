@@ -0,0 +1,113 @@
+"""
+Active stories and the sweeper that removes expired ones.
+
+The sweeper deletes (or archives into story_archive) expired stories in
+small batches, committing after each one so no lock is held for long. It
+runs from `flask stories sweep` or, when STORY_SWEEP_INTERVAL is set, from
+a daemon thread inside the app process.
+"""
+import logging
+import threading
+import time
+from datetime import datetime
+import click
+from flask.cli import AppGroup
+from sqlalchemy import delete, insert, literal, select
+from models import db, Story, StoryArchive
+
+logger = logging.getLogger(__name__)
+
+
+def active_stories(user_id, now=None):
+    now = now or datetime.utcnow()
+    stmt = (
+        select(Story)
+        .where(Story.user_id == user_id, Story.expires_at > now)
+        .order_by(Story.expires_at)
+    )
+    return db.session.scalars(stmt).all()
+
+
+def sweep_expired_stories(batch_size=500, max_batches=None, archive=False, now=None):
+    """Removes expired stories batch by batch; returns [{"rows", "seconds"}] per batch."""
+    now = now or datetime.utcnow()
+    batches = []
+    while max_batches is None or len(batches) < max_batches:
+        started = time.perf_counter()
+        ids = db.session.scalars(
+            select(Story.id)
+            .where(Story.expires_at <= now)
+            .order_by(Story.expires_at)
+            .limit(batch_size)
+            .with_for_update(skip_locked=True)
+        ).all()
+        if not ids:
+            break
+        if archive:
+            expired = select(
+                Story.id, Story.media_url, Story.user_id, Story.created_at, Story.expires_at, literal(now)
+            ).where(Story.id.in_(ids))
+            db.session.execute(insert(StoryArchive).from_select(
+                ['id', 'media_url', 'user_id', 'created_at', 'expires_at', 'archived_at'], expired
+            ))
+        db.session.execute(delete(Story).where(Story.id.in_(ids)).execution_options(synchronize_session=False))
+        db.session.commit()
+        batches.append({"rows": len(ids), "seconds": time.perf_counter() - started})
+    return batches
+
+
+class StorySweeper(threading.Thread):
+
+    def __init__(self, app, interval, batch_size=500, archive=False):
+        super().__init__(name='story-sweeper', daemon=True)
+        self.app = app
+        self.interval = interval
+        self.batch_size = batch_size
+        self.archive = archive
+        self._stopped = threading.Event()
+
+    def stop(self):
+        self._stopped.set()
+
+    def run(self):
+        while not self._stopped.wait(self.interval):
+            with self.app.app_context():
+                try:
+                    batches = sweep_expired_stories(self.batch_size, archive=self.archive)
+                    if batches:
+                        logger.info("story sweep removed %d rows in %d batches (slowest %.3fs)",
+                                    sum(b["rows"] for b in batches), len(batches),
+                                    max(b["seconds"] for b in batches))
+                except Exception:
+                    db.session.rollback()
+                    logger.exception("story sweep failed")
+                finally:
+                    db.session.remove()
+
+
+def start_story_sweeper(app):
+    interval = app.config.get('STORY_SWEEP_INTERVAL')
+    if not interval:
+        return None
+    sweeper = StorySweeper(
+        app, interval,
+        batch_size=app.config.get('STORY_SWEEP_BATCH_SIZE', 500),
+        archive=app.config.get('STORY_SWEEP_ARCHIVE', False),
+    )
+    sweeper.start()
+    return sweeper
+
+
+stories_cli = AppGroup('stories', help='Maintain the story table.')
+
+
+@stories_cli.command('sweep')
+@click.option('--batch-size', default=500, show_default=True, help='Rows deleted per transaction.')
+@click.option('--max-batches', type=int, default=None, help='Stop after this many batches.')
+@click.option('--archive', is_flag=True, help='Copy expired stories to story_archive before deleting.')
+def sweep_command(batch_size, max_batches, archive):
+    """Delete or archive expired stories in bounded batches."""
+    batches = sweep_expired_stories(batch_size, max_batches, archive)
+    for number, batch in enumerate(batches, 1):
+        click.echo(f"batch {number}: {batch['rows']} rows in {batch['seconds'] * 1000:.1f} ms")
+    click.echo(f"{sum(b['rows'] for b in batches)} expired stories removed")
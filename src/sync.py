@@ -0,0 +1,170 @@
+"""
+Delta sync of a post's likes and comments for polling clients.
+
+GET /posts/<id>/activity?cursor= returns the likes and comments added
+after the cursor (or after ?since=<ISO time>), oldest first, with the
+post's current counts and the cursor to poll with next. Each table is read
+with a range scan on its (post_id, created_at, id) index. Without a cursor
+it returns no rows, only the counts and a cursor to start polling from.
+
+Rows only show up once they are SYNC_SETTLE_SECONDS old. created_at is
+set before commit, so a slow transaction can make a row visible after
+newer ones; holding back the newest rows keeps the cursor from skipping it.
+
+Both validators are read from the database for the rows this request
+would return, so every worker agrees on them and the cursor stays out of
+them. The ETag names the post's counts and the first and last settled like
+and comment after the cursor: once a poll with the cursor it got comes
+back empty, a client sending that ETag back gets 304 until something new
+settles or the counts change. Last-Modified is the newest of those rows, or the
+cursor's own time when there are none; If-Modified-Since is only answered
+304 when there are none, and it can't see an unlike, which only changes
+the counts. If-None-Match takes precedence.
+"""
+import base64
+from datetime import datetime, timedelta, timezone
+from flask import current_app, jsonify, make_response, request
+from sqlalchemy import and_, or_, select
+from models import db, Post, Like, Comment
+from archive import archive_before
+from utils import APIException
+
+
+def encode_cursor(likes, comments):
+    raw = '|'.join(f"{created_at.isoformat()}|{row_id}" for created_at, row_id in (likes, comments))
+    return base64.urlsafe_b64encode(raw.encode()).decode().rstrip('=')
+
+
+def decode_cursor(token):
+    try:
+        raw = base64.urlsafe_b64decode(token + '=' * (-len(token) % 4)).decode()
+        like_at, like_id, comment_at, comment_id = raw.split('|')
+        return ((datetime.fromisoformat(like_at), int(like_id)),
+                (datetime.fromisoformat(comment_at), int(comment_id)))
+    except (ValueError, UnicodeDecodeError):
+        raise APIException('Invalid cursor', status_code=400)
+
+
+def _parse_since(value):
+    try:
+        since = datetime.fromisoformat(value)
+    except ValueError:
+        raise APIException('since must be an ISO 8601 time', status_code=400)
+    # stored times are naive UTC
+    return since.astimezone(timezone.utc).replace(tzinfo=None) if since.tzinfo else since
+
+
+def _after(model, post_id, after, until):
+    created_at, row_id = after
+    return (model.post_id == post_id, model.created_at >= created_at, model.created_at <= until,
+            or_(model.created_at > created_at, and_(model.created_at == created_at, model.id > row_id)))
+
+
+def _rows_after(model, columns, post_id, after, until, limit):
+    return db.session.execute(
+        select(*columns)
+        .where(*_after(model, post_id, after, until))
+        .order_by(model.created_at, model.id)
+        .limit(limit + 1)
+    ).all()
+
+
+def _settled_until(now=None):
+    return (now or datetime.utcnow()) - timedelta(seconds=current_app.config.get('SYNC_SETTLE_SECONDS', 2))
+
+
+def _start(cursor, since, until):
+    """Where the likes and the comments of a request start, as (created_at, id) pairs."""
+    if cursor:
+        likes_after, comments_after = decode_cursor(cursor)
+    else:
+        start = since if since is not None else until
+        likes_after = comments_after = (start, 0)
+    if min(likes_after[0], comments_after[0]) < archive_before():
+        raise APIException('since/cursor is older than the archive cutoff, reload the post', status_code=410)
+    return likes_after, comments_after
+
+
+def post_activity(post_id, cursor=None, since=None, limit=50, now=None):
+    """The likes and comments of `post_id` after the cursor; None if there is no such post."""
+    counts = db.session.execute(
+        select(Post.likes_count, Post.comments_count).where(Post.id == post_id)
+    ).first()
+    if counts is None:
+        return None
+    until = _settled_until(now)
+    likes_after, comments_after = _start(cursor, since, until)
+
+    likes = _rows_after(Like, (Like.id, Like.user_id, Like.created_at), post_id, likes_after, until, limit)
+    comments = _rows_after(Comment, (Comment.id, Comment.user_id, Comment.content, Comment.created_at),
+                           post_id, comments_after, until, limit)
+    has_more = len(likes) > limit or len(comments) > limit
+    likes, comments = likes[:limit], comments[:limit]
+    # a table with nothing new moves up to the settled time, so later scans start there
+    likes_after = (likes[-1].created_at, likes[-1].id) if likes else max(likes_after, (until, 0))
+    comments_after = (comments[-1].created_at, comments[-1].id) if comments else max(comments_after, (until, 0))
+    return {
+        "post_id": post_id,
+        "likes_count": counts.likes_count,
+        "comments_count": counts.comments_count,
+        "likes": [{"id": row.id, "user_id": row.user_id, "created_at": row.created_at.isoformat()}
+                  for row in likes],
+        "comments": [{"id": row.id, "user_id": row.user_id, "content": row.content,
+                      "created_at": row.created_at.isoformat()} for row in comments],
+        "cursor": encode_cursor(likes_after, comments_after),
+        "has_more": has_more,
+    }
+
+
+def activity_state(post_id, likes_after, comments_after, until):
+    """The post's counts and the first and last settled like and comment after the cursor, in one
+    query of index probes; None if there is no such post."""
+    def edge(model, after, column, last):
+        order = (model.created_at.desc(), model.id.desc()) if last else (model.created_at, model.id)
+        return (select(column).where(*_after(model, post_id, after, until))
+                .order_by(*order).limit(1).scalar_subquery())
+
+    return db.session.execute(select(
+        Post.likes_count,
+        Post.comments_count,
+        edge(Like, likes_after, Like.id, False).label('first_like'),
+        edge(Like, likes_after, Like.id, True).label('last_like'),
+        edge(Like, likes_after, Like.created_at, True).label('last_like_at'),
+        edge(Comment, comments_after, Comment.id, False).label('first_comment'),
+        edge(Comment, comments_after, Comment.id, True).label('last_comment'),
+        edge(Comment, comments_after, Comment.created_at, True).label('last_comment_at'),
+    ).where(Post.id == post_id)).first()
+
+
+def activity_response(post_id, limit):
+    """post_activity() as a response, answering 304 when the client already has what it would return."""
+    cursor, since = request.args.get('cursor'), request.args.get('since')
+    since = _parse_since(since) if since else None
+    now = datetime.utcnow()
+    until = _settled_until(now)
+    likes_after, comments_after = _start(cursor, since, until)
+    state = activity_state(post_id, likes_after, comments_after, until)
+    if state is None:
+        raise APIException('Post not found', status_code=404)
+
+    etag = (f"activity-{post_id}-{state.likes_count}.{state.comments_count}"
+            f"-{state.first_like or 0}.{state.last_like or 0}-{state.first_comment or 0}.{state.last_comment or 0}"
+            f"-{limit}")
+    newest = [at for at in (state.last_like_at, state.last_comment_at) if at is not None]
+    last_modified = max(newest or [likes_after[0], comments_after[0]]).replace(microsecond=0, tzinfo=timezone.utc)
+    if request.if_none_match:
+        fresh = request.if_none_match.contains(etag)
+    else:
+        fresh = not newest and request.if_modified_since is not None and last_modified <= request.if_modified_since
+    if fresh:
+        response = make_response('', 304)
+        response.set_etag(etag)
+        return response
+
+    payload = post_activity(post_id, cursor, since, limit, now)
+    response = jsonify(payload)
+    # clients must revalidate
+    response.headers['Cache-Control'] = 'no-cache'
+    response.set_etag(etag)
+    response.last_modified = last_modified
+    return response
@@ -0,0 +1,111 @@
+"""
+Hashtag and location feeds.
+
+Hashtags are parsed out of Post.caption when a post is written and kept
+in `tag` / `post_tag`, an inverted index read in (created_at, post_id)
+order through ix_post_tag_tag_id_created_at_post_id. Location feeds use
+ix_post_location_created_at_id directly. Posts written with Core (`flask
+seed`, or rows that predate the index) are indexed by `flask tags backfill`.
+"""
+import re
+import click
+from flask.cli import AppGroup
+from sqlalchemy import delete, event, inspect, insert, select
+from models import db, Post, Tag, PostTag
+from bulk import insert_ignore
+from pagination import paginate
+
+HASHTAG = re.compile(r'#(\w+)')
+MAX_TAG_LENGTH = 100
+
+
+def parse_tags(caption):
+    """Lowercased hashtags of `caption` in order of appearance, without duplicates."""
+    names = (name.lower() for name in HASHTAG.findall(caption or ''))
+    return list(dict.fromkeys(name for name in names if len(name) <= MAX_TAG_LENGTH))
+
+
+def tag_ids(connection, names):
+    """Returns {name: id}, creating the tags that don't exist yet."""
+    if not names:
+        return {}
+    insert_ignore(Tag, [{"name": name} for name in names], ['name'], ['id'], connection)
+    return dict(connection.execute(select(Tag.name, Tag.id).where(Tag.name.in_(names))).all())
+
+
+def index_posts(connection, posts):
+    """Replaces the post_tag rows of `posts`, an iterable of (id, caption, created_at)."""
+    posts = list(posts)
+    if not posts:
+        return 0
+    connection.execute(delete(PostTag).where(PostTag.post_id.in_([post_id for post_id, _, _ in posts])))
+    parsed = [(post_id, parse_tags(caption), created_at) for post_id, caption, created_at in posts]
+    ids = tag_ids(connection, sorted({name for _, names, _ in parsed for name in names}))
+    rows = [
+        {"post_id": post_id, "tag_id": ids[name], "created_at": created_at}
+        for post_id, names, created_at in parsed for name in names
+    ]
+    if rows:
+        connection.execute(insert(PostTag), rows)
+    return len(rows)
+
+
+def tag_feed(name, cursor=None, limit=20, options=()):
+    tag_id = db.session.scalar(select(Tag.id).where(Tag.name == name.lstrip('#').lower()))
+    if tag_id is None:
+        return [], None
+    entries, next_cursor = paginate(
+        select(PostTag).where(PostTag.tag_id == tag_id), PostTag.created_at, PostTag.post_id, cursor, limit
+    )
+    posts = {post.id: post for post in db.session.scalars(
+        select(Post).where(Post.id.in_([entry.post_id for entry in entries])).options(*options)
+    )}
+    return [posts[entry.post_id] for entry in entries if entry.post_id in posts], next_cursor
+
+
+def location_feed(location, cursor=None, limit=20, options=()):
+    stmt = select(Post).where(Post.location == location).options(*options)
+    return paginate(stmt, Post.created_at, Post.id, cursor, limit)
+
+
+def backfill_tags(batch_size=1000):
+    """Re-indexes every post in id order, one transaction per batch."""
+    last_id, indexed = 0, 0
+    while True:
+        batch = db.session.execute(
+            select(Post.id, Post.caption, Post.created_at)
+            .where(Post.id > last_id).order_by(Post.id).limit(batch_size)
+        ).all()
+        if not batch:
+            return indexed
+        indexed += index_posts(db.session.connection(), batch)
+        db.session.commit()
+        last_id = batch[-1].id
+
+
+@event.listens_for(Post, 'after_insert')
+def _index_new_post(mapper, connection, target):
+    if parse_tags(target.caption):
+        index_posts(connection, [(target.id, target.caption, target.created_at)])
+
+
+@event.listens_for(Post, 'after_update')
+def _reindex_post(mapper, connection, target):
+    state = inspect(target)
+    if state.attrs.caption.history.has_changes() or state.attrs.created_at.history.has_changes():
+        index_posts(connection, [(target.id, target.caption, target.created_at)])
+
+
+@event.listens_for(Post, 'before_delete')
+def _unindex_post(mapper, connection, target):
+    connection.execute(delete(PostTag).where(PostTag.post_id == target.id))
+
+
+tags_cli = AppGroup('tags', help='Maintain the hashtag index.')
+
+
+@tags_cli.command('backfill')
+@click.option('--batch-size', default=1000, show_default=True)
+def backfill_command(batch_size):
+    """Parse the hashtags of every existing post."""
+    click.echo(f"{backfill_tags(batch_size)} post tags indexed")
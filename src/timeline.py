@@ -0,0 +1,314 @@
+"""
+Fan-out-on-write timelines for the home feed (FEED_MODE=write).
+
+When a Post is inserted its id is pushed into the timeline of every follower,
+so reading the feed becomes one range lookup per user. Authors with more than
+FANOUT_MAX_FOLLOWERS followers are skipped here and merged in at read time by
+feed.read_feed instead. With FANOUT_ASYNC=1 the insert only queues a
+"fan_out" job (see jobs.py) and a worker writes the timelines.
+
+Two stores are available through TIMELINE_STORE:
+- "sql": the timeline_entry table, written on the flush connection so it is
+  part of the same transaction as the post.
+- "memory": per-process lists, for tests and single-worker development.
+
+Both keep TIMELINE_CAPACITY entries per user. The memory store caps a list
+as it appends. The SQL store only appends, and a TimelineTrimmer thread
+cuts it back every TIMELINE_TRIM_INTERVAL seconds. It only touches the
+timelines that can have grown since its last run: the followers of
+authors with new posts, and users with new follows. `flask timeline trim`
+trims every timeline.
+"""
+import logging
+import threading
+from bisect import bisect_left, insort
+import click
+from flask import current_app, has_app_context
+from flask.cli import AppGroup
+from sqlalchemy import and_, delete, event, exists, func, insert, literal, or_, select, tuple_, union
+from models import db, User, Post, Follow, TimelineEntry
+from jobs import enqueue, handler
+
+logger = logging.getLogger(__name__)
+
+
+class TimelineStore:
+    """Per-user list of (created_at, post_id), newest first, capped at `capacity`."""
+
+    def __init__(self, capacity=800):
+        self.capacity = capacity
+
+    def fan_out(self, connection, author_id, post_id, created_at):
+        raise NotImplementedError()
+
+    def backfill(self, connection, owner_id, author_id):
+        raise NotImplementedError()
+
+    def purge(self, connection, owner_id, author_id):
+        raise NotImplementedError()
+
+    def remove_post(self, connection, post_id):
+        raise NotImplementedError()
+
+    def range(self, owner_id, before=None, limit=20):
+        raise NotImplementedError()
+
+
+class MemoryTimelineStore(TimelineStore):
+
+    def __init__(self, capacity=800):
+        super().__init__(capacity)
+        self._lock = threading.Lock()
+        # owner_id -> [(created_at, post_id, author_id)] in ascending order
+        self._timelines = {}
+
+    def _push(self, owner_id, entry):
+        timeline = self._timelines.setdefault(owner_id, [])
+        if entry not in timeline:
+            insort(timeline, entry)
+        if len(timeline) > self.capacity:
+            del timeline[:len(timeline) - self.capacity]
+
+    def fan_out(self, connection, author_id, post_id, created_at):
+        followers = connection.scalars(select(Follow.follower_id).where(Follow.following_id == author_id)).all()
+        with self._lock:
+            for owner_id in set(followers):
+                self._push(owner_id, (created_at, post_id, author_id))
+
+    def backfill(self, connection, owner_id, author_id):
+        rows = connection.execute(
+            select(Post.created_at, Post.id)
+            .where(Post.user_id == author_id)
+            .order_by(Post.created_at.desc(), Post.id.desc())
+            .limit(self.capacity)
+        ).all()
+        with self._lock:
+            for created_at, post_id in rows:
+                self._push(owner_id, (created_at, post_id, author_id))
+
+    def purge(self, connection, owner_id, author_id):
+        with self._lock:
+            timeline = self._timelines.get(owner_id, [])
+            timeline[:] = [entry for entry in timeline if entry[2] != author_id]
+
+    def remove_post(self, connection, post_id):
+        with self._lock:
+            for timeline in self._timelines.values():
+                timeline[:] = [entry for entry in timeline if entry[1] != post_id]
+
+    def range(self, owner_id, before=None, limit=20):
+        with self._lock:
+            timeline = self._timelines.get(owner_id, [])
+            end = bisect_left(timeline, before) if before else len(timeline)
+            return [(created_at, post_id) for created_at, post_id, _ in reversed(timeline[max(0, end - limit):end])]
+
+
+class SQLTimelineStore(TimelineStore):
+
+    def fan_out(self, connection, author_id, post_id, created_at):
+        # a backfill may have got there first when the fan-out runs as a job
+        already = exists().where(TimelineEntry.owner_id == Follow.follower_id, TimelineEntry.post_id == post_id)
+        followers = (
+            select(Follow.follower_id, literal(post_id), literal(created_at))
+            .where(Follow.following_id == author_id, ~already)
+            .distinct()
+        )
+        connection.execute(
+            insert(TimelineEntry).from_select(['owner_id', 'post_id', 'created_at'], followers)
+        )
+
+    def backfill(self, connection, owner_id, author_id):
+        already = exists().where(TimelineEntry.owner_id == owner_id, TimelineEntry.post_id == Post.id)
+        recent = (
+            select(literal(owner_id), Post.id, Post.created_at)
+            .where(Post.user_id == author_id, ~already)
+            .order_by(Post.created_at.desc(), Post.id.desc())
+            .limit(self.capacity)
+        )
+        connection.execute(
+            insert(TimelineEntry).from_select(['owner_id', 'post_id', 'created_at'], recent)
+        )
+
+    def purge(self, connection, owner_id, author_id):
+        connection.execute(
+            delete(TimelineEntry).where(
+                TimelineEntry.owner_id == owner_id,
+                TimelineEntry.post_id.in_(select(Post.id).where(Post.user_id == author_id)),
+            )
+        )
+
+    def remove_post(self, connection, post_id):
+        connection.execute(delete(TimelineEntry).where(TimelineEntry.post_id == post_id))
+
+    def range(self, owner_id, before=None, limit=20):
+        stmt = select(TimelineEntry.created_at, TimelineEntry.post_id).where(TimelineEntry.owner_id == owner_id)
+        if before:
+            created_at, post_id = before
+            stmt = stmt.where(or_(
+                TimelineEntry.created_at < created_at,
+                and_(TimelineEntry.created_at == created_at, TimelineEntry.post_id < post_id),
+            ))
+        stmt = stmt.order_by(TimelineEntry.created_at.desc(), TimelineEntry.post_id.desc()).limit(limit)
+        return [tuple(row) for row in db.session.execute(stmt)]
+
+    def trim(self, owners=None):
+        """Deletes everything past `capacity` in the timelines of `owners` (a select of user ids),
+        or in every timeline; fan_out only appends."""
+        ranked = select(
+            TimelineEntry.owner_id,
+            TimelineEntry.post_id,
+            func.row_number().over(
+                partition_by=TimelineEntry.owner_id,
+                order_by=(TimelineEntry.created_at.desc(), TimelineEntry.post_id.desc()),
+            ).label('position'),
+        )
+        if owners is not None:
+            ranked = ranked.where(TimelineEntry.owner_id.in_(owners))
+        ranked = ranked.subquery()
+        overflow = select(ranked.c.owner_id, ranked.c.post_id).where(ranked.c.position > self.capacity)
+        result = db.session.execute(
+            delete(TimelineEntry).where(tuple_(TimelineEntry.owner_id, TimelineEntry.post_id).in_(overflow))
+        )
+        db.session.commit()
+        return result.rowcount
+
+
+def fed_since(post_id, follow_id):
+    """The users whose timelines can have grown since the posts and follows up to these ids."""
+    authors = select(Post.user_id).where(Post.id > post_id)
+    return union(
+        select(Follow.follower_id).where(Follow.following_id.in_(authors)),
+        select(Follow.follower_id).where(Follow.id > follow_id),
+    )
+
+
+class TimelineTrimmer(threading.Thread):
+
+    def __init__(self, app, interval):
+        super().__init__(name='timeline-trimmer', daemon=True)
+        self.app = app
+        self.interval = interval
+        self._stopped = threading.Event()
+
+    def stop(self):
+        self._stopped.set()
+
+    def _high_water(self):
+        return (db.session.scalar(select(func.max(Post.id))) or 0,
+                db.session.scalar(select(func.max(Follow.id))) or 0)
+
+    def run(self):
+        # from here on; what is already there is left to `flask timeline trim`
+        with self.app.app_context():
+            try:
+                since = self._high_water()
+            finally:
+                db.session.remove()
+        while not self._stopped.wait(self.interval):
+            with self.app.app_context():
+                try:
+                    upto = self._high_water()
+                    removed = get_timeline_store().trim(fed_since(*since))
+                    since = upto
+                    if removed:
+                        logger.info("timeline trim removed %d entries", removed)
+                except Exception:
+                    db.session.rollback()
+                    logger.exception("timeline trim failed")
+                finally:
+                    db.session.remove()
+
+
+def start_timeline_trimmer(app):
+    interval = app.config.get('TIMELINE_TRIM_INTERVAL')
+    if not interval or app.config.get('FEED_MODE') != 'write' or app.config.get('TIMELINE_STORE', 'sql') != 'sql':
+        return None
+    trimmer = TimelineTrimmer(app, interval)
+    trimmer.start()
+    return trimmer
+
+
+_memory_store = None
+
+
+def get_timeline_store():
+    global _memory_store
+    capacity = current_app.config.get('TIMELINE_CAPACITY', 800)
+    if current_app.config.get('TIMELINE_STORE', 'sql') == 'memory':
+        if _memory_store is None:
+            _memory_store = MemoryTimelineStore(capacity)
+        return _memory_store
+    return SQLTimelineStore(capacity)
+
+
+def fan_out_enabled():
+    return has_app_context() and current_app.config.get('FEED_MODE') == 'write'
+
+
+def fanout_limit():
+    return current_app.config.get('FANOUT_MAX_FOLLOWERS', 10000)
+
+
+def _is_fanned_out(connection, author_id):
+    followers = connection.scalar(select(User.followers_count).where(User.id == author_id))
+    return (followers or 0) <= fanout_limit()
+
+
+def backfill_follows(connection, rows):
+    # for follows written without the ORM, see bulk.py
+    store = get_timeline_store()
+    for row in rows:
+        if _is_fanned_out(connection, row['following_id']):
+            store.backfill(connection, row['follower_id'], row['following_id'])
+
+
+@handler('fan_out')
+def fan_out_posts(payloads):
+    connection = db.session.connection()
+    posts = connection.execute(
+        select(Post.id, Post.user_id, Post.created_at).where(Post.id.in_([p['post_id'] for p in payloads]))
+    ).all()
+    store = get_timeline_store()
+    for post_id, author_id, created_at in posts:
+        if _is_fanned_out(connection, author_id):
+            store.fan_out(connection, author_id, post_id, created_at)
+
+
+@event.listens_for(Post, 'after_insert')
+def _fan_out_post(mapper, connection, target):
+    if not fan_out_enabled():
+        return
+    if current_app.config.get('FANOUT_ASYNC'):
+        enqueue('fan_out', [{"post_id": target.id}], [f"fan_out:{target.id}"], connection=connection)
+    elif _is_fanned_out(connection, target.user_id):
+        get_timeline_store().fan_out(connection, target.user_id, target.id, target.created_at)
+
+
+@event.listens_for(Post, 'before_delete')
+def _remove_post(mapper, connection, target):
+    if fan_out_enabled():
+        get_timeline_store().remove_post(connection, target.id)
+
+
+@event.listens_for(Follow, 'after_insert')
+def _backfill_follow(mapper, connection, target):
+    if fan_out_enabled() and _is_fanned_out(connection, target.following_id):
+        get_timeline_store().backfill(connection, target.follower_id, target.following_id)
+
+
+@event.listens_for(Follow, 'after_delete')
+def _purge_unfollow(mapper, connection, target):
+    if fan_out_enabled():
+        get_timeline_store().purge(connection, target.follower_id, target.following_id)
+
+
+timeline_cli = AppGroup('timeline', help='Maintain the materialized home feed timelines.')
+
+
+@timeline_cli.command('trim')
+def trim_command():
+    """Cap every SQL timeline at TIMELINE_CAPACITY entries."""
+    store = get_timeline_store()
+    if not isinstance(store, SQLTimelineStore):
+        raise click.ClickException('trim only applies to TIMELINE_STORE=sql')
+    click.echo(f"{store.trim()} timeline entries removed")
@@ -0,0 +1,67 @@
+import os
+import sys
+import pytest
+from sqlalchemy import event
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, os.path.join(ROOT, 'src'))
+
+
+@pytest.fixture(scope='session')
+def app(tmp_path_factory):
+    os.environ['DATABASE_URL'] = f"sqlite:///{tmp_path_factory.mktemp('db') / 'test.db'}"
+    from flask_migrate import upgrade
+    from app import create_app
+    from datagen import generate
+
+    app = create_app('migrate')
+    app.config['TESTING'] = True
+    with app.app_context():
+        upgrade(directory=os.path.join(ROOT, 'migrations'))
+        generate(users=300, seed=1)
+    return app
+
+
+@pytest.fixture(scope='session')
+def other_app(app):
+    """A second app on the same database, like another gunicorn worker."""
+    from app import create_app
+    return create_app('')
+
+
+@pytest.fixture
+def ctx(app):
+    with app.test_request_context():
+        yield app
+
+
+@pytest.fixture
+def client(app):
+    return app.test_client()
+
+
+class QueryCounter:
+
+    def __init__(self, engine):
+        self.engine = engine
+        self.statements = []
+
+    def _count(self, conn, cursor, statement, *args):
+        self.statements.append(statement)
+
+    def __enter__(self):
+        event.listen(self.engine, 'before_cursor_execute', self._count)
+        return self
+
+    def __exit__(self, *exc):
+        event.remove(self.engine, 'before_cursor_execute', self._count)
+
+    @property
+    def count(self):
+        return len(self.statements)
+
+
+@pytest.fixture
+def count_queries(ctx):
+    from models import db
+    return lambda: QueryCounter(db.engine)
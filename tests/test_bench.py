@@ -0,0 +1,30 @@
+import random
+from sqlalchemy import func, select
+from models import db, Post, Like, Job
+from bench import run, scenarios
+
+
+def totals():
+    return (db.session.scalar(select(func.count(Like.id))),
+            db.session.scalar(select(func.sum(Post.likes_count))),
+            db.session.scalar(select(func.count(Job.id))))
+
+
+def test_write_scenarios_leave_the_data_as_they_found_it(ctx):
+    before = totals()
+    first = run(requests=5, only=['likes_batch'])
+    assert totals() == before
+    assert run(requests=5, only=['likes_batch'])["likes_batch"]["max_queries"] == first["likes_batch"]["max_queries"]
+    assert totals() == before
+
+
+def test_write_cleanup_gives_the_posts_new_etags(client, ctx):
+    requests, cleanups = scenarios(random.Random(7), 1)
+    requests["likes_batch"](client, 0)
+    # the newest like is one the batch added
+    post_id = db.session.scalar(select(Like.post_id).order_by(Like.id.desc()).limit(1))
+    during = client.get(f"/posts/{post_id}")
+    cleanups["likes_batch"]()
+    after = client.get(f"/posts/{post_id}", headers={"If-None-Match": during.headers["ETag"]})
+    assert after.status_code == 200
+    assert after.get_json()["likes_count"] == during.get_json()["likes_count"] - 1
@@ -0,0 +1,11 @@
+import pytest
+
+
+@pytest.mark.parametrize("item", [
+    {"user_id": True, "post_id": 1},
+    {"user_id": 1, "post_id": False},
+    {"user_id": "1", "post_id": 1},
+])
+def test_batches_reject_ids_that_are_not_integers(client, item):
+    response = client.post('/likes/batch', json={"likes": [item]})
+    assert response.status_code == 400
@@ -0,0 +1,51 @@
+from sqlalchemy import select
+from models import db, User, Post, Like
+
+
+def unliked_post(ctx, likers=20):
+    """A post and `likers` users who haven't liked it yet."""
+    post_id = db.session.scalar(select(Post.id).order_by(Post.id.desc()).limit(1))
+    liked = select(Like.user_id).where(Like.post_id == post_id)
+    users = db.session.scalars(select(User.id).where(User.id.not_in(liked)).limit(likers)).all()
+    return post_id, users
+
+
+def test_writes_in_one_worker_change_the_etag_in_another(app, other_app, ctx):
+    post_id, users = unliked_post(ctx)
+    client, other = app.test_client(), other_app.test_client()
+    before = other.get(f"/posts/{post_id}")
+    assert other.get(f"/posts/{post_id}", headers={"If-None-Match": before.headers["ETag"]}).status_code == 304
+
+    response = client.post('/likes/batch', json={"likes": [{"user_id": user_id, "post_id": post_id} for user_id in users]})
+    assert response.get_json()["inserted"] == len(users)
+
+    after = other.get(f"/posts/{post_id}", headers={"If-None-Match": before.headers["ETag"]})
+    assert after.status_code == 200
+    assert after.get_json()["likes_count"] == before.get_json()["likes_count"] + len(users)
+    assert after.headers["ETag"] != before.headers["ETag"]
+
+
+def test_orm_changes_change_the_etag_in_another_worker(app, other_app, ctx):
+    user_id = db.session.scalar(select(User.id).limit(1))
+    other = other_app.test_client()
+    before = other.get(f"/users/{user_id}")
+
+    db.session.get(User, user_id).bio = 'changed elsewhere'
+    db.session.commit()
+
+    after = other.get(f"/users/{user_id}", headers={"If-None-Match": before.headers["ETag"]})
+    assert after.status_code == 200
+    assert after.get_json()["bio"] == 'changed elsewhere'
+
+
+def test_stats_count_each_payload_lookup_once(app, ctx):
+    user_id = db.session.scalar(select(User.id).order_by(User.id.desc()).limit(1))
+    cache = app.extensions['response_cache']
+    cache.backend.clear()
+    before = cache.stats()
+    client = app.test_client()
+    client.get(f"/users/{user_id}")
+    client.get(f"/users/{user_id}")
+    after = cache.stats()
+    assert after["misses"] - before["misses"] == 1
+    assert after["hits"] - before["hits"] == 1
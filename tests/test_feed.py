@@ -0,0 +1,66 @@
+import pytest
+from sqlalchemy import func, select
+from models import db, User, Post, Follow
+import timeline
+from feed import followed_ids, read_feed
+
+
+def page_through(user_id, limit):
+    ids, cursor, pages = [], None, 0
+    while True:
+        posts, cursor = read_feed(user_id, cursor, limit)
+        ids.extend(post.id for post in posts)
+        pages += 1
+        if cursor is None:
+            return ids, pages
+
+
+@pytest.fixture
+def mixed_reader(ctx, monkeypatch):
+    """FEED_MODE=write for a user following both fanned-out and celebrity accounts."""
+    reader = db.session.scalar(
+        select(Follow.follower_id).group_by(Follow.follower_id).order_by(func.count().desc()).limit(1)
+    )
+    authors = db.session.execute(
+        select(User.id, User.followers_count).where(User.id.in_(followed_ids(reader)))
+        .order_by(User.followers_count)
+    ).all()
+    # the more followed half of the accounts is too large to fan out
+    threshold = authors[len(authors) // 2].followers_count
+    monkeypatch.setitem(ctx.config, 'FEED_MODE', 'write')
+    monkeypatch.setitem(ctx.config, 'TIMELINE_STORE', 'memory')
+    monkeypatch.setitem(ctx.config, 'FANOUT_MAX_FOLLOWERS', threshold)
+    monkeypatch.setattr(timeline, '_memory_store', None)
+
+    store = timeline.get_timeline_store()
+    connection = db.session.connection()
+    fanned_out = [author_id for author_id, followers in authors if followers <= threshold]
+    for author_id in fanned_out:
+        store.backfill(connection, reader, author_id)
+    assert fanned_out and len(fanned_out) < len(authors)
+    return reader
+
+
+def whole_feed(user_id):
+    return db.session.scalars(
+        select(Post.id).where(Post.user_id.in_(followed_ids(user_id)))
+        .order_by(Post.created_at.desc(), Post.id.desc())
+    ).all()
+
+
+def test_materialized_feed_pages_to_the_end(mixed_reader):
+    expected = whole_feed(mixed_reader)
+    assert len(expected) > 20
+    ids, pages = page_through(mixed_reader, 5)
+    assert ids == expected
+    assert pages == -(-len(expected) // 5)
+
+
+def test_materialized_feed_with_only_celebrities(mixed_reader, ctx, monkeypatch):
+    # nothing is fanned out, every post comes from the read-time merge
+    monkeypatch.setitem(ctx.config, 'FANOUT_MAX_FOLLOWERS', -1)
+    monkeypatch.setattr(timeline, '_memory_store', None)
+    expected = whole_feed(mixed_reader)
+    ids, pages = page_through(mixed_reader, 5)
+    assert ids == expected
+    assert pages == -(-len(expected) // 5)
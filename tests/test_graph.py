@@ -0,0 +1,76 @@
+from datetime import datetime, timedelta
+from sqlalchemy import select, func
+from models import db, Follow, FollowTombstone
+from graph import FollowGraph, SQLFollowGraph
+
+
+def holder(app):
+    return app.extensions['follow_graph']
+
+
+def some_follow(ctx):
+    return db.session.execute(select(Follow.follower_id, Follow.following_id).order_by(Follow.id).limit(1)).one()
+
+
+def test_unfollows_in_one_worker_reach_the_graph_of_another(app, other_app, ctx):
+    with other_app.app_context():
+        graph = holder(other_app).refresh()
+    follower_id, following_id = some_follow(ctx)
+    assert graph.follows(follower_id, following_id)
+
+    db.session.delete(db.session.scalar(select(Follow).filter_by(follower_id=follower_id, following_id=following_id)))
+    db.session.commit()
+    with other_app.app_context():
+        assert not holder(other_app).refresh().follows(follower_id, following_id)
+
+    # followed again: the tombstone must not win over the newer follow
+    db.session.add(Follow(follower_id=follower_id, following_id=following_id))
+    db.session.commit()
+    with other_app.app_context():
+        assert holder(other_app).refresh().follows(follower_id, following_id)
+
+
+def test_sql_fallback_answers_like_the_graph(ctx):
+    user_id = db.session.scalar(
+        select(Follow.follower_id).group_by(Follow.follower_id).order_by(func.count().desc()).limit(1)
+    )
+    graph, fallback = FollowGraph.build(), SQLFollowGraph()
+    assert fallback.following_ids(user_id) == list(graph.following_ids(user_id))
+    assert fallback.mutuals(user_id) == list(graph.mutuals(user_id))
+    assert [score for _, score in fallback.suggestions(user_id)] == [score for _, score in graph.suggestions(user_id)]
+
+
+def test_suggestions_break_ties_by_follower_count(ctx):
+    graph = FollowGraph.build()
+    user_id = db.session.scalar(select(Follow.follower_id).limit(1))
+    suggestions = graph.suggestions(user_id, limit=50)
+    keys = [(-score, -len(graph.follower_ids(candidate)), candidate) for candidate, score in suggestions]
+    assert keys == sorted(keys)
+    assert graph.followers.degree(-1) == 0
+
+
+def test_a_follow_committed_after_a_higher_id_was_read_is_picked_up(app, other_app, ctx):
+    follow = db.session.scalar(select(Follow).order_by(Follow.id).limit(1).offset(5))
+    follower_id, following_id, follow_id = follow.follower_id, follow.following_id, follow.id
+    db.session.delete(follow)
+    db.session.commit()
+    with other_app.app_context():
+        graph = holder(other_app).refresh()
+    assert not graph.follows(follower_id, following_id)
+    assert graph.seen_id > follow_id
+
+    # a transaction that took its id before the last read and committed after it
+    db.session.add(Follow(id=follow_id, follower_id=follower_id, following_id=following_id))
+    db.session.commit()
+    with other_app.app_context():
+        assert holder(other_app).refresh().follows(follower_id, following_id)
+
+
+def test_refresh_purges_old_tombstones(app, ctx):
+    old = FollowTombstone(follower_id=1, following_id=2, deleted_at=datetime.utcnow() - timedelta(days=2))
+    db.session.add(old)
+    db.session.commit()
+    old_id = old.id
+    holder(app).refresh()
+    db.session.expire_all()
+    assert db.session.get(FollowTombstone, old_id) is None
@@ -0,0 +1,60 @@
+import json
+import pytest
+from sqlalchemy import delete, select
+from models import db, Post, Media
+from media import closest_thumbnail, process_file
+
+
+def thumbnail(size):
+    return {"url": f"/media/thumbs/{size}/a.png.jpg", "width": size, "height": size}
+
+
+def test_a_size_that_was_not_generated_falls_back_to_the_closest(ctx, client):
+    post = db.session.scalar(select(Post).where(Post.image_url.is_not(None)).order_by(Post.id).limit(1))
+    # processed while MEDIA_THUMB_SIZES was 150,640
+    media = Media(url=post.image_url, status='ready', width=800, height=800, placeholder='L00000fQfQfQfQfQfQfQfQfQfQfQ',
+                  thumbnails=json.dumps({"150": thumbnail(150), "640": thumbnail(640)}))
+    db.session.add(media)
+    db.session.commit()
+    try:
+        response = client.get(f"/users/{post.user_id}/grid?size=320&limit=100")
+        assert response.status_code == 200
+        cell = next(item for item in response.get_json()["results"] if item["id"] == post.id)
+        assert cell["thumbnails"] == {"150": thumbnail(150)}
+    finally:
+        db.session.delete(media)
+        db.session.commit()
+
+    assert closest_thumbnail({"150": 1, "640": 2}, "395") == {"640": 2}
+
+
+def test_files_deleted_during_a_run_are_recorded_as_invalid(tmp_path):
+    pytest.importorskip('PIL')
+    row = process_file(str(tmp_path / 'gone.png'), '/media/gone.png', str(tmp_path), '/media/', (150,), 10 ** 6, (4, 3))
+    assert row["status"] == 'invalid'
+
+
+def test_thumbnails_keep_the_original_extension(tmp_path):
+    Image = pytest.importorskip('PIL.Image')
+    for name, colour in (('a.png', 'red'), ('a.jpg', 'blue')):
+        Image.new('RGB', (200, 100), colour).save(tmp_path / name)
+    rows = [process_file(str(tmp_path / name), f'/media/{name}', str(tmp_path), '/media/', (150,), 10 ** 6, (4, 3))
+            for name in ('a.png', 'a.jpg')]
+    urls = {json.loads(row["thumbnails"])["150"]["url"] for row in rows}
+    assert urls == {'/media/thumbs/150/a.png.jpg', '/media/thumbs/150/a.jpg.jpg'}
+
+
+def test_a_batch_with_valid_and_invalid_files_is_recorded(ctx, tmp_path, monkeypatch):
+    Image = pytest.importorskip('PIL.Image')
+    from media import process_uploads
+    Image.new('RGB', (200, 100), 'red').save(tmp_path / 'good.png')
+    (tmp_path / 'corrupt.jpg').write_bytes(b'not a jpeg')
+    monkeypatch.setitem(ctx.config, 'MEDIA_URL_PREFIX', '/batch-test/')
+    try:
+        assert process_uploads(str(tmp_path), workers=1) == {"ready": 1, "invalid": 1}
+        rows = {media.url: media.status for media in db.session.scalars(
+            select(Media).where(Media.url.like('/batch-test/%')))}
+        assert rows == {'/batch-test/good.png': 'ready', '/batch-test/corrupt.jpg': 'invalid'}
+    finally:
+        db.session.execute(delete(Media).where(Media.url.like('/batch-test/%')))
+        db.session.commit()
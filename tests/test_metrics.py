@@ -0,0 +1,65 @@
+import gc
+import json
+import os
+import subprocess
+import sys
+import pytest
+from sqlalchemy import text
+from sqlalchemy.exc import OperationalError
+import metrics
+from models import db
+
+
+def test_failed_statement_leaves_no_timing_behind(ctx):
+    with db.engine.connect() as connection:
+        with pytest.raises(OperationalError):
+            connection.execute(text("SELECT * FROM no_such_table"))
+        assert connection.info['query_started'] == []
+        connection.execute(text("SELECT 1"))
+        assert connection.info['query_started'] == []
+
+
+def write_snapshot(directory, pid, snapshot):
+    with open(os.path.join(directory, f"metrics-{pid}.json"), "w") as f:
+        json.dump(dict(snapshot, pid=pid), f)
+
+
+def test_collect_keeps_the_counters_of_exited_workers_and_only_sums_counters(ctx, tmp_path, monkeypatch):
+    monkeypatch.setitem(ctx.config, 'METRICS_DIR', str(tmp_path))
+    monkeypatch.setattr(metrics, 'registry', metrics.Registry())
+    exited = subprocess.Popen([sys.executable, '-c', 'pass'])
+    exited.wait()
+    histogram = {'endpoint="a"': {"le": [1.0], "buckets": [2], "sum": 0.5, "count": 2}}
+    worker = {"histograms": {"http_request_duration_seconds": histogram}, "counters": {"db_statements_total": {'endpoint="a"': 3}, "db_pool_size": {'engine="primary"': 5}}}
+    write_snapshot(tmp_path, exited.pid, worker)
+    write_snapshot(tmp_path, os.getppid(), worker)
+    metrics.registry.inc("db_statements_total", 'endpoint="a"', 4)
+    metrics.registry.collectors.append(lambda: {"db_pool_size": {'engine="primary"': 5}})
+
+    lines = metrics.collect().splitlines()
+    assert not (tmp_path / f"metrics-{exited.pid}.json").exists()
+    # the exited worker's counters stay in the total, its gauges go
+    assert 'db_statements_total{endpoint="a"} 10' in lines
+    assert f'db_pool_size{{engine="primary",pid="{os.getpid()}"}} 5' in lines
+    assert f'db_pool_size{{engine="primary",pid="{os.getppid()}"}} 5' in lines
+    assert 'http_request_duration_seconds_count{endpoint="a"} 4' in lines
+    assert f'pid="{exited.pid}"' not in "\n".join(lines)
+    # and are counted once, however often it is scraped
+    assert 'db_statements_total{endpoint="a"} 10' in metrics.collect().splitlines()
+
+
+def test_building_apps_registers_nothing_process_wide(app):
+    import app as app_module
+    collectors, fork_apps = len(metrics.registry.collectors), len(app_module._fork_apps)
+    for _ in range(3):
+        other = app_module.create_app('')
+        assert len(other.extensions['metrics_collectors']) == 2
+    assert len(metrics.registry.collectors) == collectors
+    del other
+    gc.collect()
+    assert len(app_module._fork_apps) == fork_apps
+
+
+def test_metrics_include_the_apps_own_collectors(client):
+    text = client.get('/metrics').get_data(as_text=True)
+    assert text.count("# TYPE cache_entries gauge") == 1
@@ -0,0 +1,44 @@
+import pytest
+from metrics import registry, render
+from ratelimit import RateLimiter, MemoryBuckets, parse_limit
+
+
+@pytest.fixture
+def limited(app):
+    """Another app on the test database, allowing 2 requests per minute per client."""
+    from app import create_app
+    app = create_app('')
+    limiter = RateLimiter(MemoryBuckets(), parse_limit('2/m'))
+    app.extensions['rate_limiter'] = limiter
+    app.before_request(limiter.limit_request)
+    return app
+
+
+def test_naming_another_user_does_not_spend_their_quota(limited):
+    client = limited.test_client()
+    for _ in range(2):
+        assert client.get('/users/1?user_id=2', environ_base={"REMOTE_ADDR": "10.0.0.1"}).status_code == 200
+    assert client.get('/users/1?user_id=2', environ_base={"REMOTE_ADDR": "10.0.0.1"}).status_code == 429
+    # user 2 calling from their own address still has a full bucket
+    assert client.get('/users/1?user_id=2', environ_base={"REMOTE_ADDR": "10.0.0.2"}).status_code == 200
+
+
+def test_clients_behind_a_trusted_proxy_get_their_own_bucket(monkeypatch, app):
+    from app import create_app
+    monkeypatch.setenv('TRUSTED_PROXY_HOPS', '1')
+    app = create_app('')
+    limiter = RateLimiter(MemoryBuckets(), parse_limit('2/m'))
+    app.before_request(limiter.limit_request)
+    client = app.test_client()
+    proxy = {"REMOTE_ADDR": "10.0.0.254"}
+    for _ in range(2):
+        assert client.get('/users/1', environ_base=proxy, headers={"X-Forwarded-For": "1.1.1.1"}).status_code == 200
+    assert client.get('/users/1', environ_base=proxy, headers={"X-Forwarded-For": "1.1.1.1"}).status_code == 429
+    assert client.get('/users/1', environ_base=proxy, headers={"X-Forwarded-For": "2.2.2.2"}).status_code == 200
+
+
+def test_rate_limited_requests_render_as_a_counter(limited):
+    client = limited.test_client()
+    for _ in range(3):
+        client.get('/users/1', environ_base={"REMOTE_ADDR": "10.0.0.3"})
+    assert "# TYPE http_rate_limited_total counter" in render(registry.snapshot())
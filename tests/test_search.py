@@ -0,0 +1,25 @@
+from sqlalchemy import func, select
+from models import db, User
+from search import search_users
+
+
+def test_short_queries_only_match_username_prefixes_in_order(ctx):
+    results = search_users('US', limit=10)
+    expected = db.session.scalars(
+        select(User.username).where(User.is_active).order_by(func.lower(User.username)).limit(10)
+    ).all()
+    assert [user.username for user in results] == expected
+    # full names aren't searched below three characters
+    assert search_users('su') == []
+
+
+def test_longer_queries_also_match_full_names_ranked_by_followers(ctx):
+    results = search_users('sun', limit=10)
+    assert results and all('sun' in user.full_name.lower() for user in results)
+    ranks = [(not user.full_name.lower().startswith('sun'), -user.followers_count) for user in results]
+    assert ranks == sorted(ranks)
+
+
+def test_username_prefixes_rank_first(ctx):
+    user = db.session.scalar(select(User).order_by(User.id.desc()).limit(1))
+    assert search_users(user.username)[0].id == user.id
@@ -0,0 +1,60 @@
+import pytest
+from sqlalchemy import func, select
+from models import db, Post, Follow
+from feed import followed_ids, read_feed
+from serializers import page_payload, serialize_posts
+
+
+@pytest.fixture
+def reader(ctx):
+    """A user whose home feed has more than 50 posts."""
+    feed_size = (
+        select(func.count(Post.id))
+        .where(Post.user_id.in_(followed_ids(Follow.follower_id)))
+        .scalar_subquery()
+    )
+    user_id = db.session.scalar(select(Follow.follower_id).where(feed_size > 50).limit(1))
+    assert user_id is not None
+    return user_id
+
+
+def serialized_feed_queries(count_queries, user_id, limit, **fieldset):
+    db.session.expunge_all()
+    with count_queries() as counter:
+        posts, _ = read_feed(user_id, limit=limit)
+        if fieldset:
+            payload = page_payload(posts, fieldset)
+            authors = [payload["users"][str(result["user_id"])] for result in payload["results"]]
+        else:
+            authors = [result["user"] for result in serialize_posts(posts)]
+    assert len(authors) == limit and all(authors)
+    return counter.count
+
+
+def test_feed_page_costs_a_constant_number_of_queries(reader, count_queries):
+    # one SELECT for the page, one for all of its authors
+    assert serialized_feed_queries(count_queries, reader, 50) == 2
+    assert serialized_feed_queries(count_queries, reader, 10) == 2
+
+
+def test_compact_page_costs_a_constant_number_of_queries(reader, count_queries):
+    fieldset = {"fields": ('id', 'user'), "user_fields": ('username',), "include_users": True}
+    assert serialized_feed_queries(count_queries, reader, 50, **fieldset) == 2
+    assert serialized_feed_queries(count_queries, reader, 10, **fieldset) == 2
+
+
+def test_compact_timestamps_match_serialize(reader, ctx, client):
+    full = client.get('/feed', query_string={"user_id": reader, "limit": 5}).get_json()["results"]
+    compact = client.get('/feed', query_string={"user_id": reader, "limit": 5, "fields": 'id,created_at,user',
+                                                "fields[user]": 'id,created_at'}).get_json()["results"]
+    assert [(post["id"], post["created_at"], post["user"]["created_at"]) for post in full] == \
+        [(post["id"], post["created_at"], post["user"]["created_at"]) for post in compact]
+
+
+def test_stdlib_encoder_writes_the_same_timestamps(ctx, monkeypatch):
+    import serializers
+    from datetime import datetime
+    value = {"at": datetime(2026, 1, 2, 3, 4, 5, 120), "on": datetime(2026, 1, 2)}
+    fast = ctx.json.dumps(value)
+    monkeypatch.setattr(serializers, 'orjson', None)
+    assert ctx.json.dumps(value) == fast == '{"at":"2026-01-02T03:04:05.000120","on":"2026-01-02T00:00:00"}'
@@ -0,0 +1,73 @@
+from datetime import datetime, timedelta
+import pytest
+from sqlalchemy import select
+from models import db, Post, Like, User
+
+SINCE = (datetime.utcnow() - timedelta(days=30)).isoformat()
+
+
+@pytest.fixture
+def settled_now(app, other_app, monkeypatch):
+    # rows settle as soon as they are written, so a test needn't wait
+    for each in (app, other_app):
+        monkeypatch.setitem(each.config, 'SYNC_SETTLE_SECONDS', 0)
+
+
+def new_like(post_id):
+    liked = select(Like.user_id).where(Like.post_id == post_id)
+    user_id = db.session.scalar(select(User.id).where(User.id.not_in(liked)).limit(1))
+    like = Like(user_id=user_id, post_id=post_id, created_at=datetime.utcnow())
+    db.session.add(like)
+    db.session.commit()
+    return like
+
+
+def poll(client, post_id, response=None, **params):
+    headers = {"If-None-Match": response.headers["ETag"]} if response is not None else {}
+    return client.get(f"/posts/{post_id}/activity", query_string=params, headers=headers)
+
+
+def test_a_client_following_the_cursor_gets_304_until_something_new_settles(app, other_app, ctx, settled_now):
+    post_id = db.session.scalar(select(Post.id).order_by(Post.id).limit(1))
+    client, other = app.test_client(), other_app.test_client()
+    new_like(post_id)
+    first = poll(client, post_id, since=SINCE)
+    assert first.get_json()["likes"]
+
+    caught_up = poll(other, post_id, first, cursor=first.get_json()["cursor"])
+    assert caught_up.status_code == 200
+    assert caught_up.get_json()["likes"] == []
+    cursor = caught_up.get_json()["cursor"]
+    assert poll(other, post_id, caught_up, cursor=cursor).status_code == 304
+    assert poll(client, post_id, caught_up, cursor=cursor).status_code == 304
+
+    like = new_like(post_id)
+    changed = poll(other, post_id, caught_up, cursor=cursor)
+    assert changed.status_code == 200
+    assert [row["id"] for row in changed.get_json()["likes"]] == [like.id]
+
+
+def test_an_unlike_changes_the_etag(client, ctx, settled_now):
+    post_id = db.session.scalar(select(Post.id).order_by(Post.id.desc()).limit(1))
+    like = new_like(post_id)
+    before = poll(client, post_id)
+    assert poll(client, post_id, before).status_code == 304
+
+    db.session.delete(like)
+    db.session.commit()
+    after = poll(client, post_id, before)
+    assert after.status_code == 200
+    assert after.get_json()["likes_count"] == before.get_json()["likes_count"] - 1
+
+
+def test_if_modified_since_is_answered_for_the_rows_of_the_request(client, ctx, settled_now):
+    post_id = db.session.scalar(select(Post.id).order_by(Post.id).limit(1).offset(1))
+    new_like(post_id)
+    caught_up = poll(client, post_id)
+    cursor = caught_up.get_json()["cursor"]
+    since = {"If-Modified-Since": caught_up.headers["Last-Modified"]}
+    assert client.get(f"/posts/{post_id}/activity", query_string={"cursor": cursor}, headers=since).status_code == 304
+    # the same validator, but a query that has rows to return
+    older = client.get(f"/posts/{post_id}/activity", query_string={"since": SINCE}, headers=since)
+    assert older.status_code == 200
+    assert older.get_json()["likes"]
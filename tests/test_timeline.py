@@ -0,0 +1,33 @@
+from datetime import datetime, timedelta
+from sqlalchemy import delete, func, select
+from models import db, Post, Follow, TimelineEntry
+from timeline import SQLTimelineStore, fed_since
+
+
+def fill(owner_id, posts):
+    now = datetime.utcnow()
+    db.session.execute(TimelineEntry.__table__.insert(), [
+        {"owner_id": owner_id, "post_id": post_id, "created_at": now - timedelta(minutes=i)}
+        for i, post_id in enumerate(posts)
+    ])
+
+
+def test_trim_caps_the_timelines_that_grew(ctx):
+    latest = db.session.execute(select(Post.id, Post.user_id).order_by(Post.id.desc()).limit(1)).one()
+    follower_id = db.session.scalar(select(Follow.follower_id).where(Follow.following_id == latest.user_id).limit(1))
+    bystander_id = db.session.scalar(
+        select(Follow.follower_id).where(Follow.follower_id.not_in(fed_since(latest.id - 1, 10 ** 9))).limit(1)
+    )
+    posts = db.session.scalars(select(Post.id).order_by(Post.id).limit(5)).all()
+    fill(follower_id, posts)
+    fill(bystander_id, posts)
+    try:
+        assert SQLTimelineStore(capacity=3).trim(fed_since(latest.id - 1, 10 ** 9)) == 2
+
+        def entries(owner_id):
+            return db.session.scalar(select(func.count()).where(TimelineEntry.owner_id == owner_id))
+        assert entries(follower_id) == 3
+        assert entries(bystander_id) == 5
+    finally:
+        db.session.execute(delete(TimelineEntry).where(TimelineEntry.owner_id.in_([follower_id, bystander_id])))
+        db.session.commit()